@@ -0,0 +1,89 @@
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import DateTimeField, Value
+from django.utils import timezone
+
+from .models import (ArchivedRespondentAnswer, ArchivedTakenQuiz, Quiz,
+                     QuizAttempt, RespondentAnswer, TakenQuiz, Watermark)
+from .stats import QUESTION_STATS_WATERMARK, refresh_question_stats
+
+ARCHIVE_TABLES = {
+    'taken_quizzes': TakenQuiz,
+    'respondent_answers': RespondentAnswer,
+    'attempts': QuizAttempt,
+}
+
+
+def live_table_sizes():
+    return {label: model.objects.count() for label, model in ARCHIVE_TABLES.items()}
+
+
+def _copy_rows(queryset, model, fields):
+    # INSERT ... SELECT: строки копируются внутри базы, без загрузки в Python.
+    connection = connections[queryset.db]
+    select_sql, params = queryset.values_list(*fields).query.sql_with_params()
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) {select_sql}', params)
+
+
+def _archive_batch(quiz_id, respondent_ids):
+    taken_quizzes = TakenQuiz.objects.filter(quiz_id=quiz_id, respondent_id__in=respondent_ids)
+    answers = RespondentAnswer.objects.filter(quiz_id=quiz_id, respondent_id__in=respondent_ids)
+    attempts = QuizAttempt.objects.filter(quiz_id=quiz_id, respondent_id__in=respondent_ids)
+
+    _copy_rows(
+        taken_quizzes.annotate(archived_at=Value(timezone.now(), DateTimeField())),
+        ArchivedTakenQuiz, ('id', 'respondent_id', 'quiz_id', 'score', 'date', 'archived_at'))
+    _copy_rows(
+        answers, ArchivedRespondentAnswer,
+        ('id', 'respondent_id', 'answer_id', 'question_id', 'quiz_id', 'is_correct'))
+    # Строки уже скопированы: удаление без сигналов, статистика
+    # и счетчики опроса учитывают архив и не меняются.
+    return {
+        'taken_quizzes': taken_quizzes._raw_delete(taken_quizzes.db),
+        'respondent_answers': answers._raw_delete(answers.db),
+        'attempts': attempts._raw_delete(attempts.db),
+    }
+
+
+def archive_attempts(before, batch_size=None, progress=None):
+
+    '''
+    Переносит в архивные таблицы прохождения опросов, закрытых раньше
+    `before` (`end_date < before`, но не позже сегодняшнего дня), вместе
+    с ответами респондентов; завершенные попытки удаляются. Респонденты
+    обрабатываются пакетами по `batch_size` прохождений, каждый пакет —
+    отдельная транзакция. Переносятся только прохождения, уже учтенные
+    аналитикой вопросов (до водяного знака), поэтому сначала она
+    обновляется. `progress(counts, duration)` вызывается после каждого
+    пакета. Возвращает количество перенесенных строк по таблицам.
+    '''
+
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    before = min(before, timezone.localdate())
+    refresh_question_stats()
+    position = Watermark.objects.filter(name=QUESTION_STATS_WATERMARK).values_list('position', flat=True).first() or 0
+
+    counts = dict.fromkeys(ARCHIVE_TABLES, 0)
+    counts['quizzes'] = 0
+    quiz_ids = Quiz.objects.filter(end_date__lt=before).order_by('pk').values_list('pk', flat=True)
+    for quiz_id in quiz_ids:
+        respondent_ids = list(TakenQuiz.objects
+                              .filter(quiz_id=quiz_id, pk__lte=position)
+                              .order_by('respondent_id')
+                              .values_list('respondent_id', flat=True))
+        if not respondent_ids:
+            continue
+        counts['quizzes'] += 1
+        for start in range(0, len(respondent_ids), batch_size):
+            started = time.perf_counter()
+            with transaction.atomic():
+                moved = _archive_batch(quiz_id, respondent_ids[start:start + batch_size])
+            for label, count in moved.items():
+                counts[label] += count
+            if progress is not None:
+                progress(counts, time.perf_counter() - started)
+    return counts
@@ -0,0 +1,912 @@
+import asyncio
+import datetime
+import random
+import re
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import OperationalError, connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import QUIZ_ROWS_STATS, get_quiz_content, quiz_rows_cache_stats
+from .models import (Answer, Question, Quiz, QuizAttempt, Respondent,
+                     RespondentAnswer, Subject, TakenQuiz, User)
+from .purge import purge_quiz, soft_delete_quiz
+from .stats import (rebuild_quiz_stats, refresh_question_stats,
+                    repair_quiz_counters)
+from .testing import async_views
+
+
+SCALES = {
+    'tiny': dict(moderators=1, subjects=2, quizzes=4, questions=3, answers=3, respondents=10, attempts=1),
+    'small': dict(moderators=2, subjects=5, quizzes=20, questions=5, answers=4, respondents=200, attempts=3),
+    'medium': dict(moderators=10, subjects=10, quizzes=200, questions=10, answers=4, respondents=2000, attempts=5),
+    'large': dict(moderators=50, subjects=20, quizzes=2000, questions=15, answers=5, respondents=20000, attempts=10),
+}
+
+SIGNUP_PASSWORD = 'bench-Pa55word!'
+
+
+class Fixture:
+
+    '''
+    Описание засеянных данных, которое нужно сценариям: пользователи,
+    категории и структура опросов без повторных запросов к базе.
+    '''
+
+    def __init__(self):
+        self.moderator_ids = []
+        self.subject_ids = []
+        self.quiz_ids = defaultdict(list)  # subject_id -> [quiz_id, ...]
+        self.moderator_quizzes = defaultdict(list)  # owner_id -> [quiz_id, ...]
+        self.respondent_ids = []
+        self.counts = {}
+
+
+def seed(moderators, subjects, quizzes, questions, answers, respondents, attempts, seed=0, batch_size=2000):
+
+    '''
+    Засевает базу пакетными вставками: модераторы, категории, опросы
+    с вопросами и ответами, респонденты и их завершенные попытки вместе
+    с ответами. Сигналы при `bulk_create` не срабатывают, поэтому
+    статистика и счетчики опросов в конце пересобираются целиком.
+    '''
+
+    rng = random.Random(seed)
+    fixture = Fixture()
+    today = timezone.localdate()
+
+    with transaction.atomic():
+        moderator_users = User.objects.bulk_create([
+            User(username=f'bench-moderator-{i}', password='!', is_moderator=True) for i in range(moderators)
+        ], batch_size=batch_size)
+        fixture.moderator_ids = [user.pk for user in moderator_users]
+
+        subject_objects = Subject.objects.bulk_create([
+            Subject(name=f'Bench {i}') for i in range(subjects)
+        ], batch_size=batch_size)
+        fixture.subject_ids = [subject.pk for subject in subject_objects]
+
+        quiz_objects = Quiz.objects.bulk_create([
+            Quiz(
+                owner=moderator_users[i % moderators],
+                subject=subject_objects[i % subjects],
+                name=f'Bench quiz {i}',
+                start_date=today - datetime.timedelta(days=30),
+                end_date=today + datetime.timedelta(days=30),
+                single_page=(i % 5 == 4),
+                questions_count=questions,
+            )
+            for i in range(quizzes)
+        ], batch_size=batch_size)
+        for quiz in quiz_objects:
+            fixture.quiz_ids[quiz.subject_id].append(quiz.pk)
+            fixture.moderator_quizzes[quiz.owner_id].append(quiz.pk)
+
+        question_objects = Question.objects.bulk_create([
+            Question(quiz=quiz, text=f'Question {j}') for quiz in quiz_objects for j in range(questions)
+        ], batch_size=batch_size)
+        answer_objects = Answer.objects.bulk_create([
+            Answer(question=question, text=f'Answer {k}', is_correct=(k == 0))
+            for question in question_objects for k in range(answers)
+        ], batch_size=batch_size)
+
+        quiz_content = defaultdict(list)  # quiz_id -> [(question_id, [(answer_id, is_correct), ...]), ...]
+        question_answers = defaultdict(list)
+        for answer in answer_objects:
+            question_answers[answer.question_id].append((answer.pk, answer.is_correct))
+        for question in question_objects:
+            quiz_content[question.quiz_id].append((question.pk, question_answers[question.pk]))
+
+        respondent_users = User.objects.bulk_create([
+            User(username=f'bench-respondent-{i}', password='!', is_respondent=True) for i in range(respondents)
+        ], batch_size=batch_size)
+        respondent_objects = Respondent.objects.bulk_create([
+            Respondent(user=user) for user in respondent_users
+        ], batch_size=batch_size)
+        fixture.respondent_ids = [respondent.pk for respondent in respondent_objects]
+
+        categories = []
+        taken_quizzes = []
+        quiz_attempts = []
+        respondent_answers = []
+        answer_count = 0
+        finished_at = timezone.now()
+        for respondent in respondent_objects:
+            respondent_subjects = rng.sample(fixture.subject_ids, min(rng.randint(1, 3), subjects))
+            categories.extend(
+                Respondent.category.through(respondent_id=respondent.pk, subject_id=subject_id)
+                for subject_id in respondent_subjects
+            )
+            available = [quiz_id for subject_id in respondent_subjects for quiz_id in fixture.quiz_ids[subject_id]]
+            for quiz_id in rng.sample(available, min(attempts, len(available))):
+                correct = 0
+                for question_id, options in quiz_content[quiz_id]:
+                    answer_id, is_correct = rng.choice(options)
+                    correct += is_correct
+                    respondent_answers.append(RespondentAnswer(
+                        respondent_id=respondent.pk, answer_id=answer_id,
+                        question_id=question_id, quiz_id=quiz_id, is_correct=is_correct))
+                total = len(quiz_content[quiz_id])
+                taken_quizzes.append(TakenQuiz(
+                    respondent_id=respondent.pk, quiz_id=quiz_id,
+                    score=round(correct / total * 100.0, 2) if total else 0.0))
+                quiz_attempts.append(QuizAttempt(
+                    respondent_id=respondent.pk, quiz_id=quiz_id,
+                    position=total, correct_count=correct, finished_at=finished_at))
+            if len(respondent_answers) >= batch_size * 10:
+                RespondentAnswer.objects.bulk_create(respondent_answers, batch_size=batch_size)
+                answer_count += len(respondent_answers)
+                respondent_answers = []
+
+        Respondent.category.through.objects.bulk_create(categories, batch_size=batch_size)
+        TakenQuiz.objects.bulk_create(taken_quizzes, batch_size=batch_size)
+        QuizAttempt.objects.bulk_create(quiz_attempts, batch_size=batch_size)
+        RespondentAnswer.objects.bulk_create(respondent_answers, batch_size=batch_size)
+        answer_count += len(respondent_answers)
+        rebuild_quiz_stats()
+        repair_quiz_counters()
+
+    fixture.counts = {
+        'moderators': len(moderator_users),
+        'subjects': len(subject_objects),
+        'quizzes': len(quiz_objects),
+        'questions': len(question_objects),
+        'answers': len(answer_objects),
+        'respondents': len(respondent_objects),
+        'taken_quizzes': len(taken_quizzes),
+        'respondent_answers': answer_count,
+    }
+    return fixture
+
+
+class Recorder:
+
+    '''
+    Потокобезопасный сборщик замеров: время ответа и количество
+    SQL-запросов (из `RequestMetricsMiddleware`) по имени URL,
+    плюс длительность сценариев целиком.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(list)
+        self.scenarios = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, client, method, url, data=None, expected=(200, 302)):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, data)
+        elapsed = time.perf_counter() - start
+        metrics = getattr(response, 'request_metrics', None)
+        name = metrics.url_name if metrics and metrics.url_name else url
+        with self.lock:
+            self.requests[name].append((elapsed, metrics.queries if metrics else None))
+            if response.status_code not in expected:
+                self.errors[name] += 1
+        return response
+
+    def scenario(self, name, elapsed):
+        with self.lock:
+            self.scenarios[name].append(elapsed)
+
+
+def signup(client, recorder, fixture, rng, username):
+    recorder.request(client, 'post', reverse('respondent_signup'), {
+        'username': username,
+        'password1': SIGNUP_PASSWORD,
+        'password2': SIGNUP_PASSWORD,
+        'category': rng.sample(fixture.subject_ids, 1),
+    })
+
+
+def browse(client, recorder, fixture, rng):
+    recorder.request(client, 'get', reverse('respondents:quiz_list'))
+    recorder.request(client, 'get', reverse('respondents:taken_quiz_list'))
+
+
+def take_quiz(client, recorder, fixture, rng, respondent_id):
+
+    '''
+    Полное прохождение одного еще не пройденного опроса: по вопросу
+    за шаг или всей формой сразу для опросов `single_page`.
+    '''
+
+    quiz = Quiz.objects.open() \
+        .filter(subject__category_respondents=respondent_id) \
+        .exclude(taken_quizzes__respondent_id=respondent_id) \
+        .values_list('pk', 'single_page') \
+        .order_by('?') \
+        .first()
+    if quiz is None:
+        return
+    quiz_id, single_page = quiz
+    content = get_quiz_content(quiz_id)
+    url = reverse('respondents:take_quiz', args=[quiz_id])
+
+    start = time.perf_counter()
+    recorder.request(client, 'get', url)
+    position = 0
+    while position < len(content.questions):
+        questions = content.questions[position:] if single_page else content.questions[position:position + 1]
+        recorder.request(client, 'post', url, {
+            f'answer_{question.pk}': rng.choice(question.answers).pk for question in questions
+        })
+        position += len(questions)
+    recorder.scenario('take_quiz', time.perf_counter() - start)
+
+
+def moderate(client, recorder, fixture, rng, moderator_id):
+    recorder.request(client, 'get', reverse('moderators:quiz_change_list'))
+    quizzes = fixture.moderator_quizzes[moderator_id]
+    if quizzes:
+        recorder.request(client, 'get', reverse('moderators:quiz_results', args=[rng.choice(quizzes)]))
+
+
+def worker(number, workers, iterations, signups, fixture, recorder, seed=0, host='localhost'):
+    rng = random.Random(f'{seed}-{number}')
+    client = Client(HTTP_HOST=host, raise_request_exception=False)
+    respondent_ids = fixture.respondent_ids[number::workers]
+    moderator_id = fixture.moderator_ids[number % len(fixture.moderator_ids)]
+    users = User.objects.in_bulk(respondent_ids + [moderator_id])
+    try:
+        for i in range(signups):
+            client.logout()
+            start = time.perf_counter()
+            signup(client, recorder, fixture, rng, f'bench-signup-{seed}-{number}-{i}')
+            recorder.scenario('signup', time.perf_counter() - start)
+
+        for i in range(iterations):
+            respondent_id = respondent_ids[i % len(respondent_ids)]
+            client.force_login(users[respondent_id])
+            start = time.perf_counter()
+            browse(client, recorder, fixture, rng)
+            recorder.scenario('browse', time.perf_counter() - start)
+            take_quiz(client, recorder, fixture, rng, respondent_id)
+
+            client.force_login(users[moderator_id])
+            start = time.perf_counter()
+            moderate(client, recorder, fixture, rng, moderator_id)
+            recorder.scenario('moderate', time.perf_counter() - start)
+    finally:
+        if workers > 1:
+            connections.close_all()
+
+
+def summarize(samples):
+    latencies = sorted(sample * 1000 for sample in samples)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return {
+        'count': len(latencies),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def run(fixture, workers=4, iterations=10, signups=1, seed=0, host='localhost'):
+
+    '''
+    Гоняет сценарии через настоящие URL и всю цепочку middleware
+    в `workers` потоках (каждый со своим клиентом, сессией и соединением
+    с базой) и возвращает отчет с перцентилями, пропускной способностью
+    и количеством запросов к базе. Один поток работает без `threading`,
+    поэтому прогон можно выполнять и внутри `TestCase`.
+    '''
+
+    recorder = Recorder()
+    args = (workers, iterations, signups, fixture, recorder, seed, host)
+    cache_before = quiz_rows_cache_stats()
+    start = time.perf_counter()
+    if workers == 1:
+        worker(0, *args)
+    else:
+        threads = [threading.Thread(target=worker, args=(number, *args)) for number in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    duration = time.perf_counter() - start
+
+    endpoints = {}
+    for name, samples in sorted(recorder.requests.items()):
+        queries = [count for _, count in samples if count is not None]
+        endpoints[name] = summarize([elapsed for elapsed, _ in samples])
+        endpoints[name]['errors'] = recorder.errors[name]
+        if queries:
+            endpoints[name]['mean_queries'] = round(statistics.fmean(queries), 2)
+            endpoints[name]['max_queries'] = max(queries)
+
+    cache_after = quiz_rows_cache_stats()
+    quiz_list_cache = {name: cache_after[name] - cache_before[name] for name in QUIZ_ROWS_STATS}
+    lookups = sum(quiz_list_cache.values())
+    quiz_list_cache['hit_rate'] = round(quiz_list_cache['hits'] / lookups, 4) if lookups else None
+
+    total = sum(len(samples) for samples in recorder.requests.values())
+    return {
+        'duration_s': round(duration, 3),
+        'requests': total,
+        'errors': sum(recorder.errors.values()),
+        'throughput_rps': round(total / duration, 2) if duration else None,
+        'endpoints': endpoints,
+        'scenarios': {name: summarize(samples) for name, samples in sorted(recorder.scenarios.items())},
+        'quiz_list_cache': quiz_list_cache,
+    }
+
+
+def login_sessions(user_ids, host='localhost'):
+    sessions = {}
+    for user in User.objects.filter(pk__in=user_ids):
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        sessions[user.pk] = client.cookies[settings.SESSION_COOKIE_NAME].value
+    return sessions
+
+
+def database_profile():
+    with connection.cursor() as cursor:
+        profile = {}
+        for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'temp_store'):
+            cursor.execute(f'PRAGMA {pragma}')
+            row = cursor.fetchone()
+            profile[pragma] = row[0] if row else None
+    profile['transaction_mode'] = connection.transaction_mode
+    profile['conn_max_age'] = connection.settings_dict['CONN_MAX_AGE']
+    return profile
+
+
+def stress_worker(number, workers, iterations, fixture, sessions, recorder, seed=0, host='localhost'):
+    rng = random.Random(f'stress-{seed}-{number}')
+    client = Client(HTTP_HOST=host, raise_request_exception=False)
+    respondent_ids = fixture.respondent_ids[number::workers][:iterations]
+    try:
+        for i in range(iterations):
+            respondent_id = respondent_ids[i % len(respondent_ids)]
+            client.cookies = SimpleCookie({settings.SESSION_COOKIE_NAME: sessions[respondent_id]})
+            try:
+                take_quiz(client, recorder, fixture, rng, respondent_id)
+            except OperationalError:
+                # Выбор опроса идет мимо представлений, но тоже может упереться в блокировку.
+                recorder.errors['select_quiz'] += 1
+    finally:
+        connections.close_all()
+
+
+def stress_writes(fixture, workers=16, iterations=5, seed=0, host='localhost'):
+
+    '''
+    Много одновременных респондентов проходят опросы до конца:
+    каждый шаг `take_quiz` пишет попытку, ответы и результат.
+    Отчет — записанные ответы в секунду и количество упавших
+    запросов (для SQLite обычно «database is locked»).
+    '''
+
+    respondent_ids = [pk for number in range(workers) for pk in fixture.respondent_ids[number::workers][:iterations]]
+    sessions = login_sessions(respondent_ids, host)
+    answers_before = RespondentAnswer.objects.count()
+    recorder = Recorder()
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=stress_worker, args=(number, workers, iterations, fixture, sessions, recorder, seed, host))
+        for number in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    written = RespondentAnswer.objects.count() - answers_before
+    steps = recorder.requests.get('respondents:take_quiz', [])
+    return {
+        'workers': workers,
+        'database_profile': database_profile(),
+        'duration_s': round(duration, 3),
+        'walkthroughs': len(recorder.scenarios['take_quiz']),
+        'requests': len(steps),
+        'errors': sum(recorder.errors.values()),
+        'answers_written': written,
+        'answers_per_s': round(written / duration, 2) if duration else None,
+        'take_quiz': summarize([elapsed for elapsed, _ in steps]) if steps else None,
+    }
+
+
+class SlowDatabase:
+
+    '''
+    Имитация медленной (например, удаленной) базы: перед каждым
+    SQL-запросом поток засыпает на `delay` секунд. Обертка ставится
+    на все соединения, которые откроются, пока действует контекст.
+    '''
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.install)
+        for connection in connections.all(initialized_only=True):
+            self.install(connection=connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def queries_from_header(value):
+    match = re.search(r'desc="(\d+) queries"', value or '')
+    return int(match.group(1)) if match else None
+
+
+def respondent_sessions(fixture, users, host='localhost'):
+
+    '''
+    Сессии (cookie `sessionid`) и по одному непройденному опросу
+    для первых `users` респондентов.
+    '''
+
+    sessions = []
+    for user in User.objects.filter(pk__in=fixture.respondent_ids[:users]).order_by('pk'):
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        quiz_id = Quiz.objects.open() \
+            .filter(subject__category_respondents=user.pk) \
+            .exclude(taken_quizzes__respondent_id=user.pk) \
+            .values_list('pk', flat=True) \
+            .order_by('pk') \
+            .first()
+        paths = [reverse('respondents:quiz_list'), reverse('respondents:taken_quiz_list')]
+        if quiz_id:
+            paths.append(reverse('respondents:take_quiz', args=[quiz_id]))
+        sessions.append((client.cookies[settings.SESSION_COOKIE_NAME].value, paths))
+    return sessions
+
+
+def compare_summary(samples, duration):
+    latencies = [elapsed for elapsed, _, _ in samples]
+    queries = [count for _, count, _ in samples if count is not None]
+    return {
+        'duration_s': round(duration, 3),
+        'requests': len(samples),
+        'errors': sum(1 for _, _, status in samples if status not in (200, 302)),
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+        'latency': summarize(latencies),
+        'mean_queries': round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+
+def run_wsgi(sessions, threads, rounds, host='localhost'):
+
+    '''
+    Синхронные представления в модели WSGI-сервера: `threads` рабочих
+    потоков обслуживают всех пользователей, каждый пользователь ждет
+    ответа перед следующим запросом. Задержка включает ожидание
+    свободного потока.
+    '''
+
+    local = threading.local()
+
+    def handle(session, path, submitted):
+        if not hasattr(local, 'client'):
+            local.client = Client(HTTP_HOST=host, raise_request_exception=False)
+        local.client.cookies = SimpleCookie({settings.SESSION_COOKIE_NAME: session})
+        response = local.client.get(path)
+        return time.perf_counter() - submitted, response.request_metrics.queries, response.status_code
+
+    samples = []
+    lock = threading.Lock()
+
+    def user(session, paths):
+        for _ in range(rounds):
+            for path in paths:
+                sample = pool.submit(handle, session, path, time.perf_counter()).result()
+                with lock:
+                    samples.append(sample)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        users = [threading.Thread(target=user, args=session) for session in sessions]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+    return compare_summary(samples, time.perf_counter() - start)
+
+
+async def asgi_get(application, path, session, host='localhost'):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (b'host', host.encode()),
+            (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session}'.encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': (host, 80),
+    }
+    received = False
+    response = {}
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается: обработчик отменит ожидание сам.
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.lower(): value for name, value in message['headers']}
+
+    await application(scope, receive, send)
+    server_timing = response['headers'].get(b'server-timing', b'').decode()
+    return response['status'], queries_from_header(server_timing)
+
+
+def run_asgi(sessions, rounds, host='localhost'):
+
+    '''
+    Асинхронные представления под настоящим `ASGIHandler`: все
+    пользователи работают конкурентно в одном цикле событий.
+    '''
+
+    application = ASGIHandler()
+    samples = []
+
+    async def user(session, paths):
+        for _ in range(rounds):
+            for path in paths:
+                submitted = time.perf_counter()
+                status, queries = await asgi_get(application, path, session, host)
+                samples.append((time.perf_counter() - submitted, queries, status))
+
+    async def main():
+        await asyncio.gather(*(user(session, paths) for session, paths in sessions))
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return compare_summary(samples, time.perf_counter() - start)
+
+
+def compare_async(fixture, users=32, threads=4, rounds=5, delay=0.005, host='localhost'):
+
+    '''
+    Сравнение синхронных (WSGI, `threads` потоков) и асинхронных (ASGI)
+    страниц респондента — списков опросов и первого шага `take_quiz` —
+    при `users` одновременных пользователях и медленной базе.
+    '''
+
+    sessions = respondent_sessions(fixture, users, host)
+    with SlowDatabase(delay):
+        with async_views(False):
+            wsgi = run_wsgi(sessions, threads, rounds, host)
+        with async_views(True):
+            asgi = run_asgi(sessions, rounds, host)
+    return {
+        'users': len(sessions),
+        'server_threads': threads,
+        'rounds': rounds,
+        'db_delay_ms': round(delay * 1000, 3),
+        'wsgi_sync_views': wsgi,
+        'asgi_async_views': asgi,
+    }
+
+
+SESSION_CONFIGS = (
+    ('db', 'session'),
+    ('db', 'fallback'),
+    ('cached_db', 'fallback'),
+    ('cache', 'cookie'),
+    ('signed_cookies', 'cookie'),
+)
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def count_writes(queries):
+    writes = session_writes = session_reads = 0
+    for query in queries:
+        sql = query['sql'].lstrip().upper()
+        session = '"DJANGO_SESSION"' in sql
+        if sql.startswith(WRITE_STATEMENTS):
+            writes += 1
+            session_writes += session
+        elif session:
+            session_reads += 1
+    return writes, session_writes, session_reads
+
+
+def session_walkthrough(client, respondent_id, rng):
+
+    '''
+    Проходит один опрос респондентом до конца. Каждый шаг — POST
+    с переходом по редиректу, то есть вместе со страницей, на которой
+    показываются сообщения. Возвращает `(шаги, запросы, время шагов)`.
+    '''
+
+    quiz = Quiz.objects.open() \
+        .filter(subject__category_respondents=respondent_id) \
+        .exclude(taken_quizzes__respondent_id=respondent_id) \
+        .values_list('pk', 'single_page') \
+        .order_by('pk') \
+        .first()
+    if quiz is None:
+        return 0, [], []
+    quiz_id, single_page = quiz
+    content = get_quiz_content(quiz_id)
+    url = reverse('respondents:take_quiz', args=[quiz_id])
+
+    queries, elapsed = [], []
+    with CaptureQueriesContext(connection) as captured:
+        client.get(url)
+    queries.extend(captured)
+    position = steps = 0
+    while position < len(content.questions):
+        questions = content.questions[position:] if single_page else content.questions[position:position + 1]
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as captured:
+            client.post(url, {
+                f'answer_{question.pk}': rng.choice(question.answers).pk for question in questions
+            }, follow=True)
+        elapsed.append(time.perf_counter() - start)
+        queries.extend(captured)
+        position += len(questions)
+        steps += 1
+    return steps, queries, elapsed
+
+
+def compare_sessions(fixture, users=4, seed=0, host='localhost'):
+
+    '''
+    Для каждой пары «хранилище сессий — хранилище сообщений»
+    из `SESSION_CONFIGS` отдельные `users` респондентов проходят по опросу.
+    Отчет — записи в базу (всего и в `django_session`) и чтения
+    `django_session` в пересчете на шаг опроса.
+    '''
+
+    if users * len(SESSION_CONFIGS) > len(fixture.respondent_ids):
+        raise ValueError('Недостаточно респондентов для сравнения хранилищ сессий.')
+
+    rng = random.Random(f'sessions-{seed}')
+    report = {}
+    for number, (session_storage, message_storage) in enumerate(SESSION_CONFIGS):
+        steps = writes = session_writes = session_reads = 0
+        elapsed = []
+        with override_settings(
+            SESSION_ENGINE=settings.SESSION_STORAGES[session_storage],
+            MESSAGE_STORAGE=settings.MESSAGE_STORAGES[message_storage],
+        ):
+            for respondent_id in fixture.respondent_ids[number * users:(number + 1) * users]:
+                # Новый клиент загружает middleware, а значит и SESSION_ENGINE, заново.
+                client = Client(HTTP_HOST=host)
+                client.force_login(User.objects.get(pk=respondent_id))
+                walkthrough_steps, queries, walkthrough_elapsed = session_walkthrough(client, respondent_id, rng)
+                counts = count_writes(queries)
+                steps += walkthrough_steps
+                writes += counts[0]
+                session_writes += counts[1]
+                session_reads += counts[2]
+                elapsed.extend(walkthrough_elapsed)
+        report[f'{session_storage}+{message_storage}'] = {
+            'steps': steps,
+            'writes_per_step': round(writes / steps, 2) if steps else None,
+            'session_writes_per_step': round(session_writes / steps, 2) if steps else None,
+            'session_reads_per_step': round(session_reads / steps, 2) if steps else None,
+            'step': summarize(elapsed) if elapsed else None,
+        }
+    return {'users': users, 'sessions': report}
+
+
+def editor_post_data(questions, answers, suffix, bulk):
+
+    '''
+    Данные POST, в которых у каждого вопроса изменен текст первого
+    ответа: для массового редактора — одна форма на все вопросы,
+    иначе — по форме на вопрос.
+    '''
+
+    forms = []
+    for question in questions:
+        question_prefix = f'question-{question.pk}-' if bulk else ''
+        prefix = f'answers-{question.pk}' if bulk else 'answers'
+        question_answers = answers[question.pk]
+        data = {
+            f'{question_prefix}text': question.text,
+            f'{prefix}-TOTAL_FORMS': len(question_answers),
+            f'{prefix}-INITIAL_FORMS': len(question_answers),
+            f'{prefix}-MIN_NUM_FORMS': 0,
+            f'{prefix}-MAX_NUM_FORMS': 1000,
+        }
+        for i, answer in enumerate(question_answers):
+            data[f'{prefix}-{i}-id'] = answer.pk
+            data[f'{prefix}-{i}-text'] = f'{answer.text} {suffix}' if i == 0 else answer.text
+            if answer.is_correct:
+                data[f'{prefix}-{i}-is_correct'] = 'on'
+        forms.append(data)
+    if bulk:
+        return [{key: value for data in forms for key, value in data.items()}]
+    return forms
+
+
+def timed_request(client, method, url, data=None):
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        response = getattr(client, method)(url, data)
+    if response.status_code >= 400 or (method == 'post' and response.status_code != 302):
+        raise RuntimeError(f'{method.upper()} {url}: {response.status_code}')
+    return time.perf_counter() - start, len(queries)
+
+
+def compare_question_editor(questions=100, answers=4, host='localhost'):
+
+    '''
+    Сравнивает правку первого ответа каждого вопроса опроса из
+    `questions` вопросов: по одному вопросу через `question_change`
+    (GET и POST на вопрос) и всех сразу через массовый редактор.
+    '''
+
+    moderator = User.objects.create(username='bench-editor', password='!', is_moderator=True)
+    quiz = Quiz.objects.create(
+        owner=moderator, subject=Subject.objects.order_by('pk').first(), name='Bench editor', questions_count=questions)
+    question_objects = Question.objects.bulk_create([
+        Question(quiz=quiz, text=f'Question {i}') for i in range(questions)
+    ])
+    Answer.objects.bulk_create([
+        Answer(question=question, text=f'Answer {k}', is_correct=(k == 0))
+        for question in question_objects for k in range(answers)
+    ])
+    answer_map = defaultdict(list)
+    for answer in Answer.objects.filter(question__quiz=quiz).order_by('pk'):
+        answer_map[answer.question_id].append(answer)
+
+    client = Client(HTTP_HOST=host)
+    client.force_login(moderator)
+    report = {'questions': questions, 'answers': answers}
+
+    elapsed = queries = 0
+    for question, data in zip(question_objects, editor_post_data(question_objects, answer_map, 'v1', bulk=False)):
+        url = reverse('moderators:question_change', args=[quiz.pk, question.pk])
+        for method, payload in (('get', None), ('post', data)):
+            request_elapsed, request_queries = timed_request(client, method, url, payload)
+            elapsed += request_elapsed
+            queries += request_queries
+    report['per_question'] = {'requests': questions * 2, 'ms': round(elapsed * 1000, 2), 'queries': queries}
+
+    url = reverse('moderators:questions_bulk_change', args=[quiz.pk])
+    get_elapsed, get_queries = timed_request(client, 'get', url)
+    [data] = editor_post_data(question_objects, answer_map, 'v2', bulk=True)
+    post_elapsed, post_queries = timed_request(client, 'post', url, data)
+    report['bulk'] = {
+        'requests': 2,
+        'ms': round((get_elapsed + post_elapsed) * 1000, 2),
+        'queries': get_queries + post_queries,
+        'get_ms': round(get_elapsed * 1000, 2),
+        'post_ms': round(post_elapsed * 1000, 2),
+    }
+    return report
+
+
+def purge_fixture(moderator, subject, respondents, questions, answers, name, batch_size=5000):
+    quiz = Quiz.objects.create(
+        owner=moderator, subject=subject, name=name, questions_count=questions, taken_count=len(respondents))
+    question_objects = Question.objects.bulk_create([
+        Question(quiz=quiz, text=f'Question {i}') for i in range(questions)
+    ])
+    answer_objects = Answer.objects.bulk_create([
+        Answer(question=question, text=f'Answer {k}', is_correct=(k == 0))
+        for question in question_objects for k in range(answers)
+    ])
+    respondent_answers = []
+    taken_quizzes = []
+    for i, respondent in enumerate(respondents):
+        correct = 0
+        for j, question in enumerate(question_objects):
+            answer = answer_objects[j * answers + (i + j) % answers]
+            correct += answer.is_correct
+            respondent_answers.append(RespondentAnswer(
+                respondent=respondent, answer=answer, question=question, quiz=quiz, is_correct=answer.is_correct))
+        taken_quizzes.append(TakenQuiz(respondent=respondent, quiz=quiz, score=round(correct / questions * 100.0, 2)))
+    RespondentAnswer.objects.bulk_create(respondent_answers, batch_size=batch_size)
+    TakenQuiz.objects.bulk_create(taken_quizzes, batch_size=batch_size)
+    rebuild_quiz_stats([quiz.pk])
+    return quiz
+
+
+def measure(function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def compare_purge(respondents=5000, questions=20, answers=4, batch_size=None):
+
+    '''
+    Сравнивает удаление двух одинаковых опросов (`respondents` прохождений
+    по `questions` вопросов): каскадом Django одной транзакцией и очисткой
+    `purge_quiz` пакетами. Для каждого способа — общее время, пиковая
+    память Python и самая долгая транзакция (время блокировки записи).
+    '''
+
+    moderator = User.objects.create(username='bench-purge', password='!', is_moderator=True)
+    subject = Subject.objects.order_by('pk').first()
+    users = User.objects.bulk_create([
+        User(username=f'bench-purge-{i}', password='!', is_respondent=True) for i in range(respondents)
+    ])
+    respondent_objects = Respondent.objects.bulk_create([Respondent(user=user) for user in users])
+    cascade_quiz = purge_fixture(moderator, subject, respondent_objects, questions, answers, 'Bench cascade')
+    purge_quiz_object = purge_fixture(moderator, subject, respondent_objects, questions, answers, 'Bench purge')
+    refresh_question_stats()
+    report = {
+        'respondents': respondents,
+        'questions': questions,
+        'answers': answers,
+        'rows': respondents * (questions + 1) + questions * (answers + 1),
+    }
+
+    (deleted, _), elapsed, peak = measure(cascade_quiz.delete)
+    report['cascade'] = {
+        'ms': round(elapsed * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+        'lock_ms': round(elapsed * 1000, 2),
+        'deleted': deleted,
+    }
+
+    batches = []
+
+    def purge():
+        soft_delete_quiz(purge_quiz_object)
+        return purge_quiz(purge_quiz_object.pk, batch_size=batch_size,
+                          progress=lambda counts, duration: batches.append(duration))
+
+    counts, elapsed, peak = measure(purge)
+    report['purge'] = {
+        'ms': round(elapsed * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+        'lock_ms': round(max(batches, default=0) * 1000, 2),
+        'batches': len(batches),
+        'deleted': sum(counts.values()),
+    }
+    return report
@@ -0,0 +1,375 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .metrics import current_metrics
+from .models import Answer, Question, Quiz, Subject
+
+
+class AnswerContent(namedtuple('AnswerContent', 'pk text is_correct')):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.text
+
+
+class QuestionContent(namedtuple('QuestionContent', 'pk text answers')):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.text
+
+
+class QuizContent(namedtuple('QuizContent', 'quiz_id version questions')):
+
+    '''
+    Неизменяемый снимок содержимого опроса: вопросы и ответы,
+    упорядоченные по тексту так же, как их показывает `take_quiz`.
+    Снимок одинаков для всех респондентов и хранится в общем кэше.
+    '''
+
+    __slots__ = ()
+
+    @property
+    def answer_questions(self):
+        return {answer.pk: question.pk for question in self.questions for answer in question.answers}
+
+    @property
+    def correct_answer_ids(self):
+        return [answer.pk for question in self.questions for answer in question.answers if answer.is_correct]
+
+
+def _version_key(quiz_id):
+    return f'quiz-content-version:{quiz_id}'
+
+
+def _content_key(quiz_id, version):
+    return f'quiz-content:{quiz_id}:{version}'
+
+
+def get_quiz_content_version(quiz_id):
+    key = _version_key(quiz_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_quiz_content_version(quiz_id):
+    key = _version_key(quiz_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def invalidate_quiz_content(quiz_id):
+
+    '''
+    Переводит опрос на новую версию содержимого. Старый снимок
+    не удаляется явно: он просто перестает быть доступным и истекает сам.
+    Вызывать после фиксации транзакции, иначе параллельный запрос
+    может закэшировать незафиксированные (или уже устаревшие) данные.
+    '''
+
+    cache.set(_version_key(quiz_id), time.time_ns(), None)
+
+
+def build_quiz_content(quiz_id, version=None):
+    # Как и строки списка опросов, снимок читается только с основной базы.
+    answers = {}
+    answer_rows = Answer.objects.db_manager(DEFAULT_DB_ALIAS) \
+        .filter(question__quiz_id=quiz_id) \
+        .order_by('text', 'pk') \
+        .values_list('pk', 'question_id', 'text', 'is_correct')
+    for pk, question_id, text, is_correct in answer_rows:
+        answers.setdefault(question_id, []).append(AnswerContent(pk, text, is_correct))
+
+    question_rows = Question.objects.db_manager(DEFAULT_DB_ALIAS) \
+        .filter(quiz_id=quiz_id) \
+        .order_by('text', 'pk') \
+        .values_list('pk', 'text')
+    questions = tuple(QuestionContent(pk, text, tuple(answers.get(pk, ()))) for pk, text in question_rows)
+    return QuizContent(quiz_id, version, questions)
+
+
+def get_quiz_content(quiz_id):
+    version = get_quiz_content_version(quiz_id)
+    key = _content_key(quiz_id, version)
+    content = cache.get(key)
+    if content is None:
+        content = build_quiz_content(quiz_id, version)
+        cache.set(key, content, settings.QUIZ_CONTENT_CACHE_TIMEOUT)
+    return content
+
+
+async def aget_quiz_content(quiz_id):
+    version = await aget_quiz_content_version(quiz_id)
+    key = _content_key(quiz_id, version)
+    content = await cache.aget(key)
+    if content is None:
+        # Промах бывает редко, сборку снимка достаточно выполнить в потоке.
+        content = await sync_to_async(build_quiz_content)(quiz_id, version)
+        await cache.aset(key, content, settings.QUIZ_CONTENT_CACHE_TIMEOUT)
+    return content
+
+
+class SubjectContent(namedtuple('SubjectContent', 'pk name color badge')):
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+class SubjectRegistry:
+
+    '''
+    Справочник категорий. Категорий мало и они почти не меняются,
+    поэтому список вместе с готовыми HTML-бейджами хранится в общем кэше
+    и дополнительно в памяти процесса. При каждом обращении сверяется
+    только номер версии в общем кэше; сигналы сохранения и удаления
+    `Subject` переводят справочник на новую версию.
+    '''
+
+    version_key = 'subjects-version'
+
+    def __init__(self):
+        # Пара (версия, категории) заменяется целиком одним присваиванием.
+        self._state = (None, {})
+
+    def _current_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, time.time_ns(), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def _load(self):
+        version = self._current_version()
+        loaded_version, loaded = self._state
+        if version == loaded_version:
+            return loaded
+        return self._fetch(version)
+
+    async def _aload(self):
+        version = await cache.aget(self.version_key)
+        loaded_version, loaded = self._state
+        if version is not None and version == loaded_version:
+            return loaded
+        return await sync_to_async(self._load)()
+
+    def _fetch(self, version):
+        key = f'subjects:{version}'
+        subjects = cache.get(key)
+        if subjects is None:
+            subjects = tuple(
+                SubjectContent(subject.pk, subject.name, subject.color, subject.get_html_badge())
+                for subject in Subject.objects.order_by('pk')
+            )
+            cache.set(key, subjects, settings.SUBJECT_CACHE_TIMEOUT)
+        loaded = {subject.pk: subject for subject in subjects}
+        self._state = (version, loaded)
+        return loaded
+
+    def all(self):
+        return list(self._load().values())
+
+    def get(self, pk):
+        return self._load().get(pk)
+
+    def filter(self, pks):
+        subjects = self._load()
+        return [subjects[pk] for pk in sorted(pks) if pk in subjects]
+
+    async def afilter(self, pks):
+        subjects = await self._aload()
+        return [subjects[pk] for pk in sorted(pks) if pk in subjects]
+
+    def choices(self):
+        return [(subject.pk, subject.name) for subject in self.all()]
+
+    def badge(self, pk):
+        subject = self.get(pk)
+        return subject.badge if subject else ''
+
+    def version(self):
+        return self._current_version()
+
+    async def aversion(self):
+        version = await cache.aget(self.version_key)
+        if version is None:
+            version = await sync_to_async(self._current_version)()
+        return version
+
+    def invalidate(self):
+        cache.set(self.version_key, time.time_ns(), None)
+        self._state = (None, {})
+
+
+subjects = SubjectRegistry()
+
+
+class QuizRow(namedtuple('QuizRow', 'pk name subject_id questions_count taken_count start_date end_date is_active html')):
+
+    '''
+    Строка списка доступных опросов респондента вместе с готовым HTML
+    (`account/respondents/_quiz_row.html`). Поля `name`, `pk` и
+    `taken_count` нужны постраничной навигации по ключу.
+    '''
+
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+QUIZ_ROWS_STATS = ('hits', 'misses')
+
+# Счетчики попаданий держатся в памяти процесса: запись в общий кэш
+# на каждый запрос списка стоила бы дороже самого попадания.
+_quiz_rows_stats = dict.fromkeys(QUIZ_ROWS_STATS, 0)
+_quiz_rows_stats_lock = threading.Lock()
+
+
+def _subject_quizzes_version_key(subject_id):
+    return f'subject-quizzes-version:{subject_id}'
+
+
+def _quiz_rows_key(subject_ids, versions, subjects_version, date):
+    # Ключ не должен зависеть от количества категорий (лимит длины ключа memcached).
+    digest = hashlib.md5(
+        ';'.join(f'{pk}:{versions[pk]}' for pk in subject_ids).encode(), usedforsecurity=False
+    ).hexdigest()
+    # Номер формата меняется вместе с полями `QuizRow`.
+    return f'quiz-rows:2:{date.isoformat()}:{subjects_version}:{digest}'
+
+
+def _fill_versions(keys, found):
+    missing = {key: time.time_ns() for key in keys if key not in found}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        found.update(cache.get_many(missing))
+    return found
+
+
+def get_subject_quizzes_versions(subject_ids):
+    keys = {_subject_quizzes_version_key(pk): pk for pk in subject_ids}
+    found = _fill_versions(keys, cache.get_many(keys))
+    return {pk: found[key] for key, pk in keys.items()}
+
+
+async def aget_subject_quizzes_versions(subject_ids):
+    keys = {_subject_quizzes_version_key(pk): pk for pk in subject_ids}
+    found = await cache.aget_many(keys)
+    if len(found) < len(keys):
+        found = await sync_to_async(_fill_versions)(keys, found)
+    return {pk: found[key] for key, pk in keys.items()}
+
+
+def invalidate_subject_quizzes(*subject_ids):
+
+    '''
+    Переводит закэшированные списки опросов этих категорий на новую
+    версию. Как и `invalidate_quiz_content`, вызывать после фиксации
+    транзакции.
+    '''
+
+    version = time.time_ns()
+    cache.set_many({_subject_quizzes_version_key(pk): version for pk in set(subject_ids) if pk is not None}, None)
+
+
+def build_quiz_rows(subject_ids, date):
+
+    '''
+    Открытые на дату `date` опросы категорий `subject_ids` с вопросами,
+    отсортированные по `(name, pk)`. Читается всегда основная база:
+    снимок с отстающей реплики остался бы в кэше до следующей смены версии.
+    Счетчик прохождений в снимке не обновляется при каждом прохождении,
+    а берется на момент построения.
+    '''
+
+    template = get_template('account/respondents/_quiz_row.html')
+    quizzes = Quiz.objects.db_manager(DEFAULT_DB_ALIAS) \
+        .open(date) \
+        .filter(subject_id__in=subject_ids, questions_count__gt=0) \
+        .order_by('name', 'pk') \
+        .values_list('pk', 'name', 'subject_id', 'questions_count', 'taken_count', 'start_date', 'end_date', 'is_active')
+    rows = []
+    for values in quizzes:
+        row = QuizRow(*values, html='')
+        rows.append(row._replace(html=mark_safe(template.render({'quiz': row}))))
+    return tuple(rows)
+
+
+def _record_quiz_rows(hit):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.record_cache(hit)
+    with _quiz_rows_stats_lock:
+        _quiz_rows_stats['hits' if hit else 'misses'] += 1
+
+
+def get_quiz_rows(subject_ids, date=None):
+
+    '''
+    Строки списка опросов для набора категорий. Список одинаков
+    для всех респондентов с теми же категориями, поэтому хранится
+    в общем кэше; ключ включает дату, версию справочника категорий
+    (бейджи) и версии списков каждой категории. Пройденные респондентом
+    опросы исключает вызывающий код.
+    '''
+
+    date = date or timezone.localdate()
+    subject_ids = sorted(set(subject_ids))
+    key = _quiz_rows_key(subject_ids, get_subject_quizzes_versions(subject_ids), subjects.version(), date)
+    rows = cache.get(key)
+    _record_quiz_rows(hit=rows is not None)
+    if rows is None:
+        rows = build_quiz_rows(subject_ids, date)
+        cache.set(key, rows, settings.QUIZ_LIST_CACHE_TIMEOUT)
+    return rows
+
+
+async def aget_quiz_rows(subject_ids, date=None):
+    date = date or timezone.localdate()
+    subject_ids = sorted(set(subject_ids))
+    versions = await aget_subject_quizzes_versions(subject_ids)
+    key = _quiz_rows_key(subject_ids, versions, await subjects.aversion(), date)
+    rows = await cache.aget(key)
+    _record_quiz_rows(hit=rows is not None)
+    if rows is None:
+        rows = await sync_to_async(build_quiz_rows)(subject_ids, date)
+        await cache.aset(key, rows, settings.QUIZ_LIST_CACHE_TIMEOUT)
+    return rows
+
+
+def quiz_rows_cache_stats():
+
+    '''
+    Счетчики попаданий и промахов кэша списков опросов для мониторинга,
+    с запуска текущего процесса. Попадания и промахи каждого запроса
+    также попадают в журнал метрик запросов (`account.metrics`).
+    '''
+
+    with _quiz_rows_stats_lock:
+        stats = dict(_quiz_rows_stats)
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / total, 4) if total else None
+    return stats
+
+
+def reset_quiz_rows_cache_stats():
+    with _quiz_rows_stats_lock:
+        _quiz_rows_stats.update(dict.fromkeys(QUIZ_ROWS_STATS, 0))
@@ -0,0 +1,55 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import RespondentAnswer
+
+
+RESULT_COLUMNS = ('respondent', 'date', 'score')
+ANSWER_COLUMNS = ('respondent', 'question', 'answer', 'is_correct')
+
+
+class Echo:
+
+    '''
+    Псевдобуфер для `csv.writer`: вместо накопления строк
+    сразу возвращает записанное значение.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def result_rows(quiz):
+    return quiz.taken_quizzes \
+        .order_by('pk') \
+        .values_list('respondent__user__username', 'date', 'score') \
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def answer_rows(quiz):
+    return RespondentAnswer.objects \
+        .filter(quiz=quiz) \
+        .order_by('pk') \
+        .values_list('respondent__user__username', 'question__text', 'answer__text', 'is_correct') \
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(columns, rows):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', stream_csv),
+    'ndjson': ('application/x-ndjson; charset=utf-8', stream_ndjson),
+}
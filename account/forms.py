@@ -3,8 +3,8 @@ from django.contrib.auth.forms import UserCreationForm
 from django.db import transaction
 from django.core.exceptions import ValidationError
 
-from account.models import (Answer, Question, Respondent, RespondentAnswer,
-                              Subject, User)
+from account.cache import subjects
+from account.models import Answer, Question, Respondent, RespondentAnswer, User
 
 
 class ModeratorSignUpForm(UserCreationForm):
@@ -20,8 +20,9 @@ class ModeratorSignUpForm(UserCreationForm):
 
 
 class RespondentSignUpForm(UserCreationForm):
-    category = forms.ModelMultipleChoiceField(
-        queryset=Subject.objects.all(),
+    category = forms.TypedMultipleChoiceField(
+        choices=subjects.choices,
+        coerce=int,
         widget=forms.CheckboxSelectMultiple,
         required=True
     )
@@ -40,12 +41,33 @@ class RespondentSignUpForm(UserCreationForm):
 
 
 class RespondentCategoryForm(forms.ModelForm):
+
+    '''
+    Варианты категорий берутся из справочника `account.cache.subjects`,
+    а выбранные категории — из промежуточной таблицы, поэтому форма
+    не читает таблицу `Subject`.
+    '''
+
+    category = forms.TypedMultipleChoiceField(
+        label='Категории',
+        choices=subjects.choices,
+        coerce=int,
+        widget=forms.CheckboxSelectMultiple
+    )
+
     class Meta:
         model = Respondent
-        fields = ('category', )
-        widgets = {
-            'category': forms.CheckboxSelectMultiple
-        }
+        fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial.setdefault('category', self.instance.get_category_ids())
+
+    def save(self, commit=True):
+        respondent = super().save(commit)
+        if commit:
+            respondent.category.set(self.cleaned_data['category'])
+        return respondent
 
 
 class QuestionForm(forms.ModelForm):
@@ -54,6 +76,13 @@ class QuestionForm(forms.ModelForm):
         fields = ('text', )
 
 
+# Ограничения на варианты ответа к вопросу: общие для редактора вопроса
+# и для импорта опросов из файла.
+ANSWERS_MIN_NUM = 2
+ANSWERS_MAX_NUM = 10
+NO_CORRECT_ANSWER_MESSAGE = 'Отметьте хотя бы один ответ как правильный.'
+
+
 class BaseAnswerInlineFormSet(forms.BaseInlineFormSet):
     def clean(self):
         super().clean()
@@ -65,21 +94,122 @@ class BaseAnswerInlineFormSet(forms.BaseInlineFormSet):
                     has_one_correct_answer = True
                     break
         if not has_one_correct_answer:
-            raise ValidationError('Отметьте хотя бы один ответ как правильный.', code='no_correct_answer')
+            raise ValidationError(NO_CORRECT_ANSWER_MESSAGE, code='no_correct_answer')
 
 
-class TakeQuizForm(forms.ModelForm):
-    answer = forms.ModelChoiceField(
-        queryset=Answer.objects.none(),
-        widget=forms.RadioSelect(),
-        required=True,
-        empty_label=None)
+class PreloadedChoiceField(forms.ModelChoiceField):
 
-    class Meta:
-        model = RespondentAnswer
-        fields = ('answer', )
+    '''
+    Скрытое поле `id` формы набора, которое проверяет первичный ключ
+    по заранее загруженным объектам, а не запросом к базе на каждую форму.
+    '''
+
+    def __init__(self, objects, *args, **kwargs):
+        self.objects = objects
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class PreloadedAnswerInlineFormSet(BaseAnswerInlineFormSet):
+
+    '''
+    Набор форм ответов одного вопроса по уже загруженному списку
+    ответов `answers`: массовый редактор загружает ответы всех вопросов
+    опроса одним запросом и не делает запросов на каждый вопрос.
+    '''
+
+    def __init__(self, *args, answers, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queryset = answers
+        self._object_dict = {answer.pk: answer for answer in answers}
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        field = form.fields[self._pk_field.name]
+        form.fields[self._pk_field.name] = PreloadedChoiceField(
+            self._object_dict, field.queryset, initial=field.initial, required=False, widget=field.widget)
+
+
+# Классы наборов форм строятся один раз при импорте модуля.
+AnswerFormSet = forms.inlineformset_factory(
+    Question,
+    Answer,
+    formset=BaseAnswerInlineFormSet,
+    fields=('text', 'is_correct'),
+    min_num=ANSWERS_MIN_NUM,
+    validate_min=True,
+    max_num=ANSWERS_MAX_NUM,
+    validate_max=True
+)
+
+BulkAnswerFormSet = forms.inlineformset_factory(
+    Question,
+    Answer,
+    formset=PreloadedAnswerInlineFormSet,
+    fields=('text', 'is_correct'),
+    extra=1,
+    min_num=ANSWERS_MIN_NUM,
+    validate_min=True,
+    max_num=ANSWERS_MAX_NUM,
+    validate_max=True
+)
+
+
+class QuizImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл с опросами',
+        help_text='JSON или CSV (quiz, subject, start_date, end_date, question, answer, is_correct).')
+
+
+class TakeQuizForm(forms.Form):
+
+    '''
+    Форма ответов на один или несколько вопросов опроса: по полю
+    с вариантами на каждый вопрос. Варианты берутся из снимка содержимого
+    опроса (`account.cache.QuestionContent`), поэтому ни отрисовка,
+    ни проверка формы не обращаются к таблице ответов.
+    '''
 
     def __init__(self, *args, **kwargs):
-        question = kwargs.pop('question')
+        self.questions = kwargs.pop('questions')
         super().__init__(*args, **kwargs)
-        self.fields['answer'].queryset = question.answers.order_by('text')
+        for question in self.questions:
+            self.fields[self.field_name(question)] = forms.TypedChoiceField(
+                label=question.text,
+                choices=[(answer.pk, answer.text) for answer in question.answers],
+                coerce=int,
+                widget=forms.RadioSelect(),
+                required=True)
+
+    @staticmethod
+    def field_name(question):
+        return f'answer_{question.pk}'
+
+    def selected_answers(self):
+        selected = []
+        for question in self.questions:
+            answer_pk = self.cleaned_data[self.field_name(question)]
+            selected.append((question, next(answer for answer in question.answers if answer.pk == answer_pk)))
+        return selected
+
+    @property
+    def correct_count(self):
+        return sum(answer.is_correct for _, answer in self.selected_answers())
+
+    def save(self, respondent, quiz):
+        return RespondentAnswer.objects.bulk_create([
+            RespondentAnswer(
+                respondent=respondent,
+                answer_id=answer.pk,
+                question_id=question.pk,
+                quiz_id=quiz.pk,
+                is_correct=answer.is_correct)
+            for question, answer in self.selected_answers()
+        ])
@@ -0,0 +1,183 @@
+import csv
+import io
+import json
+import os
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache import invalidate_subject_quizzes
+from .forms import ANSWERS_MAX_NUM, ANSWERS_MIN_NUM, NO_CORRECT_ANSWER_MESSAGE
+from .models import Answer, Question, Quiz, Subject
+
+
+CSV_COLUMNS = ('quiz', 'subject', 'start_date', 'end_date', 'question', 'answer', 'is_correct')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'да', '+'}
+
+
+def parse_json(text):
+
+    '''
+    Формат JSON: `{"quizzes": [{"name", "subject", "start_date", "end_date",
+    "is_active", "single_page", "questions": [{"text", "answers":
+    [{"text", "is_correct"}]}]}]}` или просто список опросов.
+    '''
+
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ValidationError(f'Некорректный JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('quizzes')
+    if not isinstance(data, list):
+        raise ValidationError('Ожидается список опросов.')
+    return data
+
+
+def parse_csv(text):
+
+    '''
+    Формат CSV: по строке на каждый вариант ответа. Строки с одинаковыми
+    `quiz` и `question` собираются в один вопрос в порядке появления.
+    '''
+
+    reader = csv.DictReader(io.StringIO(text))
+    missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+    missing.discard('start_date')
+    missing.discard('end_date')
+    if missing:
+        raise ValidationError(f'В CSV нет столбцов: {", ".join(sorted(missing))}.')
+
+    quizzes = {}
+    for row in reader:
+        quiz = quizzes.setdefault(row['quiz'], {
+            'name': row['quiz'],
+            'subject': row['subject'],
+            'questions': {},
+        })
+        for field in ('start_date', 'end_date'):
+            if row.get(field):
+                quiz[field] = row[field]
+        question = quiz['questions'].setdefault(row['question'], {'text': row['question'], 'answers': []})
+        question['answers'].append({
+            'text': row['answer'],
+            'is_correct': (row['is_correct'] or '').strip().lower() in TRUE_VALUES,
+        })
+    for quiz in quizzes.values():
+        quiz['questions'] = list(quiz['questions'].values())
+    return list(quizzes.values())
+
+
+def parse_quiz_file(content, filename):
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValidationError('Файл должен быть в кодировке UTF-8.')
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.json':
+        return parse_json(content)
+    if extension == '.csv':
+        return parse_csv(content)
+    raise ValidationError('Поддерживаются только файлы .json и .csv.')
+
+
+def _clean(instance, exclude, location, errors):
+    try:
+        instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+    except ValidationError as e:
+        for field, messages in e.message_dict.items():
+            for message in messages:
+                errors.append(f'{location}, {field}: {message}')
+
+
+def build_quizzes(data, owner):
+
+    '''
+    Проверяет весь файл целиком и возвращает несохраненные объекты
+    `[(quiz, [(question, [answer, ...]), ...]), ...]`. Все ошибки
+    собираются в одно `ValidationError`, чтобы автор исправил файл за раз.
+    '''
+
+    subjects = {subject.name: subject for subject in Subject.objects.all()}
+    errors = []
+    quizzes = []
+
+    for quiz_number, quiz_data in enumerate(data, start=1):
+        location = f'Опрос {quiz_number}'
+        if not isinstance(quiz_data, dict):
+            errors.append(f'{location}: ожидается объект.')
+            continue
+        subject = subjects.get(quiz_data.get('subject'))
+        if subject is None:
+            errors.append(f'{location}: неизвестная категория «{quiz_data.get("subject")}».')
+        quiz = Quiz(owner=owner, subject=subject, name=quiz_data.get('name') or '')
+        for field in ('start_date', 'end_date', 'is_active', 'single_page'):
+            if field in quiz_data:
+                setattr(quiz, field, quiz_data[field])
+        _clean(quiz, ['owner', 'subject'], location, errors)
+
+        questions = []
+        for question_number, question_data in enumerate(quiz_data.get('questions') or [], start=1):
+            question_location = f'{location}, вопрос {question_number}'
+            if not isinstance(question_data, dict):
+                errors.append(f'{question_location}: ожидается объект.')
+                continue
+            question = Question(text=question_data.get('text') or '')
+            _clean(question, ['quiz'], question_location, errors)
+
+            answers = []
+            for answer_data in question_data.get('answers') or []:
+                if not isinstance(answer_data, dict):
+                    errors.append(f'{question_location}: ответ должен быть объектом.')
+                    continue
+                answer = Answer(text=answer_data.get('text') or '', is_correct=bool(answer_data.get('is_correct')))
+                _clean(answer, ['question'], question_location, errors)
+                answers.append(answer)
+            if not ANSWERS_MIN_NUM <= len(answers) <= ANSWERS_MAX_NUM:
+                errors.append(f'{question_location}: должно быть от {ANSWERS_MIN_NUM} до {ANSWERS_MAX_NUM} ответов.')
+            if not any(answer.is_correct for answer in answers):
+                errors.append(f'{question_location}: {NO_CORRECT_ANSWER_MESSAGE}')
+            questions.append((question, answers))
+
+        if not questions:
+            errors.append(f'{location}: нет ни одного вопроса.')
+        quizzes.append((quiz, questions))
+
+    if errors:
+        raise ValidationError(errors)
+    return quizzes
+
+
+def import_quizzes(data, owner, batch_size=1000):
+
+    '''
+    Сохраняет опросы тремя пакетами `bulk_create` (опросы, вопросы,
+    ответы) в одной транзакции. Сигналы не отправляются, поэтому счетчик
+    вопросов заполняется заранее. Возвращает список созданных опросов.
+    '''
+
+    quizzes = build_quizzes(data, owner)
+    for quiz, quiz_questions in quizzes:
+        quiz.questions_count = len(quiz_questions)
+    with transaction.atomic():
+        created = Quiz.objects.bulk_create([quiz for quiz, _ in quizzes], batch_size=batch_size)
+
+        questions = []
+        for quiz, quiz_questions in quizzes:
+            for question, _ in quiz_questions:
+                question.quiz = quiz
+                questions.append(question)
+        Question.objects.bulk_create(questions, batch_size=batch_size)
+
+        answers = []
+        for _, quiz_questions in quizzes:
+            for question, question_answers in quiz_questions:
+                for answer in question_answers:
+                    answer.question = question
+                    answers.append(answer)
+        Answer.objects.bulk_create(answers, batch_size=batch_size)
+        # `bulk_create` не отправляет сигналы сохранения.
+        subject_ids = {quiz.subject_id for quiz in created}
+        transaction.on_commit(lambda: invalidate_subject_quizzes(*subject_ids))
+    return created
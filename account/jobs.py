@@ -0,0 +1,185 @@
+import json
+import logging
+import traceback
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import collect_metrics
+from .models import Job
+from .purge import purge_quiz
+from .stats import (rebuild_quiz_stats, recompute_scores,
+                    refresh_question_stats)
+
+logger = logging.getLogger('account.jobs')
+
+JOBS = {}
+
+_current_job = ContextVar('current_job', default=None)
+
+
+def register(name):
+
+    '''
+    Регистрирует обработчик фоновой задачи под именем `name`. Обработчик
+    получает параметры задачи как именованные аргументы и возвращает
+    результат, сериализуемый в JSON.
+    '''
+
+    def decorator(handler):
+        JOBS[name] = handler
+        return handler
+    return decorator
+
+
+def enqueue(name, owner=None, max_attempts=None, unique=False, **params):
+
+    '''
+    Ставит задачу в очередь. С `unique=True` возвращает уже ожидающую
+    задачу с тем же именем, владельцем и параметрами, поэтому повторное
+    нажатие кнопки не создает дубликат. Выполняющаяся задача не
+    учитывается: она могла прочитать данные до изменения.
+    '''
+
+    if name not in JOBS:
+        raise KeyError(f'Неизвестная задача: {name}')
+    if unique:
+        job = Job.objects \
+            .filter(name=name, owner=owner, params=params, status=Job.QUEUED) \
+            .order_by('pk') \
+            .first()
+        if job is not None:
+            return job
+    return Job.objects.create(
+        name=name, owner=owner, params=params,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+
+
+def claim_next_job():
+
+    '''
+    Забирает самую старую готовую к выполнению задачу. Перевод в статус
+    `running` — условное обновление, поэтому несколько процессов
+    `run_workers` не получат одну задачу дважды.
+    '''
+
+    while True:
+        now = timezone.now()
+        pk = Job.objects \
+            .filter(status=Job.QUEUED, run_after__lte=now) \
+            .order_by('run_after', 'pk') \
+            .values_list('pk', flat=True) \
+            .first()
+        if pk is None:
+            return None
+        claimed = Job.objects \
+            .filter(pk=pk, status=Job.QUEUED) \
+            .update(status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+
+
+def report_progress(data):
+
+    '''
+    Сохраняет промежуточный результат выполняющейся задачи, чтобы
+    страница задачи показывала прогресс. Вне задачи ничего не делает.
+    '''
+
+    job_id = _current_job.get()
+    if job_id is not None:
+        Job.objects.filter(pk=job_id).update(result=data)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def execute_job(job_id):
+
+    '''
+    Выполняет забранную задачу и сохраняет результат, ошибку и показатели.
+    Вызывается в процессах пула `run_workers`. Исключение обработчика
+    возвращает задачу в очередь с задержкой `JOB_RETRY_DELAY * 2**(n-1)`,
+    пока не исчерпаны попытки. Возвращает итоговый статус.
+    '''
+
+    job = Job.objects.get(pk=job_id)
+    handler = JOBS.get(job.name)
+    token = _current_job.set(job.pk)
+    try:
+        with collect_metrics(f'job:{job.name}') as metrics:
+            if handler is None:
+                raise KeyError(f'Неизвестная задача: {job.name}')
+            result = handler(**job.params)
+    except Exception:
+        job.error = traceback.format_exc()
+        if handler is not None and job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = Job.FAILED
+    else:
+        job.status = Job.DONE
+        job.result = result
+        job.error = ''
+    finally:
+        _current_job.reset(token)
+
+    job.finished_at = timezone.now()
+    job.metrics = metrics.as_dict()
+    job.metrics['wait_ms'] = round((job.started_at - job.created_at).total_seconds() * 1000, 2)
+    job.save(update_fields=['status', 'run_after', 'result', 'error', 'finished_at', 'metrics'])
+    log_job(job)
+    return job.status
+
+
+def log_job(job):
+    data = dict(job.metrics, job=job.pk, status=job.status, attempt=job.attempts)
+    level = logging.INFO if job.status == Job.DONE else logging.WARNING
+    logger.log(level, json.dumps(data, ensure_ascii=False), extra={'metrics': data})
+
+
+def requeue_stale_jobs():
+
+    '''
+    Возвращает в очередь задачи, которые выполняются дольше `JOB_TIMEOUT`
+    секунд: их процесс, скорее всего, завершился аварийно. Задачи
+    с исчерпанными попытками помечаются как неудачные.
+    '''
+
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT))
+    failed = stale \
+        .filter(attempts__gte=F('max_attempts')) \
+        .update(status=Job.FAILED, finished_at=timezone.now(), error='Превышено время выполнения.')
+    return failed + stale.update(status=Job.QUEUED)
+
+
+@register('rebuild_quiz_stats')
+def rebuild_quiz_stats_job(quiz_ids=None):
+    return {'quizzes': rebuild_quiz_stats(quiz_ids)}
+
+
+@register('refresh_question_stats')
+def refresh_question_stats_job(full=False):
+    return {'taken_quizzes': refresh_question_stats(full=full)}
+
+
+@register('recompute_scores')
+def recompute_scores_job(quiz_ids):
+    answers = scores = 0
+    for quiz_id in quiz_ids:
+        changed = recompute_scores(quiz_id)
+        answers += changed[0]
+        scores += changed[1]
+    return {'answers': answers, 'scores': scores}
+
+
+@register('purge_quiz')
+def purge_quiz_job(quiz_id):
+    return purge_quiz(quiz_id, progress=lambda counts, duration: report_progress(counts))
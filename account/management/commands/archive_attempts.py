@@ -0,0 +1,36 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.archive import archive_attempts, live_table_sizes
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит прохождения опросов, закрытых раньше --before, и ответы '
+        'респондентов в архивные таблицы пакетами и сообщает, насколько '
+        'уменьшились рабочие таблицы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Дата ГГГГ-ММ-ДД: опросы с датой окончания раньше нее.')
+        parser.add_argument('--batch-size', type=int, help='Прохождений в одной транзакции.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        try:
+            before = datetime.date.fromisoformat(options['before'])
+        except ValueError:
+            raise CommandError(f'Неверная дата: {options["before"]}.')
+
+        sizes = live_table_sizes()
+        counts = archive_attempts(before, batch_size=options['batch_size'], progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(f'Опросов перенесено в архив: {counts["quizzes"]}.'))
+        for label, size in sizes.items():
+            remaining = size - counts[label]
+            percent = counts[label] / size * 100 if size else 0.0
+            self.stdout.write(f'{label}: {size} → {remaining} строк (−{percent:.1f}%)')
+
+    def progress(self, counts, duration):
+        if self.verbosity > 1:
+            self.stdout.write(f'  прохождений: {counts["taken_quizzes"]} ({duration * 1000:.1f} мс)')
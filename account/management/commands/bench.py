@@ -0,0 +1,143 @@
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from account import bench
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон сценариев респондентов и модераторов на отдельной '
+        'временной базе. Результат — JSON с перцентилями задержек, пропускной '
+        'способностью и количеством запросов к базе для сравнения коммитов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(bench.SCALES), default='small', help='Готовый размер данных.')
+        for name in bench.SCALES['small']:
+            parser.add_argument(f'--{name}', type=int, help=f'Переопределяет {name} из --scale.')
+        parser.add_argument('--workers', type=int, default=4, help='Количество параллельных клиентов.')
+        parser.add_argument('--iterations', type=int, default=10, help='Итераций сценариев на клиента.')
+        parser.add_argument('--signups', type=int, default=1, help='Регистраций на клиента.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--compare-async', action='store_true',
+            help='Вместо сценариев сравнить синхронные (WSGI) и асинхронные (ASGI) страницы респондента '
+                 'при медленной базе; --workers задает число одновременных пользователей.')
+        parser.add_argument(
+            '--stress-writes', action='store_true',
+            help='Вместо сценариев одновременно пройти опросы --workers респондентами '
+                 'и измерить скорость записи ответов и количество ошибок блокировки.')
+        parser.add_argument(
+            '--compare-sessions', action='store_true',
+            help='Вместо сценариев сравнить хранилища сессий и сообщений: записи в базу на шаг опроса; '
+                 '--workers задает число респондентов на каждое хранилище.')
+        parser.add_argument(
+            '--compare-editor', action='store_true',
+            help='Вместо сценариев сравнить правку всех вопросов опроса по одному и массовым редактором.')
+        parser.add_argument('--editor-questions', type=int, default=100, help='Вопросов в опросе для --compare-editor.')
+        parser.add_argument(
+            '--compare-purge', action='store_true',
+            help='Сравнить удаление опроса каскадом Django и пакетной очисткой: время, память, блокировка.')
+        parser.add_argument('--purge-respondents', type=int, default=5000, help='Прохождений удаляемого опроса для --compare-purge.')
+        parser.add_argument('--threads', type=int, default=4, help='Рабочих потоков WSGI-сервера для --compare-async.')
+        parser.add_argument('--db-delay', type=float, default=5.0, help='Задержка каждого SQL-запроса для --compare-async, мс.')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout).')
+
+    def handle(self, *args, **options):
+        scale = dict(bench.SCALES[options['scale']])
+        for name in scale:
+            if options[name] is not None:
+                scale[name] = options[name]
+        if options['workers'] < 1 or options['workers'] > scale['respondents']:
+            raise CommandError('--workers должно быть от 1 до количества респондентов.')
+
+        with tempfile.TemporaryDirectory(prefix='survey-bench-') as directory:
+            # Данные разработчика не трогаем: прогон идет на тестовой базе,
+            # для SQLite — в файле, чтобы ее видели соединения всех потоков.
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            cache.clear()
+            try:
+                start = time.perf_counter()
+                fixture = bench.seed(seed=options['seed'], **scale)
+                seed_duration = time.perf_counter() - start
+                if options['compare_async']:
+                    report = bench.compare_async(
+                        fixture,
+                        users=options['workers'],
+                        threads=options['threads'],
+                        rounds=options['iterations'],
+                        delay=options['db_delay'] / 1000,
+                    )
+                elif options['compare_sessions']:
+                    report = bench.compare_sessions(
+                        fixture,
+                        users=options['workers'],
+                        seed=options['seed'],
+                    )
+                elif options['compare_editor']:
+                    report = bench.compare_question_editor(questions=options['editor_questions'])
+                elif options['compare_purge']:
+                    report = bench.compare_purge(respondents=options['purge_respondents'])
+                elif options['stress_writes']:
+                    report = bench.stress_writes(
+                        fixture,
+                        workers=options['workers'],
+                        iterations=options['iterations'],
+                        seed=options['seed'],
+                    )
+                else:
+                    report = bench.run(
+                        fixture,
+                        workers=options['workers'],
+                        iterations=options['iterations'],
+                        signups=options['signups'],
+                        seed=options['seed'],
+                    )
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                cache.clear()
+
+        report = {
+            'commit': self.get_commit(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'config': {
+                'scale': options['scale'],
+                'workers': options['workers'],
+                'iterations': options['iterations'],
+                'signups': options['signups'],
+                'seed': options['seed'],
+                **scale,
+            },
+            'fixture': fixture.counts,
+            'seed_s': round(seed_duration, 3),
+            **report,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Отчет записан в {options["output"]}.'))
+        else:
+            self.stdout.write(output)
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.stats import quiz_counter_mismatches, repair_quiz_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики вопросов и прохождений опросов с количеством строк. '
+        'С --fix расходящиеся счетчики исправляются, без него команда '
+        'завершается с ошибкой, если расхождения найдены.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, action='append', dest='quiz_ids', help='Идентификатор опроса (можно повторять).')
+        parser.add_argument('--fix', action='store_true', help='Исправить расходящиеся счетчики.')
+
+    def handle(self, *args, **options):
+        if options['fix']:
+            mismatches = repair_quiz_counters(options['quiz_ids'])
+        else:
+            mismatches = quiz_counter_mismatches(options['quiz_ids'])
+        for row in mismatches:
+            self.stdout.write(
+                f'{row["name"]} #{row["pk"]}: вопросов {row["questions_count"]} (фактически {row["actual_questions_count"]}), '
+                f'прохождений {row["taken_count"]} (фактически {row["actual_taken_count"]})')
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено опросов: {len(mismatches)}.'))
+        else:
+            raise CommandError(f'Счетчики расходятся у опросов: {len(mismatches)}. Запустите с --fix.')
@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from account.importers import import_quizzes, parse_quiz_file
+from account.models import User
+
+
+class Command(BaseCommand):
+    help = 'Импортирует опросы с вопросами и ответами из файлов JSON или CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы .json или .csv.')
+        parser.add_argument('--owner', required=True, help='Имя пользователя модератора-владельца.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'], is_moderator=True)
+        except User.DoesNotExist:
+            raise CommandError(f'Модератор {options["owner"]} не найден.')
+
+        for path in options['paths']:
+            try:
+                with open(path, 'rb') as f:
+                    data = parse_quiz_file(f.read(), path)
+                quizzes = import_quizzes(data, owner)
+            except OSError as e:
+                raise CommandError(f'{path}: {e}')
+            except ValidationError as e:
+                raise CommandError(f'{path}:\n' + '\n'.join(e.messages))
+            questions = sum(len(quiz_data.get('questions') or []) for quiz_data in data)
+            self.stdout.write(self.style.SUCCESS(f'{path}: импортировано опросов: {len(quizzes)}, вопросов: {questions}.'))
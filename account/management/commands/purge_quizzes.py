@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.models import Quiz
+from account.purge import purge_quiz, soft_delete_quiz
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет пакетами удаленные (скрытые) опросы, очистка которых '
+        'не завершилась, или опросы, указанные в --quiz.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, action='append', dest='quiz_ids', help='Идентификатор опроса (можно повторять).')
+        parser.add_argument('--batch-size', type=int, help='Строк в одной транзакции.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['quiz_ids']:
+            quizzes = list(Quiz.all_objects.filter(pk__in=options['quiz_ids']))
+            missing = set(options['quiz_ids']) - {quiz.pk for quiz in quizzes}
+            if missing:
+                raise CommandError(f'Опросы не найдены: {", ".join(map(str, sorted(missing)))}.')
+        else:
+            quizzes = list(Quiz.all_objects.filter(deleted_at__isnull=False))
+
+        for quiz in quizzes:
+            if quiz.deleted_at is None:
+                soft_delete_quiz(quiz)
+            counts = purge_quiz(quiz.pk, batch_size=options['batch_size'], progress=self.progress)
+            summary = ', '.join(f'{label}: {count}' for label, count in counts.items() if count)
+            self.stdout.write(self.style.SUCCESS(f'Опрос #{quiz.pk} удален ({summary}).'))
+
+    def progress(self, counts, duration):
+        if self.verbosity > 1:
+            label, count = list(counts.items())[-1]
+            self.stdout.write(f'  {label}: {count} ({duration * 1000:.1f} мс)')
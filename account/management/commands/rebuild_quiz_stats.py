@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from account.stats import rebuild_quiz_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованную статистику результатов опросов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int, help='Опросы для пересчета (по умолчанию все).')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids'] or None
+        rebuilt = rebuild_quiz_stats(quiz_ids)
+        self.stdout.write(self.style.SUCCESS(f'Статистика пересобрана для {rebuilt} опросов.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from account.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Пересоздает полнотекстовый индекс опросов, вопросов и ответов (SQLite FTS5) вместе с триггерами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if not rebuild_search_index(options['database']):
+            raise CommandError('Полнотекстовый индекс поддерживается только для SQLite.')
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс пересоздан.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from account.models import TakenQuiz
+from account.stats import recompute_scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает баллы прохождений по текущим правильным ответам: '
+        'для указанных опросов или для всех опросов с прохождениями.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, action='append', dest='quiz_ids', help='Идентификатор опроса (можно повторять).')
+        parser.add_argument('--batch-size', type=int, help='Респондентов в одной транзакции.')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids']
+        if quiz_ids is None:
+            quiz_ids = TakenQuiz.objects.order_by('quiz_id').values_list('quiz_id', flat=True).distinct()
+        answers = scores = quizzes = 0
+        for quiz_id in quiz_ids:
+            changed = recompute_scores(quiz_id, batch_size=options['batch_size'])
+            answers += changed[0]
+            scores += changed[1]
+            quizzes += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Опросов: {quizzes}, исправлено ответов: {answers}, баллов: {scores}.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from account.stats import refresh_question_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Добавляет в аналитику вопросов прохождения, завершенные после '
+        'предыдущего запуска. С --full пересобирает аналитику с нуля.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересобрать аналитику по всем прохождениям.')
+        parser.add_argument('--batch-size', type=int, help='Ключей прохождений в одном пакете.')
+
+    def handle(self, *args, **options):
+        processed = refresh_question_stats(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Учтено прохождений: {processed}.'))
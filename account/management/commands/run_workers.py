@@ -0,0 +1,84 @@
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from account import workers
+from account.jobs import claim_next_job, execute_job, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые задачи из очереди (модель Job) в пуле процессов. '
+        'С --processes 0 задачи выполняются в текущем процессе. Задачи, '
+        'прерванные остановкой команды, возвращаются в очередь при следующем '
+        'запуске по истечении JOB_TIMEOUT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Размер пула процессов.')
+        parser.add_argument('--poll-interval', type=float, help='Пауза между проверками очереди, сек.')
+        parser.add_argument('--once', action='store_true', help='Завершиться, когда очередь опустеет.')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes is None:
+            processes = settings.JOB_WORKERS
+        poll_interval = options['poll_interval'] or settings.JOB_POLL_INTERVAL
+
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}.')
+
+        if processes:
+            done = self.run_pool(processes, poll_interval, options['once'])
+        else:
+            done = self.run_inline(poll_interval, options['once'])
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}.'))
+
+    def run_inline(self, poll_interval, once):
+        done = 0
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if once:
+                    return done
+                time.sleep(poll_interval)
+                continue
+            self.report(job, execute_job(job.pk))
+            done += 1
+
+    def run_pool(self, processes, poll_interval, once):
+        # Задачи забирает только этот процесс, поэтому в пуле никогда
+        # не ждет больше задач, чем есть свободных процессов.
+        done = 0
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context, initializer=workers.setup) as pool:
+            running = {}
+            while True:
+                while len(running) < processes:
+                    job = claim_next_job()
+                    if job is None:
+                        break
+                    running[pool.submit(workers.run_job, job.pk)] = job
+                if not running:
+                    if once:
+                        return done
+                    time.sleep(poll_interval)
+                    continue
+                finished, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as exc:
+                        # Задача остается в статусе running и вернется
+                        # в очередь через JOB_TIMEOUT (requeue_stale_jobs).
+                        status = f'сбой процесса: {exc!r}'
+                    self.report(job, status)
+                    done += 1
+
+    def report(self, job, status):
+        self.stdout.write(f'{job.name} #{job.pk}: {status}')
@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплику (онлайн-бэкапом SQLite). '
+        'Нужна только для локальной проверки чтения с реплики; в рабочем '
+        'окружении реплику поддерживает сама СУБД.'
+    )
+
+    def handle(self, *args, **options):
+        if not settings.REPLICA_DATABASE:
+            raise CommandError('Реплика не настроена: задайте SURVEY_DB_REPLICA_NAME.')
+        primary = connections['default']
+        replica = connections[settings.REPLICA_DATABASE]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite.')
+        if primary.settings_dict['NAME'] == replica.settings_dict['NAME']:
+            raise CommandError('Основная база и реплика указывают на один файл.')
+
+        replica.close()
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        target = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f'Реплика {replica.settings_dict["NAME"]} обновлена.'))
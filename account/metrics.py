@@ -0,0 +1,209 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+logger = logging.getLogger('account.metrics')
+
+_current_metrics = ContextVar('request_metrics', default=None)
+
+
+def current_metrics():
+    return _current_metrics.get()
+
+
+class RequestMetrics:
+
+    '''
+    Показатели одного запроса: количество SQL-запросов, время в базе,
+    в обработке запроса без отрисовки шаблонов (view, middleware и база),
+    в шаблонах и общее время, мс, а также попадания и промахи кэша
+    фрагментов.
+    '''
+
+    def __init__(self):
+        self.url_name = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.view_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record_cache(self, hit):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def as_dict(self):
+        return {
+            'url_name': self.url_name,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'view_ms': round(self.view_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'total_ms': round(self.total_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def server_timing(self):
+        data = self.as_dict()
+        return ', '.join([
+            f'db;dur={data["db_ms"]};desc="{self.queries} queries"',
+            f'view;dur={data["view_ms"]}',
+            f'tpl;dur={data["template_ms"]}',
+            f'total;dur={data["total_ms"]}',
+        ])
+
+    def budget_violations(self, budget):
+        data = self.as_dict()
+        return {key: (data[key], limit) for key, limit in budget.items() if data[key] > limit}
+
+
+@contextmanager
+def collect_metrics(name):
+
+    '''
+    Собирает `RequestMetrics` для работы вне запроса (например, фоновой
+    задачи): SQL-запросы, время в базе и в шаблонах, общее время.
+    '''
+
+    metrics = RequestMetrics()
+    metrics.url_name = name
+    token = _current_metrics.set(metrics)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+        metrics.total_time = time.perf_counter() - start
+        metrics.view_time = max(metrics.total_time - metrics.template_time, 0.0)
+
+
+def count_query(execute, sql, params, many, context):
+
+    '''
+    Обертка `execute_wrappers`, которая ставится на каждое соединение
+    при его создании (см. `account.signals`). Текущий запрос берется
+    из contextvar, поэтому учитываются и запросы асинхронного ORM,
+    выполняемые в потоках `sync_to_async`.
+    '''
+
+    metrics = current_metrics()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(context, request)
+        # Вложенная отрисовка (render_to_string внутри шаблона) учитывается один раз.
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+
+    '''
+    Бэкенд шаблонов Django, который учитывает время отрисовки
+    в `RequestMetrics` текущего запроса. Работает и для `render()`
+    во view-функциях, и для `TemplateResponse` у class-based views.
+    '''
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class RequestMetricsMiddleware:
+
+    '''
+    Собирает `RequestMetrics` для каждого запроса, отдает их в заголовке
+    `Server-Timing` и структурированной строкой лога `account.metrics`,
+    а также предупреждает о превышении бюджета из `REQUEST_BUDGETS`
+    для имени URL (например, `respondents:take_quiz`). Показатели
+    доступны в тестах как `response.request_metrics`. Работает и в
+    синхронной, и в асинхронной цепочке middleware.
+    '''
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    def finish(self, request, response, metrics, start):
+        metrics.total_time = time.perf_counter() - start
+        metrics.view_time = max(metrics.total_time - metrics.template_time, 0.0)
+        if request.resolver_match:
+            metrics.url_name = request.resolver_match.view_name
+
+        response['Server-Timing'] = metrics.server_timing()
+        response.request_metrics = metrics
+        self.log(request, response, metrics)
+        return response
+
+    def log(self, request, response, metrics):
+        data = metrics.as_dict()
+        data.update(method=request.method, path=request.path, status=response.status_code)
+        budget = settings.REQUEST_BUDGETS.get(metrics.url_name)
+        violations = metrics.budget_violations(budget) if budget else {}
+        if violations:
+            data['over_budget'] = {key: {'actual': actual, 'limit': limit} for key, (actual, limit) in violations.items()}
+            logger.warning(json.dumps(data, ensure_ascii=False), extra={'metrics': data})
+        else:
+            logger.info(json.dumps(data, ensure_ascii=False), extra={'metrics': data})
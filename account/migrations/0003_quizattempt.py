@@ -0,0 +1,59 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def create_attempts_in_progress(apps, schema_editor):
+
+    '''
+    Незавершенные прохождения (есть ответы, но нет `TakenQuiz`)
+    получают попытку со счетчиками отвеченных вопросов и правильных
+    ответов. Следующий вопрос `take_quiz` выбирает среди неотвеченных,
+    поэтому порядок, в котором на них отвечали, не важен.
+    '''
+
+    RespondentAnswer = apps.get_model('account', 'RespondentAnswer')
+    TakenQuiz = apps.get_model('account', 'TakenQuiz')
+    QuizAttempt = apps.get_model('account', 'QuizAttempt')
+
+    taken = set(TakenQuiz.objects.values_list('respondent_id', 'quiz_id'))
+    progress = RespondentAnswer.objects \
+        .values('respondent_id', 'answer__question__quiz_id') \
+        .annotate(answered=Count('pk'), correct=Count('pk', filter=Q(answer__is_correct=True)))
+    QuizAttempt.objects.bulk_create([
+        QuizAttempt(
+            respondent_id=row['respondent_id'],
+            quiz_id=row['answer__question__quiz_id'],
+            position=row['answered'],
+            correct_count=row['correct'])
+        for row in progress
+        if (row['respondent_id'], row['answer__question__quiz_id']) not in taken
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0002_create_initial_subjects'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='Отвечено вопросов')),
+                ('correct_count', models.PositiveIntegerField(default=0, verbose_name='Правильных ответов')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершение')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='account.quiz')),
+                ('respondent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='account.respondent')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_quiz_attempt')],
+            },
+        ),
+        migrations.RunPython(create_attempts_in_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_quizattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quiz',
+            name='single_page',
+            field=models.BooleanField(default=False, verbose_name='Все вопросы на одной странице'),
+        ),
+    ]
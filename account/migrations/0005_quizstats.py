@@ -0,0 +1,59 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def fill_quiz_stats(apps, schema_editor):
+    TakenQuiz = apps.get_model('account', 'TakenQuiz')
+    QuizStats = apps.get_model('account', 'QuizStats')
+    QuizScoreBucket = apps.get_model('account', 'QuizScoreBucket')
+
+    totals = TakenQuiz.objects \
+        .values('quiz_id') \
+        .annotate(attempts=Count('pk'), score_sum=Sum('score'), score_min=Min('score'), score_max=Max('score')) \
+        .order_by()
+    QuizStats.objects.bulk_create([QuizStats(**row) for row in totals], batch_size=500)
+
+    buckets = {}
+    for quiz_id, score in TakenQuiz.objects.values_list('quiz_id', 'score').iterator():
+        key = (quiz_id, min(int(score // 10), 9))
+        buckets[key] = buckets.get(key, 0) + 1
+    QuizScoreBucket.objects.bulk_create([
+        QuizScoreBucket(stats_id=quiz_id, bucket=bucket, count=count)
+        for (quiz_id, bucket), count in buckets.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_quiz_single_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizStats',
+            fields=[
+                ('quiz', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='account.quiz')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Количество прохождений')),
+                ('score_sum', models.FloatField(default=0.0, verbose_name='Сумма баллов')),
+                ('score_min', models.FloatField(blank=True, null=True, verbose_name='Минимальный балл')),
+                ('score_max', models.FloatField(blank=True, null=True, verbose_name='Максимальный балл')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuizScoreBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField(verbose_name='Интервал баллов')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('stats', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='account.quizstats')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stats', 'bucket'), name='unique_quiz_score_bucket')],
+            },
+        ),
+        migrations.RunPython(fill_quiz_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.2 on 2026-10-17 19:58
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def remove_duplicates(apps, schema_editor):
+
+    '''
+    Перед созданием уникальных ограничений оставляет по одной
+    (самой ранней) строке на каждую пару. Статистика опросов,
+    у которых были удалены повторные прохождения, пересчитывается.
+    '''
+
+    TakenQuiz = apps.get_model('account', 'TakenQuiz')
+    RespondentAnswer = apps.get_model('account', 'RespondentAnswer')
+    QuizStats = apps.get_model('account', 'QuizStats')
+    QuizScoreBucket = apps.get_model('account', 'QuizScoreBucket')
+
+    keep = RespondentAnswer.objects.values('respondent_id', 'answer_id').annotate(keep=Min('pk')).values('keep')
+    RespondentAnswer.objects.exclude(pk__in=keep).delete()
+
+    keep = TakenQuiz.objects.values('respondent_id', 'quiz_id').annotate(keep=Min('pk')).values('keep')
+    duplicates = TakenQuiz.objects.exclude(pk__in=keep)
+    quiz_ids = set(duplicates.values_list('quiz_id', flat=True))
+    if not quiz_ids:
+        return
+    duplicates.delete()
+
+    taken_quizzes = TakenQuiz.objects.filter(quiz_id__in=quiz_ids)
+    QuizStats.objects.filter(quiz_id__in=quiz_ids).delete()
+    totals = taken_quizzes \
+        .values('quiz_id') \
+        .annotate(attempts=Count('pk'), score_sum=Sum('score'), score_min=Min('score'), score_max=Max('score')) \
+        .order_by()
+    QuizStats.objects.bulk_create([QuizStats(**row) for row in totals])
+    buckets = {}
+    for quiz_id, score in taken_quizzes.values_list('quiz_id', 'score'):
+        key = (quiz_id, min(int(score // 10), 9))
+        buckets[key] = buckets.get(key, 0) + 1
+    QuizScoreBucket.objects.bulk_create([
+        QuizScoreBucket(stats_id=quiz_id, bucket=bucket, count=count)
+        for (quiz_id, bucket), count in buckets.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0005_quizstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['owner', 'name'], name='quiz_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='takenquiz',
+            index=models.Index(fields=['quiz', '-date'], name='takenquiz_quiz_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='respondentanswer',
+            constraint=models.UniqueConstraint(fields=('respondent', 'answer'), name='unique_respondent_answer'),
+        ),
+        migrations.AddConstraint(
+            model_name='takenquiz',
+            constraint=models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_taken_quiz'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def backfill_answer_keys(apps, schema_editor):
+
+    '''
+    Заполняет вопрос, опрос и признак правильности пакетами по диапазонам
+    первичного ключа: каждый пакет — один UPDATE с подзапросами,
+    поэтому таблица ответов не блокируется надолго.
+    '''
+
+    RespondentAnswer = apps.get_model('account', 'RespondentAnswer')
+    Answer = apps.get_model('account', 'Answer')
+
+    answer = Answer.objects.filter(pk=OuterRef('answer_id'))
+    bounds = RespondentAnswer.objects.aggregate(first=models.Min('pk'), last=models.Max('pk'))
+    if bounds['first'] is None:
+        return
+    for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+        RespondentAnswer.objects \
+            .filter(pk__gte=start, pk__lt=start + BATCH_SIZE) \
+            .update(
+                question_id=Subquery(answer.values('question_id')),
+                quiz_id=Subquery(answer.values('question__quiz_id')),
+                is_correct=Subquery(answer.values('is_correct')))
+
+
+def remove_duplicate_question_answers(apps, schema_editor):
+    RespondentAnswer = apps.get_model('account', 'RespondentAnswer')
+    keep = RespondentAnswer.objects.values('respondent_id', 'question_id').annotate(keep=Min('pk')).values('keep')
+    RespondentAnswer.objects.exclude(pk__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='respondentanswer',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.question'),
+        ),
+        migrations.AddField(
+            model_name='respondentanswer',
+            name='quiz',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.quiz'),
+        ),
+        migrations.AddField(
+            model_name='respondentanswer',
+            name='is_correct',
+            field=models.BooleanField(default=False, verbose_name='Правильный ответ'),
+        ),
+        migrations.RunPython(backfill_answer_keys, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_question_answers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='respondentanswer',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.question'),
+        ),
+        migrations.AlterField(
+            model_name='respondentanswer',
+            name='quiz',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.quiz'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='respondentanswer',
+            name='unique_respondent_answer',
+        ),
+        migrations.AddConstraint(
+            model_name='respondentanswer',
+            constraint=models.UniqueConstraint(fields=('respondent', 'question'), name='unique_respondent_question'),
+        ),
+        migrations.AddIndex(
+            model_name='respondentanswer',
+            index=models.Index(fields=['respondent', 'quiz', 'is_correct'], name='respondentanswer_progress_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from account.search import CREATE_SQL, DROP_SQL, FILL_SQL
+
+
+def execute(statements):
+    def run(apps, schema_editor):
+        # Полнотекстовый индекс есть только у SQLite (FTS5), на других
+        # базах поиск работает без него (см. `account.search`).
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_respondentanswer_denormalized_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(execute(CREATE_SQL + FILL_SQL), execute(DROP_SQL)),
+    ]
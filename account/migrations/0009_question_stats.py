@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-17 20:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0008_quiz_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerStats',
+            fields=[
+                ('answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='account.answer')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Сколько раз выбран')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionStats',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='account.question')),
+                ('answered', models.PositiveIntegerField(default=0, verbose_name='Количество ответов')),
+                ('correct', models.PositiveIntegerField(default=0, verbose_name='Количество правильных ответов')),
+                ('score_sum', models.FloatField(default=0.0, verbose_name='Сумма баллов отвечавших')),
+                ('score_square_sum', models.FloatField(default=0.0, verbose_name='Сумма квадратов баллов')),
+                ('correct_score_sum', models.FloatField(default=0.0, verbose_name='Сумма баллов ответивших правильно')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('position', models.BigIntegerField(default=0, verbose_name='Последний обработанный ключ')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+        ),
+    ]
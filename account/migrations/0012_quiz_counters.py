@@ -0,0 +1,65 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:00
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from account.search import CREATE_SQL, DROP_SQL, FILL_SQL
+
+
+def backfill_counters(apps, schema_editor):
+
+    '''
+    Заполняет счетчики одним UPDATE с подзапросами по каждой таблице.
+    '''
+
+    Quiz = apps.get_model('account', 'Quiz')
+    Question = apps.get_model('account', 'Question')
+    TakenQuiz = apps.get_model('account', 'TakenQuiz')
+
+    def count(model):
+        rows = model.objects \
+            .filter(quiz_id=OuterRef('pk')) \
+            .order_by() \
+            .values('quiz_id') \
+            .annotate(count=Count('pk')) \
+            .values('count')
+        return Coalesce(Subquery(rows), 0)
+
+    Quiz.objects.update(questions_count=count(Question), taken_count=count(TakenQuiz))
+
+
+def rebuild_search_index(apps, schema_editor):
+    # SQLite добавляет столбцы NOT NULL пересозданием таблицы опросов,
+    # а вместе со старой таблицей удаляются и триггеры поискового индекса.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL + CREATE_SQL + FILL_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0011_quiz_deleted_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, rebuild_search_index),
+        migrations.AddField(
+            model_name='quiz',
+            name='questions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество вопросов'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='taken_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество прохождений'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['owner', '-taken_count', 'name'], name='quiz_owner_popular_idx'),
+        ),
+    ]
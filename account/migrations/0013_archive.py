@@ -0,0 +1,44 @@
+# Generated by Django 5.1.2 on 2026-10-17 21:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0012_quiz_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRespondentAnswer',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('is_correct', models.BooleanField(default=False, verbose_name='Правильный ответ')),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.answer')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.question')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='account.quiz')),
+                ('respondent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_answers', to='account.respondent')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['respondent', 'quiz'], name='archivedanswer_respondent_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTakenQuiz',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('score', models.FloatField()),
+                ('date', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='В архиве с')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_taken_quizzes', to='account.quiz')),
+                ('respondent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_taken_quizzes', to='account.respondent')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['quiz', '-date'], name='archivedtakenquiz_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_archived_taken_quiz')],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
@@ -25,6 +26,28 @@ class Subject(models.Model):
         return mark_safe(html)
 
 
+class QuizQuerySet(models.QuerySet):
+    def open(self, date=None):
+        '''
+        Опросы, доступные для прохождения: активные и попадающие
+        в интервал `start_date`..`end_date` на указанную дату.
+        '''
+        date = date or timezone.localdate()
+        return self.filter(is_active=True, start_date__lte=date, end_date__gte=date)
+
+
+class QuizManager(models.Manager.from_queryset(QuizQuerySet)):
+
+    '''
+    Менеджер по умолчанию: скрывает удаленные опросы, которые еще ждут
+    очистки (см. `account.purge`). Через него работают и связанные
+    менеджеры (`user.quizzes`, `subject.quizzes`).
+    '''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Quiz(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quizzes')
     name = models.CharField('Название опроса', max_length=255)
@@ -33,10 +56,38 @@ class Quiz(models.Model):
     start_date = models.DateField('Дата начала опроса', default=timezone.now)
     end_date = models.DateField('Дата окончания вопроса', default=timezone.now)
     is_active = models.BooleanField('Статус опроса', default=True)
+    single_page = models.BooleanField('Все вопросы на одной странице', default=False)
+    deleted_at = models.DateTimeField('Удален', null=True, blank=True, editable=False)
+
+    # Счетчики поддерживаются сигналами (`account.signals`) приращениями
+    # `F()`; расхождения исправляет команда `check_quiz_counters --fix`.
+    questions_count = models.PositiveIntegerField('Количество вопросов', default=0, editable=False)
+    taken_count = models.PositiveIntegerField('Количество прохождений', default=0, editable=False)
+
+    COUNTER_FIELDS = ('questions_count', 'taken_count')
+
+    objects = QuizManager()
+    all_objects = QuizQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('owner', 'name'), name='quiz_owner_name_idx'),
+            models.Index(fields=('owner', '-taken_count', 'name'), name='quiz_owner_popular_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Счетчики меняются только приращениями в базе: сохранение опроса
+        # не должно записывать поверх них значения, прочитанные раньше.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
@@ -60,10 +111,54 @@ class Respondent(models.Model):
     quizzes = models.ManyToManyField(Quiz, through='TakenQuiz')
     category = models.ManyToManyField(Subject, related_name='category_respondents')
 
+    def get_category_ids(self):
+        '''
+        Идентификаторы категорий респондента, прочитанные только
+        из промежуточной таблицы, без соединения с `Subject`.
+        '''
+        return list(Respondent.category.through.objects
+                    .filter(respondent_id=self.pk)
+                    .values_list('subject_id', flat=True))
+
+    async def aget_category_ids(self):
+        return [pk async for pk in Respondent.category.through.objects
+                .filter(respondent_id=self.pk)
+                .values_list('subject_id', flat=True)]
+
+    def has_taken(self, quiz):
+        '''
+        Проходил ли респондент опрос. В архиве лежат прохождения только
+        закрытых опросов, поэтому для открытых он не читается.
+        '''
+        if self.quizzes.filter(pk=quiz.pk).exists():
+            return True
+        return quiz.end_date < timezone.localdate() \
+            and ArchivedTakenQuiz.objects.filter(respondent_id=self.pk, quiz_id=quiz.pk).exists()
+
+    async def ahas_taken(self, quiz):
+        if await self.quizzes.filter(pk=quiz.pk).aexists():
+            return True
+        return quiz.end_date < timezone.localdate() \
+            and await ArchivedTakenQuiz.objects.filter(respondent_id=self.pk, quiz_id=quiz.pk).aexists()
+
+    def get_answered_question_ids(self, quiz):
+        '''
+        Идентификаторы вопросов опроса, на которые респондент уже ответил.
+        Читается только `RespondentAnswer` по индексу (respondent, quiz).
+        '''
+        return set(RespondentAnswer.objects
+                   .filter(respondent_id=self.pk, quiz_id=quiz.pk)
+                   .values_list('question_id', flat=True))
+
+    async def aget_answered_question_ids(self, quiz):
+        return {pk async for pk in RespondentAnswer.objects
+                .filter(respondent_id=self.pk, quiz_id=quiz.pk)
+                .values_list('question_id', flat=True)}
+
     def get_unanswered_questions(self, quiz):
         answered_questions = self.quiz_answers \
-            .filter(answer__question__quiz=quiz) \
-            .values_list('answer__question__pk', flat=True)
+            .filter(quiz=quiz) \
+            .values_list('question_id', flat=True)
         questions = quiz.questions.exclude(pk__in=answered_questions).order_by('text')
         return questions
 
@@ -77,7 +172,288 @@ class TakenQuiz(models.Model):
     score = models.FloatField()
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_taken_quiz'),
+        ]
+        indexes = [
+            models.Index(fields=('quiz', '-date'), name='takenquiz_quiz_date_idx'),
+        ]
+
+
+class QuizAttempt(models.Model):
+
+    '''
+    Попытка прохождения опроса. Хранит количество отвеченных вопросов
+    (`position`) и правильных ответов, поэтому итоговый балл вычисляется
+    без просмотра истории ответов. Следующий вопрос выбирается из снимка
+    содержимого опроса за вычетом уже отвеченных, а не по `position`:
+    модератор может менять вопросы во время попытки.
+    '''
+
+    respondent = models.ForeignKey(Respondent, on_delete=models.CASCADE, related_name='attempts')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='attempts')
+    position = models.PositiveIntegerField('Отвечено вопросов', default=0)
+    correct_count = models.PositiveIntegerField('Правильных ответов', default=0)
+    started_at = models.DateTimeField('Начало', auto_now_add=True)
+    finished_at = models.DateTimeField('Завершение', null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_quiz_attempt'),
+        ]
+
+    def advance(self, answered, correct):
+        '''
+        Атомарно увеличивает счетчики на `answered` вопросов. Обновление
+        условное: если параллельный запрос уже ответил на текущий
+        вопрос, ничего не меняется и возвращается False.
+        '''
+        updated = QuizAttempt.objects \
+            .filter(pk=self.pk, position=self.position, finished_at__isnull=True) \
+            .update(position=F('position') + answered, correct_count=F('correct_count') + correct)
+        if updated:
+            self.position += answered
+            self.correct_count += correct
+        return bool(updated)
+
+    def finish(self, total_questions):
+        '''
+        Завершает попытку. Балл считается по сохранившимся ответам
+        респондента: ответы на удаленные вопросы в него не входят.
+        '''
+        correct = RespondentAnswer.objects \
+            .filter(respondent_id=self.respondent_id, quiz_id=self.quiz_id, is_correct=True) \
+            .count()
+        score = min(round((correct / total_questions) * 100.0, 2), 100.0) if total_questions else 0.0
+        # Внутри шага попытки ошибка откатывает и сохраненные ответы.
+        with transaction.atomic(savepoint=False):
+            self.finished_at = timezone.now()
+            self.save(update_fields=['finished_at'])
+            return TakenQuiz.objects.create(respondent_id=self.respondent_id, quiz_id=self.quiz_id, score=score)
+
+
+class QuizStats(models.Model):
+
+    '''
+    Материализованная статистика результатов опроса. Обновляется
+    инкрементально при создании и удалении `TakenQuiz`
+    (см. `account.stats`) и пересобирается командой `rebuild_quiz_stats`.
+    '''
+
+    BUCKETS = 10
+
+    quiz = models.OneToOneField(Quiz, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    attempts = models.PositiveIntegerField('Количество прохождений', default=0)
+    score_sum = models.FloatField('Сумма баллов', default=0.0)
+    score_min = models.FloatField('Минимальный балл', null=True, blank=True)
+    score_max = models.FloatField('Максимальный балл', null=True, blank=True)
+
+    @property
+    def average_score(self):
+        if not self.attempts:
+            return None
+        return round(self.score_sum / self.attempts, 2)
+
+    @classmethod
+    def bucket_for(cls, score):
+        return min(int(score // (100 / cls.BUCKETS)), cls.BUCKETS - 1)
+
+    def histogram(self):
+        counts = dict(self.buckets.values_list('bucket', 'count')) if self.pk and self.attempts else {}
+        width = 100 // self.BUCKETS
+        return [(bucket * width, counts.get(bucket, 0)) for bucket in range(self.BUCKETS)]
+
+
+class QuizScoreBucket(models.Model):
+    stats = models.ForeignKey(QuizStats, on_delete=models.CASCADE, related_name='buckets')
+    bucket = models.PositiveSmallIntegerField('Интервал баллов')
+    count = models.PositiveIntegerField('Количество', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('stats', 'bucket'), name='unique_quiz_score_bucket'),
+        ]
+
+
+class QuestionStats(models.Model):
+
+    '''
+    Материализованная аналитика вопроса по завершенным прохождениям.
+    Хранятся только суммы, поэтому новые прохождения добавляются
+    инкрементально (см. `account.stats.refresh_question_stats`),
+    а доля правильных ответов и индекс дискриминации вычисляются из них.
+    '''
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    answered = models.PositiveIntegerField('Количество ответов', default=0)
+    correct = models.PositiveIntegerField('Количество правильных ответов', default=0)
+    score_sum = models.FloatField('Сумма баллов отвечавших', default=0.0)
+    score_square_sum = models.FloatField('Сумма квадратов баллов', default=0.0)
+    correct_score_sum = models.FloatField('Сумма баллов ответивших правильно', default=0.0)
+
+    @property
+    def percent_correct(self):
+        if not self.answered:
+            return None
+        return round(self.correct / self.answered * 100, 1)
+
+    @property
+    def discrimination(self):
+
+        '''
+        Точечно-бисериальная корреляция правильности ответа на вопрос
+        с итоговым баллом за опрос: близко к 1 — вопрос хорошо отделяет
+        сильных респондентов от слабых, около 0 и ниже — не отделяет.
+        '''
+
+        n, x, y = self.answered, self.correct, self.score_sum
+        spread = (n * x - x * x) * (n * self.score_square_sum - y * y)
+        if not n or spread <= 0:
+            return None
+        return round((n * self.correct_score_sum - x * y) / spread ** 0.5, 3)
+
+
+class AnswerStats(models.Model):
+    answer = models.OneToOneField(Answer, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    count = models.PositiveIntegerField('Сколько раз выбран', default=0)
+
+
+class Watermark(models.Model):
+
+    '''
+    Позиция инкрементальной обработки: первичный ключ последней
+    обработанной строки исходной таблицы.
+    '''
+
+    name = models.CharField(max_length=100, primary_key=True)
+    position = models.BigIntegerField('Последний обработанный ключ', default=0)
+    updated_at = models.DateTimeField('Обновлено', auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.position}'
+
+
+class Job(models.Model):
+
+    '''
+    Фоновая задача для `run_workers`: имя зарегистрированного
+    обработчика (см. `account.jobs`) и его параметры. Неудачные
+    попытки повторяются до `max_attempts` с растущей задержкой,
+    в `metrics` сохраняются время ожидания и выполнения, количество
+    SQL-запросов и время в базе.
+    '''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField('Обработчик', max_length=100)
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    status = models.CharField('Статус', max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Максимум попыток', default=3)
+    run_after = models.DateTimeField('Не раньше', default=timezone.now)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    started_at = models.DateTimeField('Начата', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+    result = models.JSONField('Результат', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    metrics = models.JSONField('Показатели', default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('status', 'run_after'), name='job_status_run_after_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def error_message(self):
+        # Последняя строка трассировки — тип и текст исключения.
+        lines = self.error.strip().splitlines()
+        return lines[-1] if lines else ''
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
 
 class RespondentAnswer(models.Model):
+
+    '''
+    Ответ респондента. Вопрос, опрос и признак правильности копируются
+    из ответа при сохранении, поэтому прогресс и подсчет баллов читают
+    одну таблицу без соединений. Если модератор позже изменит правильные
+    ответы, признак и баллы пересчитывает `account.stats.recompute_scores`.
+    '''
+
     respondent = models.ForeignKey(Respondent, on_delete=models.CASCADE, related_name='quiz_answers')
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, related_name='+')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='+')
+    is_correct = models.BooleanField('Правильный ответ', default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('respondent', 'question'), name='unique_respondent_question'),
+        ]
+        indexes = [
+            models.Index(fields=('respondent', 'quiz', 'is_correct'), name='respondentanswer_progress_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.question_id is None or self.quiz_id is None:
+            answer = Answer.objects.select_related('question').get(pk=self.answer_id)
+            self.question_id = answer.question_id
+            self.quiz_id = answer.question.quiz_id
+            self.is_correct = answer.is_correct
+        super().save(*args, **kwargs)
+
+
+class ArchivedTakenQuiz(models.Model):
+
+    '''
+    Прохождение закрытого опроса, перенесенное из `TakenQuiz` командой
+    `archive_attempts` (см. `account.archive`). Первичный ключ остается
+    прежним, поэтому архив соотносится с водяным знаком аналитики.
+    Статистика опроса и счетчик прохождений архивные строки учитывают.
+    '''
+
+    id = models.BigIntegerField(primary_key=True)
+    respondent = models.ForeignKey(Respondent, on_delete=models.CASCADE, related_name='archived_taken_quizzes')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='archived_taken_quizzes')
+    score = models.FloatField()
+    date = models.DateTimeField()
+    archived_at = models.DateTimeField('В архиве с', default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('respondent', 'quiz'), name='unique_archived_taken_quiz'),
+        ]
+        indexes = [
+            models.Index(fields=('quiz', '-date'), name='archivedtakenquiz_date_idx'),
+        ]
+
+
+class ArchivedRespondentAnswer(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    respondent = models.ForeignKey(Respondent, on_delete=models.CASCADE, related_name='archived_answers')
+    answer = models.ForeignKey(Answer, on_delete=models.CASCADE, related_name='+')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='+')
+    is_correct = models.BooleanField('Правильный ответ', default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('respondent', 'quiz'), name='archivedanswer_respondent_idx'),
+        ]
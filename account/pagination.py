@@ -0,0 +1,173 @@
+import base64
+import binascii
+import bisect
+import json
+
+from django.db.models import Q
+from django.http import Http404
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+
+    '''
+    Постраничная навигация по ключу сортировки (keyset/cursor pagination).
+    Вместо OFFSET и COUNT(*) страница выбирается условием
+    `(name, pk) > (последнее значение)`, поэтому стоимость запроса
+    не зависит от номера страницы и общего количества строк.
+    Последнее поле в `ordering` должно быть уникальным (обычно `pk`).
+    '''
+
+    def __init__(self, queryset, per_page, ordering=('name', 'pk')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps(values, separators=(',', ':'), default=str).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            values = json.loads(data)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise Http404('Неверный курсор страницы.')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise Http404('Неверный курсор страницы.')
+        return values
+
+    def _seek(self, values, forward):
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[i]})
+            for prev_field, prev_value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{prev_field.lstrip('-'): prev_value})
+            condition |= step
+        return condition
+
+    def _reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    def _page_queryset(self, after, before):
+        if before:
+            queryset = self.queryset \
+                .filter(self._seek(self.decode_cursor(before), forward=False)) \
+                .order_by(*self._reversed_ordering())
+        else:
+            queryset = self.queryset.order_by(*self.ordering)
+            if after:
+                queryset = queryset.filter(self._seek(self.decode_cursor(after), forward=True))
+
+        # Одна лишняя строка говорит о наличии следующей страницы без COUNT(*).
+        return queryset[:self.per_page + 1]
+
+    def _make_page(self, rows, after, before):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if before:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or before:
+                next_cursor = self.encode_cursor(rows[-1])
+            if after or (before and has_more):
+                previous_cursor = self.encode_cursor(rows[0])
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def page(self, after=None, before=None):
+        rows = list(self._page_queryset(after, before))
+        return self._make_page(rows, after, before)
+
+    async def apage(self, after=None, before=None):
+        rows = [row async for row in self._page_queryset(after, before)]
+        return self._make_page(rows, after, before)
+
+
+class KeysetSequencePaginator(KeysetPaginator):
+
+    '''
+    Тот же интерфейс и те же курсоры, что у `KeysetPaginator`, но для
+    уже загруженной последовательности (например, строк из кэша),
+    отсортированной по полям `ordering`. Страница ищется двоичным
+    поиском. По убыванию (`-field`) могут идти только числовые поля.
+    '''
+
+    def _sort_key(self, values):
+        return tuple(-value if field.startswith('-') else value for field, value in zip(self.ordering, values))
+
+    def _key(self, obj):
+        return self._sort_key(getattr(obj, field.lstrip('-')) for field in self.ordering)
+
+    def _bisect(self, search, cursor):
+        # Значения поддельного курсора могут не сравниваться с полями строк.
+        try:
+            return search(self.queryset, self._sort_key(self.decode_cursor(cursor)), key=self._key)
+        except TypeError:
+            raise Http404('Неверный курсор страницы.')
+
+    def _page_queryset(self, after, before):
+        rows = self.queryset
+        if before:
+            end = self._bisect(bisect.bisect_left, before)
+            return list(reversed(rows[max(end - self.per_page - 1, 0):end]))
+        start = self._bisect(bisect.bisect_right, after) if after else 0
+        return list(rows[start:start + self.per_page + 1])
+
+    async def apage(self, after=None, before=None):
+        return self.page(after, before)
+
+
+class KeysetPaginationMixin:
+
+    '''
+    Подключает `KeysetPaginator` к `ListView` вместо стандартного
+    `Paginator` (для готового списка — `KeysetSequencePaginator`).
+    Курсоры передаются в GET-параметрах `after` и `before`.
+    '''
+
+    paginate_by = 20
+    keyset_ordering = ('name', 'pk')
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def get_keyset_paginator(self, queryset, page_size):
+        paginator_class = KeysetPaginator if hasattr(queryset, 'filter') else KeysetSequencePaginator
+        return paginator_class(queryset, page_size, self.get_keyset_ordering())
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        page = paginator.page(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    async def apaginate_queryset(self, queryset, page_size):
+        paginator = self.get_keyset_paginator(queryset, page_size)
+        page = await paginator.apage(after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return (paginator, page, page.object_list, page.has_other_pages())
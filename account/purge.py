@@ -0,0 +1,123 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import invalidate_quiz_content, invalidate_subject_quizzes
+from .models import (Answer, AnswerStats, ArchivedRespondentAnswer,
+                     ArchivedTakenQuiz, Question, QuestionStats, Quiz,
+                     QuizAttempt, QuizScoreBucket, QuizStats, RespondentAnswer,
+                     TakenQuiz)
+
+
+def soft_delete_quiz(quiz):
+
+    '''
+    Скрывает опрос сразу: менеджер `Quiz.objects` его больше не видит,
+    а снимки в кэше сбрасываются. Сами строки удаляет `purge_quiz`.
+    '''
+
+    Quiz.all_objects.filter(pk=quiz.pk).update(deleted_at=timezone.now())
+    transaction.on_commit(lambda: invalidate_subject_quizzes(quiz.subject_id))
+    transaction.on_commit(lambda: invalidate_quiz_content(quiz.pk))
+
+
+def delete_in_batches(queryset, batch_size=None, before_delete=None):
+
+    '''
+    Удаляет строки `queryset` пакетами по `batch_size` ключей, каждый
+    пакет — отдельная транзакция. Удаление идет одним DELETE по ключам
+    (`_raw_delete`) в обход сборщика каскадов Django: объекты не
+    загружаются в память и сигналы не отправляются, поэтому зависимые
+    таблицы нужно очищать раньше. `before_delete(pks)` вызывается
+    в транзакции пакета перед удалением. Для каждого пакета отдает
+    количество удаленных строк и время транзакции, сек.
+    '''
+
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    while True:
+        start = time.perf_counter()
+        with transaction.atomic(using=queryset.db):
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return
+            if before_delete is not None:
+                before_delete(pks)
+            deleted = queryset.model._base_manager.filter(pk__in=pks)._raw_delete(queryset.db)
+        yield deleted, time.perf_counter() - start
+
+
+def _purge(steps, batch_size, progress):
+    counts = {}
+    for label, queryset, *before_delete in steps:
+        counts[label] = 0
+        for deleted, duration in delete_in_batches(queryset, batch_size, *before_delete):
+            counts[label] += deleted
+            if progress is not None:
+                progress(counts, duration)
+    return counts
+
+
+def purge_quiz(quiz_id, batch_size=None, progress=None):
+
+    '''
+    Удаляет опрос и все зависимые строки пакетами: сначала ответы
+    респондентов (и архивные) и аналитику, затем варианты ответов,
+    вопросы, прохождения и статистику, и в конце сам опрос. Память и время
+    блокировки записи ограничены размером пакета, а не размером опроса.
+    `progress(counts, duration)` вызывается после каждого пакета.
+    Возвращает количество удаленных строк по таблицам.
+    '''
+
+    counts = _purge([
+        ('respondent_answers', RespondentAnswer.objects.filter(quiz_id=quiz_id)),
+        ('archived_answers', ArchivedRespondentAnswer.objects.filter(quiz_id=quiz_id)),
+        ('answer_stats', AnswerStats.objects.filter(answer__question__quiz_id=quiz_id)),
+        ('question_stats', QuestionStats.objects.filter(question__quiz_id=quiz_id)),
+        ('answers', Answer.objects.filter(question__quiz_id=quiz_id)),
+        ('questions', Question.objects.filter(quiz_id=quiz_id)),
+        ('taken_quizzes', TakenQuiz.objects.filter(quiz_id=quiz_id)),
+        ('archived_taken_quizzes', ArchivedTakenQuiz.objects.filter(quiz_id=quiz_id)),
+        ('attempts', QuizAttempt.objects.filter(quiz_id=quiz_id)),
+        ('score_buckets', QuizScoreBucket.objects.filter(stats_id=quiz_id)),
+        ('stats', QuizStats.objects.filter(quiz_id=quiz_id)),
+    ], batch_size, progress)
+    # Зависимых строк не осталось: каскад ничего не загружает.
+    counts['quizzes'] = Quiz.all_objects.filter(pk=quiz_id).delete()[0]
+    return counts
+
+
+def _forget_answers(pks):
+    # На вопрос у респондента не больше одного ответа.
+    answers = RespondentAnswer.objects.filter(pk__in=pks)
+    attempts = QuizAttempt.objects.filter(finished_at__isnull=True)
+    attempts.filter(
+        respondent_id__in=answers.values('respondent_id'),
+        quiz_id__in=answers.values('quiz_id'), position__gt=0,
+    ).update(position=F('position') - 1)
+    attempts.filter(
+        respondent_id__in=answers.filter(is_correct=True).values('respondent_id'),
+        quiz_id__in=answers.values('quiz_id'), correct_count__gt=0,
+    ).update(correct_count=F('correct_count') - 1)
+
+
+def purge_question(question_id, batch_size=None, progress=None):
+
+    '''
+    Удаляет вопрос так же, как `purge_quiz`: ответы респондентов,
+    аналитику и варианты ответов пакетами, затем сам вопрос обычным
+    удалением, чтобы сработали сигналы сброса кэша. Счетчики незавершенных
+    попыток уменьшаются в той же транзакции, что и удаление ответов.
+    '''
+
+    counts = _purge([
+        ('respondent_answers', RespondentAnswer.objects.filter(question_id=question_id), _forget_answers),
+        ('archived_answers', ArchivedRespondentAnswer.objects.filter(question_id=question_id)),
+        ('answer_stats', AnswerStats.objects.filter(answer__question_id=question_id)),
+        ('question_stats', QuestionStats.objects.filter(question_id=question_id)),
+        ('answers', Answer.objects.filter(question_id=question_id)),
+    ], batch_size, progress)
+    counts['questions'] = Question.objects.filter(pk=question_id).delete()[0]
+    return counts
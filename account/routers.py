@@ -0,0 +1,96 @@
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.urls import Resolver404, resolve
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_database = ContextVar('read_database', default=None)
+
+
+class ReplicaRouter:
+
+    '''
+    Направляет чтение моделей приложения на реплику, но только внутри
+    запросов, которые `ReplicaMiddleware` пометил как читающие
+    с реплики. Запись всегда идет в `default`. Пользователи, сессии
+    и прочие служебные таблицы читаются только с `default`: отставание
+    реплики не должно разлогинивать только что вошедшего пользователя.
+    '''
+
+    app_label = 'account'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or model is get_user_model():
+            return None
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия `default`, объекты из обеих баз можно связывать.
+        databases = {'default', settings.REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+
+    '''
+    Включает чтение с реплики (`REPLICA_DATABASE`) для безопасных запросов
+    к представлениям с атрибутом `read_from_replica = True`, включая
+    отрисовку шаблона. После любого изменяющего запроса клиенту ставится
+    cookie, и следующие `REPLICA_PIN_SECONDS` секунд он читает с `default`,
+    то есть видит собственные изменения (read-your-writes).
+    '''
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _read_database.set(self.database_for(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _read_database.set(self.database_for(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_database.reset(token)
+        return self.pin(request, response)
+
+    def database_for(self, request):
+        if not settings.REPLICA_DATABASE or request.method not in SAFE_METHODS:
+            return None
+        if settings.REPLICA_PIN_COOKIE in request.COOKIES:
+            return None
+        try:
+            view = resolve(request.path_info).func
+        except Resolver404:
+            return None
+        if getattr(getattr(view, 'view_class', view), 'read_from_replica', False):
+            return settings.REPLICA_DATABASE
+        return None
+
+    def pin(self, request, response):
+        if settings.REPLICA_DATABASE and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,195 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+from .models import Quiz
+
+# Одна строка индекса на название опроса, вопрос и ответ. rowid кодирует
+# вид и первичный ключ строки (`pk * 4 + вид`), поэтому триггеры
+# обновляют и удаляют строки индекса по rowid, без просмотра таблицы.
+CREATE_SQL = [
+    '''
+    CREATE VIRTUAL TABLE account_quizsearch USING fts5(
+        quiz_id UNINDEXED, name, question, answer,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_quiz_insert AFTER INSERT ON account_quiz BEGIN
+        INSERT INTO account_quizsearch (rowid, quiz_id, name) VALUES (new.id * 4, new.id, new.name);
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_quiz_update AFTER UPDATE OF name ON account_quiz BEGIN
+        UPDATE account_quizsearch SET name = new.name WHERE rowid = new.id * 4;
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_quiz_delete AFTER DELETE ON account_quiz BEGIN
+        DELETE FROM account_quizsearch WHERE rowid = old.id * 4;
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_question_insert AFTER INSERT ON account_question BEGIN
+        INSERT INTO account_quizsearch (rowid, quiz_id, question) VALUES (new.id * 4 + 1, new.quiz_id, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_question_update AFTER UPDATE OF text, quiz_id ON account_question BEGIN
+        UPDATE account_quizsearch SET quiz_id = new.quiz_id, question = new.text WHERE rowid = new.id * 4 + 1;
+        UPDATE account_quizsearch SET quiz_id = new.quiz_id
+            WHERE old.quiz_id != new.quiz_id
+            AND rowid IN (SELECT id * 4 + 2 FROM account_answer WHERE question_id = new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_question_delete AFTER DELETE ON account_question BEGIN
+        DELETE FROM account_quizsearch WHERE rowid = old.id * 4 + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_answer_insert AFTER INSERT ON account_answer BEGIN
+        INSERT INTO account_quizsearch (rowid, quiz_id, answer)
+            SELECT new.id * 4 + 2, quiz_id, new.text FROM account_question WHERE id = new.question_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_answer_update AFTER UPDATE OF text, question_id ON account_answer BEGIN
+        UPDATE account_quizsearch
+            SET answer = new.text,
+                quiz_id = (SELECT quiz_id FROM account_question WHERE id = new.question_id)
+            WHERE rowid = new.id * 4 + 2;
+    END
+    ''',
+    '''
+    CREATE TRIGGER account_quizsearch_answer_delete AFTER DELETE ON account_answer BEGIN
+        DELETE FROM account_quizsearch WHERE rowid = old.id * 4 + 2;
+    END
+    ''',
+]
+
+FILL_SQL = [
+    'INSERT INTO account_quizsearch (rowid, quiz_id, name) SELECT id * 4, id, name FROM account_quiz',
+    'INSERT INTO account_quizsearch (rowid, quiz_id, question) SELECT id * 4 + 1, quiz_id, text FROM account_question',
+    '''
+    INSERT INTO account_quizsearch (rowid, quiz_id, answer)
+        SELECT a.id * 4 + 2, q.quiz_id, a.text FROM account_answer a JOIN account_question q ON q.id = a.question_id
+    ''',
+]
+
+DROP_SQL = [
+    'DROP TABLE IF EXISTS account_quizsearch',
+    *(f'DROP TRIGGER IF EXISTS account_quizsearch_{table}_{event}'
+      for table in ('quiz', 'question', 'answer') for event in ('insert', 'update', 'delete')),
+]
+
+
+OPTIMIZE_SQL = "INSERT INTO account_quizsearch (account_quizsearch) VALUES ('optimize')"
+
+# Веса столбцов для bm25: quiz_id, название, вопрос, ответ.
+SEARCH_SQL = '''
+    WITH hits AS MATERIALIZED (
+        SELECT quiz_id, bm25(account_quizsearch, 0.0, 10.0, 4.0, 1.0) AS score
+        FROM account_quizsearch
+        WHERE account_quizsearch MATCH %s
+    )
+    SELECT quiz_id, MIN(score) AS rank
+    FROM hits
+    WHERE quiz_id IN ({scope})
+    GROUP BY quiz_id
+    ORDER BY rank, quiz_id
+    LIMIT %s
+'''
+
+MAX_TERMS = 10
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def match_expression(terms):
+    # Каждое слово — отдельная фраза с поиском по префиксу, слова объединяются по И.
+    # Слова состоят только из \w, поэтому синтаксис FTS5 в них не попадает.
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def has_search_index(connection):
+    return connection.vendor == 'sqlite'
+
+
+def rebuild_search_index(using='default'):
+
+    '''
+    Пересоздает полнотекстовый индекс вместе с триггерами и заполняет
+    его заново. Нужна после восстановления из резервной копии и после
+    миграций, пересоздающих таблицы опросов, вопросов или ответов:
+    SQLite удаляет триггеры вместе со старой таблицей.
+    '''
+
+    connection = connections[using]
+    if not has_search_index(connection):
+        return False
+    with connection.cursor() as cursor:
+        for sql in DROP_SQL + CREATE_SQL + FILL_SQL + [OPTIMIZE_SQL]:
+            cursor.execute(sql)
+    return True
+
+
+def rank_quizzes(queryset, query, limit=None):
+
+    '''
+    Идентификаторы опросов из `queryset`, найденных по названию, тексту
+    вопросов и ответов, в порядке релевантности (bm25; совпадение
+    в названии весит больше, чем в вопросе, а в вопросе — больше,
+    чем в ответе). Не больше `limit` (по умолчанию `SEARCH_MAX_RESULTS`).
+    '''
+
+    terms = search_terms(query)
+    if not terms:
+        return []
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    connection = connections[queryset.db]
+    if not has_search_index(connection):
+        return fallback_rank_quizzes(queryset, terms, limit)
+
+    scope_sql, scope_params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL.format(scope=scope_sql), [match_expression(terms), *scope_params, limit])
+        return [quiz_id for quiz_id, _ in cursor.fetchall()]
+
+
+def fallback_rank_quizzes(queryset, terms, limit):
+    # Без FTS5: поиск подстрок без ранжирования, по названию.
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) \
+            | Q(questions__text__icontains=term) \
+            | Q(questions__answers__text__icontains=term)
+    matches = Quiz.objects.filter(condition).values('pk')
+    return list(queryset.filter(pk__in=matches).order_by('name', 'pk').values_list('pk', flat=True)[:limit])
+
+
+class QuizSearchResults:
+
+    '''
+    Результаты поиска для `Paginator`: упорядоченный список найденных
+    идентификаторов, а сами опросы (с аннотациями `queryset`) загружаются
+    только для запрошенной страницы.
+    '''
+
+    def __init__(self, queryset, query, limit=None):
+        self.queryset = queryset
+        self.quiz_ids = rank_quizzes(queryset, query, limit)
+
+    def __len__(self):
+        return len(self.quiz_ids)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        quiz_ids = self.quiz_ids[index]
+        quizzes = self.queryset.order_by().in_bulk(quiz_ids)
+        return [quizzes[pk] for pk in quiz_ids if pk in quizzes]
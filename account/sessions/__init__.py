@@ -0,0 +1,35 @@
+'''
+Хранилища сессий для `SESSION_ENGINE` (`account.sessions.db`,
+`account.sessions.cached_db`, `account.sessions.cache`). Это стандартные
+хранилища Django, которые не перезаписывают сессию, если ее данные
+не изменились с момента загрузки.
+'''
+
+import copy
+
+_UNSAVED = object()
+
+
+class UnchangedSessionMixin:
+
+    '''
+    `SessionMiddleware` сохраняет сессию при любом присваивании
+    (`modified`), даже если значение осталось прежним. Примесь помнит
+    данные, прочитанные из хранилища или записанные в него последними,
+    и пропускает сохранение, если они совпадают с текущими.
+    '''
+
+    _stored = _UNSAVED
+
+    def load(self):
+        data = super().load()
+        self._stored = copy.deepcopy(data)
+        return data
+
+    def save(self, must_create=False):
+        if not must_create and self.session_key is not None and self._stored == self._session:
+            return
+        super().save(must_create)
+        # `create()` сохраняет пустую сессию еще до того, как `cycle_key()`
+        # вернет в нее данные, поэтому запоминается именно записанное.
+        self._stored = copy.deepcopy(self._get_session(no_load=must_create))
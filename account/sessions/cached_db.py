@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends.cached_db import SessionStore as BaseSessionStore
+
+from . import UnchangedSessionMixin
+
+
+class SessionStore(UnchangedSessionMixin, BaseSessionStore):
+    pass
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends.db import SessionStore as BaseSessionStore
+
+from . import UnchangedSessionMixin
+
+
+class SessionStore(UnchangedSessionMixin, BaseSessionStore):
+    pass
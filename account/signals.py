@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_subject_quizzes, subjects
+from .metrics import count_query
+from .models import ArchivedTakenQuiz, Question, Quiz, Subject, TakenQuiz
+from .stats import forget_score, record_score, shift_quiz_counter
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # Обертки живут в объекте соединения и переживают переподключение.
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def subject_changed(sender, **kwargs):
+    transaction.on_commit(subjects.invalidate)
+
+
+@receiver(pre_save, sender=Quiz)
+def quiz_saving(sender, instance, **kwargs):
+    # Опрос мог сменить категорию: список прежней категории тоже устарел.
+    instance._previous_subject_id = None
+    if instance.pk is not None and not kwargs.get('raw'):
+        instance._previous_subject_id = Quiz.objects \
+            .filter(pk=instance.pk) \
+            .values_list('subject_id', flat=True) \
+            .first()
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def quiz_changed(sender, instance, **kwargs):
+    subject_ids = (instance.subject_id, getattr(instance, '_previous_subject_id', None))
+    transaction.on_commit(lambda: invalidate_subject_quizzes(*subject_ids))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    # Количество вопросов входит в строку списка опросов.
+    if Question.quiz.is_cached(instance):
+        subject_id = instance.quiz.subject_id
+    else:
+        subject_id = Quiz.objects.filter(pk=instance.quiz_id).values_list('subject_id', flat=True).first()
+    transaction.on_commit(lambda: invalidate_subject_quizzes(subject_id))
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, created, **kwargs):
+    # При загрузке фикстур счетчик приходит вместе с опросом.
+    if created and not kwargs.get('raw'):
+        shift_quiz_counter(instance.quiz_id, 'questions_count', 1)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    shift_quiz_counter(instance.quiz_id, 'questions_count', -1)
+
+
+@receiver(post_save, sender=TakenQuiz)
+def taken_quiz_saved(sender, instance, created, **kwargs):
+    if created:
+        record_score(instance.quiz_id, instance.score)
+        shift_quiz_counter(instance.quiz_id, 'taken_count', 1)
+
+
+@receiver(post_delete, sender=TakenQuiz)
+@receiver(post_delete, sender=ArchivedTakenQuiz)
+def taken_quiz_deleted(sender, instance, **kwargs):
+    forget_score(instance.quiz_id, instance.score)
+    shift_quiz_counter(instance.quiz_id, 'taken_count', -1)
@@ -0,0 +1,386 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (Count, F, FloatField, IntegerField, Max, Min,
+                              OuterRef, Q, Subquery, Sum, Value)
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Round
+
+from .models import (Answer, AnswerStats, ArchivedTakenQuiz, Question,
+                     QuestionStats, Quiz, QuizAttempt, QuizScoreBucket,
+                     QuizStats, RespondentAnswer, TakenQuiz, Watermark)
+
+
+def _bucket_expression():
+    width = 100 / QuizStats.BUCKETS
+    return Least(Cast(F('score') / width, IntegerField()), Value(QuizStats.BUCKETS - 1))
+
+
+def record_score(quiz_id, score):
+
+    '''
+    Учитывает новое прохождение опроса. Все изменения выполняются
+    выражениями `F()` в самой базе, поэтому параллельные завершения
+    опроса не теряют обновлений.
+    '''
+
+    with transaction.atomic():
+        QuizStats.objects.get_or_create(quiz_id=quiz_id)
+        QuizStats.objects.filter(pk=quiz_id).update(
+            attempts=F('attempts') + 1,
+            score_sum=F('score_sum') + score,
+            score_min=Least(Coalesce('score_min', Value(score)), Value(score)),
+            score_max=Greatest(Coalesce('score_max', Value(score)), Value(score)))
+        bucket = QuizStats.bucket_for(score)
+        QuizScoreBucket.objects.get_or_create(stats_id=quiz_id, bucket=bucket)
+        QuizScoreBucket.objects.filter(stats_id=quiz_id, bucket=bucket).update(count=F('count') + 1)
+
+
+def _remaining_score(aggregate, combine):
+    # Крайний балл по оставшимся прохождениям, включая архивные. Least
+    # и Greatest с NULL дают NULL, поэтому пустая таблица заменяется другой.
+    live, archived = (
+        Subquery(model.objects
+                 .filter(quiz_id=OuterRef('pk'))
+                 .values('quiz_id')
+                 .annotate(value=aggregate('score'))
+                 .values('value'))
+        for model in (TakenQuiz, ArchivedTakenQuiz)
+    )
+    return combine(Coalesce(live, archived), Coalesce(archived, live))
+
+
+def forget_score(quiz_id, score):
+
+    '''
+    Убирает удаленное прохождение (живое или архивное) из статистики.
+    Минимум и максимум нельзя уменьшить инкрементально, поэтому они
+    пересчитываются по оставшимся строкам обеих таблиц, но только если
+    удален крайний балл.
+    '''
+
+    with transaction.atomic():
+        QuizStats.objects.filter(pk=quiz_id).update(
+            attempts=F('attempts') - 1,
+            score_sum=F('score_sum') - score)
+        QuizScoreBucket.objects \
+            .filter(stats_id=quiz_id, bucket=QuizStats.bucket_for(score), count__gt=0) \
+            .update(count=F('count') - 1)
+        QuizStats.objects \
+            .filter(pk=quiz_id) \
+            .filter(Q(score_min__gte=score) | Q(score_max__lte=score)) \
+            .update(score_min=_remaining_score(Min, Least), score_max=_remaining_score(Max, Greatest))
+
+
+def _merge_totals(totals, row):
+    current = totals.get(row['quiz_id'])
+    if current is None:
+        totals[row['quiz_id']] = row
+    else:
+        current['attempts'] += row['attempts']
+        current['score_sum'] += row['score_sum']
+        current['score_min'] = min(current['score_min'], row['score_min'])
+        current['score_max'] = max(current['score_max'], row['score_max'])
+
+
+def rebuild_quiz_stats(quiz_ids=None):
+
+    '''
+    Полностью пересобирает статистику по таблице `TakenQuiz` и архиву
+    прохождений (по два агрегирующих запроса на таблицу). Возвращает
+    количество опросов, для которых есть прохождения.
+    '''
+
+    stats = QuizStats.objects.all()
+    tables = [TakenQuiz.objects.all(), ArchivedTakenQuiz.objects.all()]
+    if quiz_ids is not None:
+        stats = stats.filter(quiz_id__in=quiz_ids)
+        tables = [taken_quizzes.filter(quiz_id__in=quiz_ids) for taken_quizzes in tables]
+
+    with transaction.atomic():
+        totals = {}
+        buckets = defaultdict(int)
+        for taken_quizzes in tables:
+            for row in taken_quizzes \
+                    .values('quiz_id') \
+                    .annotate(attempts=Count('pk'), score_sum=Sum('score'), score_min=Min('score'), score_max=Max('score')) \
+                    .order_by():
+                _merge_totals(totals, row)
+            for row in taken_quizzes \
+                    .annotate(bucket=_bucket_expression()) \
+                    .values('quiz_id', 'bucket') \
+                    .annotate(count=Count('pk')) \
+                    .order_by():
+                buckets[row['quiz_id'], row['bucket']] += row['count']
+
+        stats.delete()
+        QuizStats.objects.bulk_create([QuizStats(**row) for row in totals.values()], batch_size=500)
+        QuizScoreBucket.objects.bulk_create([
+            QuizScoreBucket(stats_id=quiz_id, bucket=bucket, count=count)
+            for (quiz_id, bucket), count in buckets.items()
+        ], batch_size=500)
+    return len(totals)
+
+
+QUESTION_STATS_WATERMARK = 'question_stats'
+QUESTION_STATS_FIELDS = ('answered', 'correct', 'score_sum', 'score_square_sum', 'correct_score_sum')
+
+
+def _add_totals(model, rows, fields):
+    # Суммы из пакета прибавляются к уже накопленным и записываются одним upsert.
+    rows = {row.pop('key'): row for row in rows}
+    existing = model.objects.in_bulk(list(rows))
+    objects = []
+    for pk, row in rows.items():
+        obj = existing.get(pk) or model(pk=pk)
+        for field in fields:
+            setattr(obj, field, getattr(obj, field) + row[field])
+        objects.append(obj)
+    model.objects.bulk_create(
+        objects, batch_size=500, update_conflicts=True,
+        unique_fields=[model._meta.pk.name], update_fields=list(fields))
+
+
+def _question_stats_batch(start, end, quiz_ids=None, archived=False):
+
+    '''
+    Добавляет к аналитике ответы прохождений с ключами `(start, end]`
+    (и только опросов `quiz_ids`, если они заданы) двумя агрегирующими
+    запросами: по вопросам и по вариантам ответа. Ответы соединяются
+    с прохождением по респонденту и опросу, итоговый балл берется
+    из `TakenQuiz` (с `archived=True` — из архивных таблиц).
+    '''
+
+    if archived:
+        taken_quizzes, path = ArchivedTakenQuiz.objects.all(), 'respondent__archived_answers'
+    else:
+        taken_quizzes, path = TakenQuiz.objects.all(), 'respondent__quiz_answers'
+    taken_quizzes = taken_quizzes.filter(pk__gt=start, pk__lte=end)
+    if quiz_ids is not None:
+        taken_quizzes = taken_quizzes.filter(quiz_id__in=quiz_ids)
+    answers = taken_quizzes.filter(**{f'{path}__quiz_id': F('quiz_id')})
+    is_correct = Q(**{f'{path}__is_correct': True})
+    questions = answers \
+        .values(key=F(f'{path}__question_id')) \
+        .annotate(
+            answered=Count('pk'),
+            correct=Count('pk', filter=is_correct),
+            score_sum=Sum('score'),
+            score_square_sum=Sum(F('score') * F('score')),
+            correct_score_sum=Coalesce(Sum('score', filter=is_correct), 0.0)) \
+        .order_by()
+    choices = answers \
+        .values(key=F(f'{path}__answer_id')) \
+        .annotate(count=Count('pk')) \
+        .order_by()
+    _add_totals(QuestionStats, list(questions), QUESTION_STATS_FIELDS)
+    _add_totals(AnswerStats, list(choices), ('count',))
+    return taken_quizzes.count()
+
+
+def refresh_question_stats(full=False, batch_size=None):
+
+    '''
+    Обрабатывает прохождения новее сохраненного водяного знака
+    (первичного ключа последнего учтенного `TakenQuiz`) пакетами
+    по `batch_size` ключей; каждый пакет и сдвиг водяного знака —
+    одна транзакция, поэтому прерванный запуск продолжается с места
+    остановки, а параллельные запуски не учитывают пакет дважды.
+    Удаленные прохождения из сумм не вычитаются — для этого `full=True`
+    пересобирает аналитику с нуля, начиная с архива. Водяной знак по ключу
+    надежен, пока записи фиксируются в порядке ключей (SQLite пишет
+    последовательно). Возвращает количество учтенных прохождений.
+    '''
+
+    batch_size = batch_size or settings.QUESTION_STATS_BATCH_SIZE
+    if full:
+        with transaction.atomic():
+            QuestionStats.objects.all().delete()
+            AnswerStats.objects.all().delete()
+            Watermark.objects.update_or_create(name=QUESTION_STATS_WATERMARK, defaults={'position': 0})
+            _archived_question_stats(batch_size=batch_size)
+
+    last = TakenQuiz.objects.aggregate(last=Max('pk'))['last'] or 0
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = Watermark.objects.select_for_update().get_or_create(name=QUESTION_STATS_WATERMARK)
+            if watermark.position >= last:
+                break
+            end = min(watermark.position + batch_size, last)
+            processed += _question_stats_batch(watermark.position, end)
+            watermark.position = end
+            watermark.save()
+    return processed
+
+
+def _archived_question_stats(quiz_ids=None, batch_size=None):
+    # В архив попадают только прохождения, уже учтенные водяным знаком.
+    batch_size = batch_size or settings.QUESTION_STATS_BATCH_SIZE
+    last = ArchivedTakenQuiz.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last, batch_size):
+        _question_stats_batch(start, start + batch_size, quiz_ids=quiz_ids, archived=True)
+
+
+def rebuild_question_stats(quiz_ids):
+
+    '''
+    Пересобирает аналитику вопросов указанных опросов по прохождениям,
+    уже учтенным водяным знаком, например после пересчета баллов.
+    Водяной знак блокируется, поэтому параллельный
+    `refresh_question_stats` не учтет эти прохождения повторно.
+    '''
+
+    with transaction.atomic():
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(name=QUESTION_STATS_WATERMARK)
+        QuestionStats.objects.filter(question__quiz_id__in=quiz_ids).delete()
+        AnswerStats.objects.filter(answer__question__quiz_id__in=quiz_ids).delete()
+        _archived_question_stats(quiz_ids=quiz_ids)
+        _question_stats_batch(0, watermark.position, quiz_ids=quiz_ids)
+
+
+def _respondent_answers(**filters):
+    return RespondentAnswer.objects \
+        .filter(respondent_id=OuterRef('respondent_id'), quiz_id=OuterRef('quiz_id'), **filters) \
+        .values('respondent_id') \
+        .order_by()
+
+
+def _recompute_scores_batch(quiz_id, respondent_ids):
+
+    '''
+    Пересчитывает баллы респондентов `respondent_ids` тремя запросами
+    UPDATE: признак правильности в `RespondentAnswer` копируется
+    из текущего ответа, балл прохождения — доля правильных ответов
+    респондента, а у незавершенных попыток — счетчик правильных ответов.
+    Обновляются только изменившиеся строки.
+    '''
+
+    is_correct = Answer.objects.filter(pk=OuterRef('answer_id')).values('is_correct')
+    answers = RespondentAnswer.objects \
+        .filter(respondent_id__in=respondent_ids, quiz_id=quiz_id) \
+        .exclude(is_correct=F('answer__is_correct')) \
+        .update(is_correct=Subquery(is_correct))
+
+    # Тот же порядок операций, что и в `QuizAttempt.finish`.
+    correct = Count('pk', filter=Q(is_correct=True))
+    score = _respondent_answers() \
+        .annotate(value=Round(Cast(correct, FloatField()) / Count('pk') * 100.0, 2)) \
+        .values('value')
+    score = Coalesce(Subquery(score), 0.0)
+    scores = TakenQuiz.objects \
+        .filter(respondent_id__in=respondent_ids, quiz_id=quiz_id) \
+        .exclude(score=score) \
+        .update(score=score)
+
+    correct_count = Coalesce(Subquery(_respondent_answers(is_correct=True).annotate(value=Count('pk')).values('value')), 0)
+    QuizAttempt.objects \
+        .filter(respondent_id__in=respondent_ids, quiz_id=quiz_id, finished_at__isnull=True) \
+        .exclude(correct_count=correct_count) \
+        .update(correct_count=correct_count)
+    return answers, scores
+
+
+def recompute_scores(quiz_id, batch_size=None):
+
+    '''
+    Пересчитывает баллы всех прохождений опроса (и счетчики незавершенных
+    попыток) после изменения правильных ответов или удаления вопросов.
+    Респонденты обрабатываются пакетами по `batch_size`, каждый пакет —
+    отдельная короткая транзакция, поэтому блокировка записи не держится
+    на весь опрос. Пакет задается списком ключей, а не диапазоном: так
+    запросы идут по индексам, начинающимся с респондента. Баллы меняются
+    запросами UPDATE без сигналов, поэтому после пересчета статистика
+    опроса и аналитика вопросов пересобираются. Архивные прохождения
+    (`account.archive`) не пересчитываются. Возвращает количество
+    измененных ответов и баллов.
+    '''
+
+    batch_size = batch_size or settings.SCORE_RECOMPUTE_BATCH_SIZE
+    respondent_ids = list(TakenQuiz.objects
+                          .filter(quiz_id=quiz_id)
+                          .order_by('respondent_id')
+                          .values_list('respondent_id', flat=True))
+    respondent_ids += QuizAttempt.objects \
+        .filter(quiz_id=quiz_id, finished_at__isnull=True) \
+        .order_by('respondent_id') \
+        .values_list('respondent_id', flat=True)
+
+    answers = scores = 0
+    for start in range(0, len(respondent_ids), batch_size):
+        with transaction.atomic():
+            changed = _recompute_scores_batch(quiz_id, respondent_ids[start:start + batch_size])
+        answers += changed[0]
+        scores += changed[1]
+
+    if answers or scores:
+        rebuild_quiz_stats([quiz_id])
+        rebuild_question_stats([quiz_id])
+    return answers, scores
+
+
+QUIZ_COUNTERS = {'questions_count': (Question, ), 'taken_count': (TakenQuiz, ArchivedTakenQuiz)}
+
+
+def shift_quiz_counter(quiz_id, field, delta):
+
+    '''
+    Изменяет счетчик опроса (`questions_count` или `taken_count`)
+    на `delta` одним UPDATE с `F()`, поэтому параллельные изменения
+    не теряются. Счетчик не опускается ниже нуля: такое расхождение
+    исправит `repair_quiz_counters`.
+    '''
+
+    queryset = Quiz.all_objects.filter(pk=quiz_id)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def _count_by_quiz(models):
+    counts = []
+    for model in models:
+        rows = model.objects \
+            .filter(quiz_id=OuterRef('pk')) \
+            .order_by() \
+            .values('quiz_id') \
+            .annotate(count=Count('pk')) \
+            .values('count')
+        counts.append(Coalesce(Subquery(rows), 0))
+    return sum(counts[1:], counts[0])
+
+
+def quiz_counter_mismatches(quiz_ids=None):
+
+    '''
+    Опросы (включая ожидающие очистки), у которых счетчики расходятся
+    с количеством строк (прохождения считаются вместе с архивом): словари с ключами `pk`, `name`, значениями
+    счетчиков и фактическими количествами (`actual_questions_count`,
+    `actual_taken_count`).
+    '''
+
+    queryset = Quiz.all_objects \
+        .annotate(**{f'actual_{field}': _count_by_quiz(models) for field, models in QUIZ_COUNTERS.items()}) \
+        .filter(~Q(questions_count=F('actual_questions_count')) | ~Q(taken_count=F('actual_taken_count'))) \
+        .order_by('pk')
+    if quiz_ids is not None:
+        queryset = queryset.filter(pk__in=quiz_ids)
+    return list(queryset.values(
+        'pk', 'name', 'questions_count', 'actual_questions_count', 'taken_count', 'actual_taken_count'))
+
+
+def repair_quiz_counters(quiz_ids=None):
+
+    '''
+    Исправляет расходящиеся счетчики одним UPDATE с подзапросами:
+    значения считаются в момент записи, поэтому параллельные приращения
+    не затираются. Возвращает список исправленных опросов
+    (см. `quiz_counter_mismatches`).
+    '''
+
+    mismatches = quiz_counter_mismatches(quiz_ids)
+    if mismatches:
+        Quiz.all_objects \
+            .filter(pk__in=[row['pk'] for row in mismatches]) \
+            .update(**{field: _count_by_quiz(models) for field, models in QUIZ_COUNTERS.items()})
+    return mismatches
@@ -0,0 +1,14 @@
+from django import template
+
+from account.cache import subjects
+
+register = template.Library()
+
+
+@register.filter
+def subject_badge(subject_id):
+    '''
+    Готовый HTML-бейдж категории по ее `pk` из справочника категорий,
+    без обращения к таблице `Subject`.
+    '''
+    return subjects.badge(subject_id)
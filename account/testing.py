@@ -0,0 +1,53 @@
+import importlib
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test import override_settings
+from django.urls import clear_url_caches
+
+
+def reload_urlconf():
+    importlib.reload(importlib.import_module('account.urls'))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@contextmanager
+def async_views(enabled=True):
+
+    '''
+    Переключает маршруты респондента на асинхронные представления
+    (или обратно) внутри одного процесса. `ASYNC_VIEWS` читается при
+    импорте URLconf, поэтому модули маршрутов перезагружаются.
+    '''
+
+    try:
+        with override_settings(ASYNC_VIEWS=enabled):
+            reload_urlconf()
+            yield
+    finally:
+        reload_urlconf()
+
+
+class RequestBudgetMixin:
+
+    '''
+    Проверки бюджетов запросов для `TestCase`. По умолчанию сравнивается
+    только количество SQL-запросов: оно детерминировано и сразу ловит N+1,
+    а время в тестовом окружении слишком шумное.
+    '''
+
+    def assertWithinBudget(self, response, budget=None, timing=False):
+        metrics = getattr(response, 'request_metrics', None)
+        if metrics is None:
+            self.fail('В ответе нет request_metrics: RequestMetricsMiddleware не подключен.')
+        if budget is None:
+            if metrics.url_name not in settings.REQUEST_BUDGETS:
+                self.fail(f'Для {metrics.url_name} не задан бюджет в REQUEST_BUDGETS.')
+            budget = settings.REQUEST_BUDGETS[metrics.url_name]
+        if not timing:
+            budget = {key: limit for key, limit in budget.items() if not key.endswith('_ms')}
+        violations = metrics.budget_violations(budget)
+        if violations:
+            details = ', '.join(f'{key}={actual} (лимит {limit})' for key, (actual, limit) in violations.items())
+            self.fail(f'{metrics.url_name} превышает бюджет: {details}')
@@ -1,3 +1,1613 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import statistics
+import tempfile
+import tracemalloc
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import bench
+from .cache import (aget_quiz_content, get_quiz_content, quiz_rows_cache_stats,
+                    reset_quiz_rows_cache_stats, subjects)
+from .forms import NO_CORRECT_ANSWER_MESSAGE, TakeQuizForm
+from .importers import import_quizzes
+from .jobs import JOBS, claim_next_job, enqueue, execute_job, requeue_stale_jobs
+from .archive import archive_attempts
+from .models import (Answer, AnswerStats, ArchivedRespondentAnswer,
+                     ArchivedTakenQuiz, Job, Question, QuestionStats, Quiz,
+                     QuizAttempt, QuizScoreBucket, QuizStats, Respondent,
+                     RespondentAnswer, Subject, TakenQuiz, User)
+from .pagination import KeysetPaginator, KeysetSequencePaginator
+from .purge import purge_quiz
+from .sessions import db as db_sessions
+from .stats import recompute_scores, refresh_question_stats
+from .testing import RequestBudgetMixin, async_views
+from .views import respondents, respondents_async
+
+
+def create_moderator(username='moderator'):
+    return User.objects.create_user(username=username, is_moderator=True)
+
+
+def create_respondent(username='respondent', subjects=()):
+    user = User.objects.create_user(username=username, is_respondent=True)
+    respondent = Respondent.objects.create(user=user)
+    respondent.category.add(*subjects)
+    return respondent
+
+
+def create_quiz(owner, subject, name='Quiz', questions=1, answers=2, **kwargs):
+    quiz = Quiz.objects.create(owner=owner, subject=subject, name=name, **kwargs)
+    for i in range(questions):
+        question = Question.objects.create(quiz=quiz, text=f'Question {i}')
+        for j in range(answers):
+            Answer.objects.create(question=question, text=f'Answer {j}', is_correct=(j == 0))
+    return quiz
+
+
+def bulk_create_respondents(count, prefix='bulk'):
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}{i}', is_respondent=True) for i in range(count)
+    ])
+    return Respondent.objects.bulk_create([Respondent(user=user) for user in users])
+
+
+def answer_formset_data(question, text=None, correct=None):
+    '''
+    POST-данные для `question_change`: текст вопроса и формсет
+    его существующих ответов. `correct` — pk ответов, отмеченных верными.
+    '''
+    answers = list(question.answers.order_by('pk'))
+    data = {
+        'text': text or question.text,
+        'answers-TOTAL_FORMS': len(answers),
+        'answers-INITIAL_FORMS': len(answers),
+        'answers-MIN_NUM_FORMS': 2,
+        'answers-MAX_NUM_FORMS': 10,
+    }
+    for i, answer in enumerate(answers):
+        data[f'answers-{i}-id'] = answer.pk
+        data[f'answers-{i}-text'] = answer.text
+        is_correct = answer.is_correct if correct is None else answer.pk in correct
+        if is_correct:
+            data[f'answers-{i}-is_correct'] = 'on'
+    return data
+
+
+class BaseTestCase(TestCase):
+    def setUp(self):
+        # Первичные ключи повторяются между тестами, а кэш — нет.
+        cache.clear()
+        reset_quiz_rows_cache_stats()
+
+
+class RespondentQuizListTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.respondent = create_respondent(subjects=[self.subject])
+        self.client.force_login(self.respondent.user)
+        self.url = reverse('respondents:quiz_list')
+
+    def collect_pages(self, page_size):
+        names = []
+        params = {}
+        with mock.patch.object(respondents.QuizListView, 'paginate_by', page_size):
+            while True:
+                response = self.client.get(self.url, params)
+                page = response.context['page_obj']
+                names.extend(quiz.name for quiz in page)
+                if not page.has_next():
+                    return names, response
+                params = {'after': page.next_cursor}
+
+    def test_pages_follow_name_and_pk_order(self):
+        for i in range(7):
+            create_quiz(self.moderator, self.subject, name=f'Quiz {i % 3}')
+        names, last_response = self.collect_pages(page_size=3)
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), 7)
+
+        page = last_response.context['page_obj']
+        with mock.patch.object(respondents.QuizListView, 'paginate_by', 3):
+            response = self.client.get(self.url, {'before': page.previous_cursor})
+        self.assertEqual([quiz.name for quiz in response.context['page_obj']], names[3:6])
+
+    def test_only_open_untaken_quizzes_with_questions(self):
+        today = timezone.localdate()
+        yesterday = today - datetime.timedelta(days=1)
+        create_quiz(self.moderator, self.subject, name='Open')
+        create_quiz(self.moderator, self.subject, name='Inactive', is_active=False)
+        create_quiz(self.moderator, self.subject, name='Finished', start_date=yesterday, end_date=yesterday)
+        create_quiz(self.moderator, self.subject, name='Empty', questions=0)
+        taken = create_quiz(self.moderator, self.subject, name='Taken')
+        TakenQuiz.objects.create(respondent=self.respondent, quiz=taken, score=100)
+        create_quiz(self.moderator, Subject.objects.create(name='Other'), name='Other subject')
+
+        names, _ = self.collect_pages(page_size=20)
+        self.assertEqual(names, ['Open'])
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for i in range(30):
+            create_quiz(self.moderator, self.subject, name=f'Quiz {i:02}')
+        self.client.get(self.url)
+        counts = []
+        for page_size in (5, 25):
+            with mock.patch.object(respondents.QuizListView, 'paginate_by', page_size):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(self.url)
+            self.assertEqual(len(response.context['quizzes']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(self.url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_wrong_value_types_returns_404(self):
+        create_quiz(self.moderator, self.subject)
+        for values in ([1, 1], [None, None], ['Quiz', 'pk']):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for param in ('after', 'before'):
+                response = self.client.get(self.url, {param: cursor})
+                self.assertEqual(response.status_code, 404, (param, values))
+
+
+class TakeQuizTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.respondent = create_respondent(subjects=[self.subject])
+        self.quiz = create_quiz(self.moderator, self.subject, questions=3, answers=3)
+        self.url = reverse('respondents:take_quiz', args=[self.quiz.pk])
+        self.client.force_login(self.respondent.user)
+
+    def answer_current_question(self, correct=True):
+        question = self.client.get(self.url).context['question']
+        answer = next(answer for answer in question.answers if answer.is_correct == correct)
+        return self.client.post(self.url, {TakeQuizForm.field_name(question): answer.pk})
+
+    def test_walkthrough_records_answers_and_score(self):
+        self.answer_current_question(correct=True)
+        self.answer_current_question(correct=False)
+        response = self.answer_current_question(correct=True)
+        self.assertRedirects(response, reverse('respondents:quiz_list'))
+        self.assertEqual(RespondentAnswer.objects.filter(respondent=self.respondent).count(), 3)
+        self.assertEqual(TakenQuiz.objects.get(respondent=self.respondent, quiz=self.quiz).score, 66.67)
+
+    def test_attempt_tracks_position_and_score(self):
+        self.answer_current_question(correct=True)
+        self.answer_current_question(correct=False)
+        attempt = QuizAttempt.objects.get(respondent=self.respondent, quiz=self.quiz)
+        self.assertEqual((attempt.position, attempt.correct_count), (2, 1))
+        self.assertIsNone(attempt.finished_at)
+
+        self.answer_current_question(correct=True)
+        attempt.refresh_from_db()
+        self.assertIsNotNone(attempt.finished_at)
+
+    def test_abandoned_attempt_resumes_at_cursor(self):
+        self.answer_current_question()
+        self.client.logout()
+        self.client.force_login(self.respondent.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['question'], get_quiz_content(self.quiz.pk).questions[1])
+
+    def moderator_post(self, url, data=None):
+        self.client.force_login(self.moderator)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, data or {})
+        self.client.force_login(self.respondent.user)
+
+    def test_question_added_mid_attempt_is_asked(self):
+        self.answer_current_question()
+        # Новый вопрос встает в снимке перед уже отвеченным.
+        added = Question.objects.create(quiz=self.quiz, text='A new question')
+        Answer.objects.create(question=added, text='Right', is_correct=True)
+        Answer.objects.create(question=added, text='Wrong', is_correct=False)
+        self.moderator_post(
+            reverse('moderators:question_change', args=[self.quiz.pk, added.pk]), answer_formset_data(added))
+
+        self.assertEqual(self.client.get(self.url).context['question'].pk, added.pk)
+        for _ in range(3):
+            response = self.answer_current_question()
+        self.assertRedirects(response, reverse('respondents:quiz_list'))
+        self.assertEqual(RespondentAnswer.objects.filter(respondent=self.respondent).count(), 4)
+        self.assertEqual(TakenQuiz.objects.get(respondent=self.respondent, quiz=self.quiz).score, 100.0)
+
+    def test_question_deleted_mid_attempt_does_not_skip_unanswered(self):
+        self.answer_current_question()
+        answered = self.quiz.questions.get(text='Question 0')
+        self.moderator_post(reverse('moderators:question_delete', args=[self.quiz.pk, answered.pk]))
+
+        self.assertEqual(self.client.get(self.url).context['question'].text, 'Question 1')
+
+    def test_deleting_answered_question_keeps_score_in_range(self):
+        self.answer_current_question()
+        answered = self.quiz.questions.get(text='Question 0')
+        self.moderator_post(reverse('moderators:question_delete', args=[self.quiz.pk, answered.pk]))
+        attempt = QuizAttempt.objects.get(respondent=self.respondent, quiz=self.quiz)
+        self.assertEqual((attempt.position, attempt.correct_count), (0, 0))
+
+        self.answer_current_question(correct=True)
+        self.answer_current_question(correct=False)
+        self.assertEqual(TakenQuiz.objects.get(respondent=self.respondent, quiz=self.quiz).score, 50.0)
+
+    def test_empty_quiz_is_not_finished(self):
+        empty = create_quiz(self.moderator, self.subject, name='Empty', questions=0)
+        response = self.client.get(reverse('respondents:take_quiz', args=[empty.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(QuizAttempt.objects.filter(quiz=empty).exists())
+        self.assertFalse(TakenQuiz.objects.filter(quiz=empty).exists())
+
+    def test_stale_step_does_not_advance_twice(self):
+        question = self.client.get(self.url).context['question']
+        answer = question.answers[0]
+        attempt = QuizAttempt.objects.get(respondent=self.respondent, quiz=self.quiz)
+        self.assertTrue(attempt.advance(1, answer.is_correct))
+        stale = QuizAttempt.objects.get(pk=attempt.pk)
+        stale.position -= 1
+        self.assertFalse(stale.advance(1, answer.is_correct))
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.position, 1)
+
+    def test_warm_cache_step_does_not_touch_content_tables(self):
+        get_quiz_content(self.quiz.pk)
+        content_tables = (Question._meta.db_table, Answer._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            self.answer_current_question()
+        for query in queries:
+            for table in content_tables:
+                self.assertNotIn(f'"{table}"', query['sql'])
+
+    def test_answer_from_another_question_is_rejected(self):
+        question = self.client.get(self.url).context['question']
+        other = Answer.objects.exclude(question=question.pk).first()
+        response = self.client.post(self.url, {TakeQuizForm.field_name(question): other.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(RespondentAnswer.objects.exists())
+
+    def test_moderator_edits_invalidate_snapshot(self):
+        version = get_quiz_content(self.quiz.pk).version
+        self.client.force_login(self.moderator)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('moderators:question_add', args=[self.quiz.pk]), {'text': 'A new question'})
+        content = get_quiz_content(self.quiz.pk)
+        self.assertNotEqual(content.version, version)
+        self.assertIn('A new question', [question.text for question in content.questions])
+
+        question = Question.objects.get(text='A new question')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('moderators:question_delete', args=[self.quiz.pk, question.pk]))
+        content = get_quiz_content(self.quiz.pk)
+        self.assertNotIn('A new question', [question.text for question in content.questions])
+
+        question = self.quiz.questions.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('moderators:question_change', args=[self.quiz.pk, question.pk]),
+                answer_formset_data(question, text='Edited'))
+        content = get_quiz_content(self.quiz.pk)
+        self.assertIn('Edited', [question.text for question in content.questions])
+
+
+class JobTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, Subject.objects.create(name='Subject'))
+        self.client.force_login(self.moderator)
+
+    def test_worker_runs_queued_jobs(self):
+        respondent = create_respondent()
+        TakenQuiz.objects.create(respondent=respondent, quiz=self.quiz, score=50)
+        QuizStats.objects.all().delete()
+        job = enqueue('rebuild_quiz_stats', owner=self.moderator, quiz_ids=[self.quiz.pk])
+        self.assertEqual(enqueue('rebuild_quiz_stats', owner=self.moderator, unique=True, quiz_ids=[self.quiz.pk]), job)
+
+        out = io.StringIO()
+        call_command('run_workers', processes=0, once=True, stdout=out)
+        self.assertIn('Выполнено задач: 1.', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.result, {'quizzes': 1})
+        self.assertEqual(QuizStats.objects.get(pk=self.quiz.pk).attempts, 1)
+        self.assertGreater(job.metrics['queries'], 0)
+        self.assertIn('wait_ms', job.metrics)
+        self.assertIsNone(claim_next_job())
+
+    def test_failed_job_is_retried_then_fails(self):
+        handler = mock.Mock(side_effect=ValueError('boom'))
+        with mock.patch.dict(JOBS, {'broken': handler}), override_settings(JOB_RETRY_DELAY=0), \
+                self.assertLogs('account.jobs', 'WARNING') as logs:
+            job = enqueue('broken', max_attempts=2, value=1)
+            self.assertEqual(execute_job(claim_next_job().pk), Job.QUEUED)
+            self.assertEqual(execute_job(claim_next_job().pk), Job.FAILED)
+        self.assertEqual([json.loads(line.split(':', 2)[2])['status'] for line in logs.output], ['queued', 'failed'])
+        handler.assert_called_with(value=1)
+        job.refresh_from_db()
+        self.assertEqual((job.attempts, job.error_message), (2, 'ValueError: boom'))
+
+    def test_stale_running_job_is_requeued(self):
+        job = enqueue('refresh_question_stats')
+        claim_next_job()
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_next_job(), job)
+
+    def test_moderator_starts_and_polls_job(self):
+        url = reverse('moderators:quiz_job_start', args=[self.quiz.pk, 'rebuild_quiz_stats'])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        response = self.client.post(url)
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('moderators:job_detail', args=[job.pk]))
+        self.assertEqual(job.params, {'quiz_ids': [self.quiz.pk]})
+
+        status_url = reverse('moderators:job_status', args=[job.pk])
+        self.assertEqual(self.client.get(status_url).json()['status'], Job.QUEUED)
+        execute_job(claim_next_job().pk)
+        data = self.client.get(status_url).json()
+        self.assertEqual((data['status'], data['finished']), (Job.DONE, True))
+
+        self.client.force_login(create_moderator('other'))
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+
+class ScoreRecomputeTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, Subject.objects.create(name='Subject'), questions=3)
+        self.questions = list(self.quiz.questions.order_by('pk'))
+        self.answers = {question.pk: list(question.answers.order_by('pk')) for question in self.questions}
+        self.respondents = [create_respondent(f'respondent{i}') for i in range(5)]
+        for i, respondent in enumerate(self.respondents):
+            # Респондент i выбирает второй вариант в первых i вопросах.
+            chosen = [self.answers[question.pk][int(n < i)] for n, question in enumerate(self.questions)]
+            for answer in chosen:
+                RespondentAnswer.objects.create(respondent=respondent, answer=answer)
+            attempt = QuizAttempt.objects.create(
+                respondent=respondent, quiz=self.quiz, position=3,
+                correct_count=sum(answer.is_correct for answer in chosen))
+            if i < 4:
+                attempt.finish(len(self.questions))
+
+    def expected_scores(self):
+        correct = {answer.pk for answer in Answer.objects.filter(is_correct=True)}
+        scores = {}
+        for taken_quiz in TakenQuiz.objects.filter(quiz=self.quiz):
+            answers = RespondentAnswer.objects.filter(respondent_id=taken_quiz.respondent_id, quiz=self.quiz)
+            scores[taken_quiz.respondent_id] = round(
+                sum(answer.answer_id in correct for answer in answers) / len(answers) * 100.0, 2)
+        return scores
+
+    def actual_scores(self):
+        return dict(TakenQuiz.objects.filter(quiz=self.quiz).values_list('respondent_id', 'score'))
+
+    def test_answer_key_change_queues_recompute(self):
+        question = self.questions[0]
+        first, second = self.answers[question.pk]
+        self.client.force_login(self.moderator)
+        url = reverse('moderators:question_change', args=[self.quiz.pk, question.pk])
+        self.client.post(url, answer_formset_data(question, correct={second.pk}))
+        self.client.post(url, answer_formset_data(question, correct={first.pk, second.pk}))
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.params), ('recompute_scores', {'quiz_ids': [self.quiz.pk]}))
+
+        self.assertNotEqual(self.actual_scores(), self.expected_scores())
+        refresh_question_stats()
+        execute_job(claim_next_job().pk)
+        self.assertEqual(self.actual_scores(), self.expected_scores())
+        self.assertEqual(RespondentAnswer.objects.filter(question=question, is_correct=False).count(), 0)
+        stats = QuizStats.objects.get(pk=self.quiz.pk)
+        self.assertAlmostEqual(stats.score_sum, sum(self.expected_scores().values()))
+        self.assertEqual(QuestionStats.objects.get(pk=question.pk).percent_correct, 100.0)
+
+        # Текст вопроса без изменения ответов пересчет не запускает.
+        self.client.post(url, answer_formset_data(question, text='Renamed'))
+        self.assertFalse(Job.objects.filter(status=Job.QUEUED).exists())
+
+    def test_batches_match_single_pass(self):
+        Answer.objects.filter(question__quiz=self.quiz).update(is_correct=~F('is_correct'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(recompute_scores(self.quiz.pk, batch_size=2), (15, 4))
+        self.assertEqual(self.actual_scores(), self.expected_scores())
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 3 * 3)
+        self.assertEqual(recompute_scores(self.quiz.pk, batch_size=2), (0, 0))
+        # Незавершенная попытка продолжает с пересчитанным счетчиком.
+        self.assertEqual(QuizAttempt.objects.get(respondent=self.respondents[4]).correct_count, 3)
+
+    def test_question_delete_and_command(self):
+        self.client.force_login(self.moderator)
+        self.client.post(reverse('moderators:question_delete', args=[self.quiz.pk, self.questions[2].pk]))
+        self.assertTrue(Job.objects.filter(name='recompute_scores').exists())
+        out = io.StringIO()
+        call_command('recompute_scores', stdout=out)
+        self.assertIn('баллов: 2', out.getvalue())
+        self.assertEqual(self.actual_scores(), self.expected_scores())
+
+
+class PurgeTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.subject = Subject.objects.create(name='Subject')
+        self.quiz = create_quiz(self.moderator, self.subject, questions=2)
+        self.other = create_quiz(self.moderator, self.subject, name='Other')
+        self.respondents = [create_respondent(f'respondent{i}', subjects=[self.subject]) for i in range(3)]
+        for respondent in self.respondents:
+            for quiz in (self.quiz, self.other):
+                for question in quiz.questions.all():
+                    RespondentAnswer.objects.create(respondent=respondent, answer=question.answers.first())
+                QuizAttempt.objects.create(respondent=respondent, quiz=quiz, position=2).finish(2)
+        refresh_question_stats()
+
+    def remaining(self, quiz_id):
+        return [
+            RespondentAnswer.objects.filter(quiz_id=quiz_id).count(),
+            Answer.objects.filter(question__quiz_id=quiz_id).count(),
+            QuestionStats.objects.filter(question__quiz_id=quiz_id).count(),
+            TakenQuiz.objects.filter(quiz_id=quiz_id).count(),
+            QuizScoreBucket.objects.filter(stats_id=quiz_id).count(),
+            Quiz.all_objects.filter(pk=quiz_id).count(),
+        ]
+
+    @override_settings(PURGE_BATCH_SIZE=2)
+    def test_quiz_is_hidden_then_purged_in_batches(self):
+        self.client.force_login(self.moderator)
+        response = self.client.post(reverse('moderators:quiz_delete', args=[self.quiz.pk]), follow=True)
+        self.assertContains(response, f'Опрос {self.quiz.name} успешно удален!')
+        self.assertEqual([quiz.pk for quiz in response.context['quizzes']], [self.other.pk])
+        self.assertEqual(self.remaining(self.quiz.pk), [6, 4, 2, 3, 1, 1])
+
+        self.client.force_login(self.respondents[0].user)
+        self.assertEqual(self.client.get(reverse('respondents:take_quiz', args=[self.quiz.pk])).status_code, 404)
+        response = self.client.get(reverse('respondents:taken_quiz_list'))
+        self.assertEqual([taken_quiz.quiz_id for taken_quiz in response.context['taken_quizzes']], [self.other.pk])
+
+        job = Job.objects.get(name='purge_quiz')
+        with CaptureQueriesContext(connection) as queries, mock.patch('account.jobs.report_progress') as progress:
+            execute_job(claim_next_job().pk)
+        self.assertEqual(self.remaining(self.quiz.pk), [0, 0, 0, 0, 0, 0])
+        self.assertEqual(self.remaining(self.other.pk), [3, 2, 1, 3, 1, 1])
+        job.refresh_from_db()
+        self.assertEqual(job.result['respondent_answers'], 6)
+        self.assertEqual(job.result['quizzes'], 1)
+        # Ответы респондентов удаляются тремя пакетами по два ключа.
+        deletes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('DELETE FROM "account_respondentanswer" WHERE "account_respondentanswer"."id" IN')
+        ]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(progress.call_args_list[2].args[0]['respondent_answers'], 6)
+
+    def test_question_delete_and_command(self):
+        question = self.quiz.questions.first()
+        self.client.force_login(self.moderator)
+        self.client.post(reverse('moderators:question_delete', args=[self.quiz.pk, question.pk]))
+        self.assertFalse(Question.objects.filter(pk=question.pk).exists())
+        self.assertEqual(RespondentAnswer.objects.filter(quiz=self.quiz).count(), 3)
+
+        Quiz.objects.filter(pk=self.other.pk).update(deleted_at=timezone.now())
+        out = io.StringIO()
+        call_command('purge_quizzes', stdout=out)
+        self.assertIn(f'Опрос #{self.other.pk} удален', out.getvalue())
+        self.assertEqual(self.remaining(self.other.pk), [0, 0, 0, 0, 0, 0])
+        self.assertEqual(Quiz.objects.get().pk, self.quiz.pk)
+
+
+class ArchiveTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.subject = Subject.objects.create(name='Subject')
+        today = timezone.localdate()
+        self.closed = create_quiz(
+            self.moderator, self.subject, name='Closed', questions=2,
+            start_date=today - datetime.timedelta(days=30), end_date=today - datetime.timedelta(days=10))
+        self.open = create_quiz(self.moderator, self.subject, name='Open')
+        self.respondents = [create_respondent(f'respondent{i}', subjects=[self.subject]) for i in range(3)]
+        for i, respondent in enumerate(self.respondents):
+            for quiz in (self.closed, self.open):
+                for question in quiz.questions.all():
+                    RespondentAnswer.objects.create(respondent=respondent, answer=question.answers.all()[i % 2])
+                attempt = QuizAttempt.objects.create(respondent=respondent, quiz=quiz)
+                attempt.correct_count = RespondentAnswer.objects.filter(
+                    respondent=respondent, quiz=quiz, is_correct=True).count()
+                attempt.finish(quiz.questions.count())
+
+    def snapshot(self):
+        stats = QuizStats.objects.get(quiz=self.closed)
+        return (
+            (stats.attempts, stats.score_sum, stats.score_min, stats.score_max), stats.histogram(),
+            sorted(QuestionStats.objects.filter(question__quiz=self.closed).values_list('answered', 'correct', 'score_sum')),
+            sorted(AnswerStats.objects.filter(answer__question__quiz=self.closed).values_list('answer_id', 'count')),
+        )
+
+    def test_command_moves_closed_quizzes_and_reports_shrink(self):
+        out = io.StringIO()
+        with self.settings(ARCHIVE_BATCH_SIZE=2):
+            call_command('archive_attempts', before=timezone.localdate().isoformat(), stdout=out)
+        self.assertIn('Опросов перенесено в архив: 1.', out.getvalue())
+        self.assertIn('taken_quizzes: 6 → 3 строк (−50.0%)', out.getvalue())
+        self.assertIn('respondent_answers: 9 → 3 строк (−66.7%)', out.getvalue())
+
+        self.assertFalse(TakenQuiz.objects.filter(quiz=self.closed).exists())
+        self.assertFalse(RespondentAnswer.objects.filter(quiz_id=self.closed.pk).exists())
+        self.assertFalse(QuizAttempt.objects.filter(quiz=self.closed).exists())
+        self.assertEqual(self.closed.archived_taken_quizzes.count(), 3)
+        self.assertEqual(TakenQuiz.objects.filter(quiz=self.open).count(), 3)
+
+        # Статистика, аналитика и счетчики учитывают архив и после пересборки.
+        expected = self.snapshot()
+        call_command('rebuild_quiz_stats', stdout=io.StringIO())
+        refresh_question_stats(full=True)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(self.snapshot()[0][0], 3)
+        call_command('check_quiz_counters', stdout=io.StringIO())
+
+    def test_deletes_keep_stats_of_partly_archived_quiz(self):
+        archive_attempts(timezone.localdate())
+        late = create_respondent('late')
+        TakenQuiz.objects.create(respondent=late, quiz=self.closed, score=0.0).delete()
+        stats = QuizStats.objects.get(quiz=self.closed)
+        self.assertEqual((stats.attempts, stats.score_min, stats.score_max), (3, 0.0, 100.0))
+
+        # Архивное прохождение удаляется каскадом вместе с респондентом.
+        self.respondents[1].user.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.attempts, stats.score_min, stats.score_max), (2, 100.0, 100.0))
+        self.closed.refresh_from_db()
+        self.assertEqual(self.closed.taken_count, 2)
+        call_command('check_quiz_counters', stdout=io.StringIO())
+
+    def test_archived_results_are_shown_on_demand(self):
+        archive_attempts(timezone.localdate())
+        respondent = self.respondents[0]
+        self.client.force_login(respondent.user)
+        response = self.client.get(reverse('respondents:taken_quiz_list'))
+        self.assertEqual([taken_quiz.quiz.name for taken_quiz in response.context['taken_quizzes']], ['Open'])
+        self.assertNotIn('archived_quizzes', response.context)
+        response = self.client.get(reverse('respondents:taken_quiz_list'), {'archived': '1'})
+        self.assertEqual([taken_quiz.quiz.name for taken_quiz in response.context['archived_quizzes']], ['Closed'])
+
+        # Прохождение из архива не дает пройти опрос заново.
+        response = self.client.get(reverse('respondents:take_quiz', args=[self.closed.pk]))
+        self.assertRedirects(response, reverse('respondents:taken_quiz_list'))
+        self.assertFalse(TakenQuiz.objects.filter(quiz=self.closed).exists())
+
+        self.client.force_login(self.moderator)
+        url = reverse('moderators:quiz_results', args=[self.closed.pk])
+        response = self.client.get(url)
+        self.assertEqual((list(response.context['taken_quizzes']), response.context['total_taken_quizzes']), ([], 3))
+        response = self.client.get(url, {'archived': '1'})
+        self.assertEqual(len(response.context['archived_quizzes']), 3)
+        self.assertContains(response, respondent.user.username)
+
+        purge_quiz(self.closed.pk)
+        self.assertFalse(ArchivedTakenQuiz.objects.exists())
+        self.assertFalse(ArchivedRespondentAnswer.objects.exists())
+
+
+class QuestionsBulkChangeTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, Subject.objects.create(name='Subject'), questions=3, answers=3)
+        self.questions = list(self.quiz.questions.order_by('pk'))
+        self.url = reverse('moderators:questions_bulk_change', args=[self.quiz.pk])
+        self.client.force_login(self.moderator)
+
+    def bulk_data(self, **changes):
+        # Данные `answer_formset_data` каждого вопроса с префиксами массового редактора.
+        data = {}
+        for question in self.questions:
+            for key, value in answer_formset_data(question).items():
+                key = f'question-{question.pk}-text' if key == 'text' else key.replace('answers-', f'answers-{question.pk}-', 1)
+                data[key] = value
+        data.update(changes)
+        return data
+
+    def test_get_costs_constant_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['editors']), 3)
+        create_quiz(self.moderator, self.quiz.subject, questions=0)
+        for i in range(5):
+            Question.objects.create(quiz=self.quiz, text=f'Extra {i}')
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context['editors']), 8)
+        self.assertEqual(len(more_queries), len(queries))
+
+    def test_only_changed_rows_are_written(self):
+        first, second, third = self.questions
+        first_answers = list(first.answers.order_by('pk'))
+        third_answers = list(third.answers.order_by('pk'))
+        prefix = f'answers-{second.pk}'
+        data = self.bulk_data(**{
+            f'question-{first.pk}-text': 'Renamed',
+            f'answers-{first.pk}-1-text': 'Changed answer',
+            f'{prefix}-TOTAL_FORMS': 4,
+            f'{prefix}-3-text': 'New answer',
+            f'answers-{third.pk}-2-DELETE': 'on',
+        })
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, data)
+        self.assertRedirects(response, reverse('moderators:quiz_change', args=[self.quiz.pk]), fetch_redirect_response=False)
+
+        first.refresh_from_db()
+        self.assertEqual(first.text, 'Renamed')
+        self.assertEqual(Answer.objects.get(pk=first_answers[1].pk).text, 'Changed answer')
+        self.assertTrue(second.answers.filter(text='New answer', is_correct=False).exists())
+        self.assertFalse(Answer.objects.filter(pk=third_answers[2].pk).exists())
+        self.assertIn('Renamed', [question.text for question in get_quiz_content(self.quiz.pk).questions])
+
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len([sql for sql in writes if '"account_question"' in sql]), 1)
+        self.assertEqual(len([sql for sql in writes if '"account_answer"' in sql]), 2)
+
+    def test_invalid_question_rejects_whole_form(self):
+        question = self.questions[1]
+        data = self.bulk_data(**{
+            f'question-{self.questions[0].pk}-text': 'Renamed',
+            f'answers-{question.pk}-0-is_correct': '',
+        })
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, NO_CORRECT_ANSWER_MESSAGE)
+        self.assertFalse(Question.objects.filter(text='Renamed').exists())
+
+    def test_foreign_quiz_and_answer_ids_are_rejected(self):
+        other = create_quiz(self.moderator, self.quiz.subject, name='Other')
+        foreign = other.questions.get().answers.first()
+        response = self.client.post(self.url, self.bulk_data(**{f'answers-{self.questions[0].pk}-0-id': foreign.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.client.force_login(create_moderator('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class SinglePageQuizTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        subject = Subject.objects.create(name='Subject')
+        self.respondent = create_respondent(subjects=[subject])
+        self.quiz = create_quiz(create_moderator(), subject, questions=4, answers=3, single_page=True)
+        self.url = reverse('respondents:take_quiz', args=[self.quiz.pk])
+        self.client.force_login(self.respondent.user)
+
+    def test_all_questions_are_submitted_at_once(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['form'].fields), 4)
+
+        data = {}
+        for i, question in enumerate(get_quiz_content(self.quiz.pk).questions):
+            data[TakeQuizForm.field_name(question)] = question.answers[0 if i % 2 else 1].pk
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, data)
+        self.assertRedirects(response, reverse('respondents:quiz_list'), fetch_redirect_response=False)
+
+        inserts = [query for query in queries if query['sql'].startswith(f'INSERT INTO "{RespondentAnswer._meta.db_table}"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(RespondentAnswer.objects.filter(respondent=self.respondent).count(), 4)
+        self.assertEqual(TakenQuiz.objects.get(respondent=self.respondent, quiz=self.quiz).score, 50.0)
+
+    def test_incomplete_submission_saves_nothing(self):
+        question = get_quiz_content(self.quiz.pk).questions[0]
+        response = self.client.post(self.url, {TakeQuizForm.field_name(question): question.answers[0].pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertFalse(RespondentAnswer.objects.exists())
+        self.assertFalse(TakenQuiz.objects.exists())
+
+
+class QuizStatsTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, subject)
+        self.respondents = [create_respondent(f'respondent{i}') for i in range(4)]
+
+    def take(self, respondent, score):
+        return TakenQuiz.objects.create(respondent=respondent, quiz=self.quiz, score=score)
+
+    def test_stats_follow_created_and_deleted_attempts(self):
+        taken = [self.take(respondent, score) for respondent, score in zip(self.respondents, (20.0, 55.5, 100.0, 70.0))]
+        stats = QuizStats.objects.get(quiz=self.quiz)
+        self.assertEqual((stats.attempts, stats.score_min, stats.score_max), (4, 20.0, 100.0))
+        self.assertEqual(stats.average_score, 61.38)
+        self.assertEqual(dict(stats.histogram())[90], 1)
+
+        taken[2].delete()
+        taken[0].delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.attempts, stats.score_min, stats.score_max), (2, 55.5, 70.0))
+        self.assertEqual(dict(stats.histogram())[90], 0)
+
+    def test_rebuild_matches_incremental_stats(self):
+        for respondent, score in zip(self.respondents, (0.0, 33.33, 66.67, 100.0)):
+            self.take(respondent, score)
+        expected = QuizStats.objects.get(quiz=self.quiz)
+        expected_histogram = expected.histogram()
+
+        QuizStats.objects.all().delete()
+        call_command('rebuild_quiz_stats', stdout=io.StringIO())
+        stats = QuizStats.objects.get(quiz=self.quiz)
+        self.assertEqual(
+            (stats.attempts, stats.score_sum, stats.score_min, stats.score_max),
+            (expected.attempts, expected.score_sum, expected.score_min, expected.score_max))
+        self.assertEqual(stats.histogram(), expected_histogram)
+
+    def test_moderator_views_read_materialized_stats(self):
+        self.take(self.respondents[0], 40.0)
+        self.take(self.respondents[1], 80.0)
+        self.client.force_login(self.moderator)
+
+        response = self.client.get(reverse('moderators:quiz_change_list'))
+        self.assertEqual(response.context['quizzes'][0].taken_count, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('moderators:quiz_results', args=[self.quiz.pk]))
+        self.assertEqual(response.context['total_taken_quizzes'], 2)
+        self.assertEqual(response.context['quiz_score']['average_score'], 60.0)
+        self.assertFalse([query for query in queries if 'AVG(' in query['sql']])
+
+
+class QuizCounterTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, self.subject, name='Quiet', questions=2)
+        self.popular = create_quiz(self.moderator, self.subject, name='Popular')
+        self.respondents = [create_respondent(f'respondent{i}', subjects=[self.subject]) for i in range(3)]
+
+    def counters(self, quiz):
+        quiz.refresh_from_db()
+        return quiz.questions_count, quiz.taken_count
+
+    def test_counters_follow_questions_and_taken_quizzes(self):
+        self.assertEqual(self.counters(self.quiz), (2, 0))
+        taken = [TakenQuiz.objects.create(respondent=respondent, quiz=self.quiz, score=50.0)
+                 for respondent in self.respondents[:2]]
+        Question.objects.create(quiz=self.quiz, text='Extra')
+        self.assertEqual(self.counters(self.quiz), (3, 2))
+
+        taken[0].delete()
+        self.quiz.questions.first().delete()
+        self.assertEqual(self.counters(self.quiz), (2, 1))
+
+        # Сохранение опроса не перезаписывает счетчики прочитанными ранее значениями.
+        stale = Quiz.objects.get(pk=self.quiz.pk)
+        TakenQuiz.objects.create(respondent=self.respondents[2], quiz=self.quiz, score=50.0)
+        stale.name = 'Renamed'
+        stale.save()
+        self.assertEqual(self.counters(self.quiz), (2, 2))
+
+    def test_check_command_reports_and_repairs_mismatches(self):
+        TakenQuiz.objects.create(respondent=self.respondents[0], quiz=self.quiz, score=50.0)
+        Quiz.objects.filter(pk=self.quiz.pk).update(questions_count=7, taken_count=0)
+
+        with self.assertRaises(CommandError):
+            call_command('check_quiz_counters', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_quiz_counters', fix=True, stdout=out)
+        self.assertIn(f'Quiet #{self.quiz.pk}: вопросов 7 (фактически 2)', out.getvalue())
+        self.assertEqual(self.counters(self.quiz), (2, 1))
+        self.assertEqual(self.counters(self.popular), (1, 0))
+
+        out = io.StringIO()
+        call_command('check_quiz_counters', stdout=out)
+        self.assertIn('Расхождений нет.', out.getvalue())
+
+    def test_lists_order_popular_first_without_aggregates(self):
+        for respondent in self.respondents[:2]:
+            TakenQuiz.objects.create(respondent=respondent, quiz=self.popular, score=50.0)
+        TakenQuiz.objects.create(respondent=self.respondents[0], quiz=self.quiz, score=50.0)
+
+        self.client.force_login(self.moderator)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('moderators:quiz_change_list'), {'order': 'popular'})
+        self.assertEqual([(quiz.name, quiz.taken_count) for quiz in response.context['quizzes']],
+                         [('Popular', 2), ('Quiet', 1)])
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql'] or 'COUNT(' in query['sql']])
+
+        fresh = create_quiz(self.moderator, self.subject, name='Fresh')
+        self.client.force_login(self.respondents[2].user)
+        url = reverse('respondents:quiz_list')
+        with mock.patch.object(respondents.QuizListMixin, 'paginate_by', 2):
+            first = self.client.get(url, {'order': 'popular'})
+            self.assertEqual([quiz.name for quiz in first.context['quizzes']], ['Popular', 'Quiet'])
+            last = self.client.get(url, {'order': 'popular', 'after': first.context['page_obj'].next_cursor})
+        self.assertEqual([quiz.pk for quiz in last.context['quizzes']], [fresh.pk])
+        self.assertContains(first, '?order=popular&amp;after=')
+
+
+class QuestionStatsTests(RequestBudgetMixin, BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, subject, questions=2)
+        self.questions = list(self.quiz.questions.order_by('pk'))
+        self.answers = {question.pk: list(question.answers.order_by('-is_correct', 'pk')) for question in self.questions}
+        self.count = 0
+
+    def take(self, *correct):
+        # Ответ на каждый вопрос: правильный (True) или неправильный (False).
+        self.count += 1
+        respondent = create_respondent(f'respondent{self.count}')
+        for question, is_correct in zip(self.questions, correct):
+            answer = self.answers[question.pk][0 if is_correct else 1]
+            RespondentAnswer.objects.create(respondent=respondent, answer=answer)
+        return TakenQuiz.objects.create(respondent=respondent, quiz=self.quiz, score=sum(correct) / len(correct) * 100)
+
+    def expected(self):
+        rows = TakenQuiz.objects.filter(quiz=self.quiz).values_list('respondent_id', 'score')
+        result = {}
+        for question in self.questions:
+            pairs = [(RespondentAnswer.objects.get(respondent_id=pk, question=question).is_correct, score) for pk, score in rows]
+            correct = [float(is_correct) for is_correct, _ in pairs]
+            result[question.pk] = (
+                len(pairs), round(sum(correct) / len(pairs) * 100, 1),
+                round(statistics.correlation(correct, [score for _, score in pairs]), 3))
+        return result
+
+    def actual(self):
+        return {
+            stats.pk: (stats.answered, stats.percent_correct, stats.discrimination)
+            for stats in QuestionStats.objects.filter(question__quiz=self.quiz)
+        }
+
+    def test_incremental_refresh_matches_full_aggregate(self):
+        self.take(True, True)
+        self.take(True, False)
+        self.assertEqual(refresh_question_stats(), 2)
+        self.assertEqual(refresh_question_stats(), 0)
+
+        self.take(False, False)
+        self.take(True, False)
+        self.take(False, True)
+        self.assertEqual(refresh_question_stats(batch_size=1), 3)
+        self.assertEqual(self.actual(), self.expected())
+        self.assertEqual(AnswerStats.objects.get(pk=self.answers[self.questions[0].pk][0].pk).count, 3)
+
+        call_command('refresh_question_stats', '--full', stdout=io.StringIO())
+        self.assertEqual(self.actual(), self.expected())
+
+    def test_analytics_view(self):
+        self.take(True, False)
+        self.take(False, False)
+        refresh_question_stats()
+        self.client.force_login(self.moderator)
+        response = self.client.get(reverse('moderators:quiz_analytics', args=[self.quiz.pk]))
+        self.assertWithinBudget(response)
+        first = response.context['questions'][0]
+        self.assertEqual(first['stats'].percent_correct, 50.0)
+        self.assertEqual([choice['percent'] for choice in first['answers']], [50.0, 50.0])
+        self.assertIsNone(response.context['questions'][1]['stats'].discrimination)
+
+        self.client.force_login(create_moderator('other'))
+        self.assertEqual(self.client.get(reverse('moderators:quiz_analytics', args=[self.quiz.pk])).status_code, 404)
+
+
+class QuizResultsExportTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, Subject.objects.create(name='Subject'), questions=2)
+        self.url = reverse('moderators:quiz_results_export', args=[self.quiz.pk])
+        self.client.force_login(self.moderator)
+
+    def add_results(self, count, prefix):
+        TakenQuiz.objects.bulk_create([
+            TakenQuiz(respondent=respondent, quiz=self.quiz, score=50.0)
+            for respondent in bulk_create_respondents(count, prefix)
+        ])
+
+    def consume(self, params):
+        response = self.client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_and_ndjson_results(self):
+        self.add_results(3, 'r')
+        rows = list(csv.reader(io.StringIO(self.consume({'format': 'csv'}))))
+        self.assertEqual(rows[0], ['respondent', 'date', 'score'])
+        self.assertEqual([row[0] for row in rows[1:]], ['r0', 'r1', 'r2'])
+
+        lines = self.consume({'format': 'ndjson'}).splitlines()
+        self.assertEqual(json.loads(lines[1])['respondent'], 'r1')
+        self.assertEqual(json.loads(lines[1])['score'], 50.0)
+
+    def test_answer_rows(self):
+        respondent = create_respondent()
+        answer = Answer.objects.filter(question__quiz=self.quiz, is_correct=True).first()
+        RespondentAnswer.objects.create(respondent=respondent, answer=answer)
+        rows = list(csv.reader(io.StringIO(self.consume({'format': 'csv', 'data': 'answers'}))))
+        self.assertEqual(rows[1], ['respondent', answer.question.text, answer.text, 'True'])
+
+    def test_unknown_format_and_foreign_quiz(self):
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 404)
+        self.client.force_login(create_moderator('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    @override_settings(EXPORT_CHUNK_SIZE=100)
+    def test_memory_does_not_grow_with_attempt_count(self):
+        def peak_memory(params):
+            tracemalloc.start()
+            try:
+                for _ in self.client.get(self.url, params).streaming_content:
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.add_results(500, 'small')
+        small = peak_memory({'format': 'ndjson'})
+        self.add_results(4500, 'large')
+        large = peak_memory({'format': 'ndjson'})
+        # Десятикратный рост числа строк не должен заметно менять пик памяти.
+        self.assertLess(large, small * 1.5)
+
+
+class QuizImportTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+
+    def quiz_data(self, questions=2, correct=True):
+        return {'quizzes': [{
+            'name': 'Imported',
+            'subject': 'Subject',
+            'single_page': True,
+            'questions': [
+                {'text': f'Q{i}', 'answers': [{'text': 'yes', 'is_correct': correct}, {'text': 'no'}]}
+                for i in range(questions)
+            ],
+        }]}
+
+    def upload(self, name, content):
+        self.client.force_login(self.moderator)
+        return self.client.post(reverse('moderators:quiz_import'), {'file': SimpleUploadedFile(name, content)})
+
+    def test_json_upload_uses_batched_inserts(self):
+        content = json.dumps(self.quiz_data(questions=300)).encode()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.upload('quizzes.json', content)
+        self.assertRedirects(response, reverse('moderators:quiz_change_list'))
+
+        quiz = Quiz.objects.get(name='Imported')
+        self.assertTrue(quiz.single_page)
+        self.assertEqual(quiz.questions.count(), 300)
+        self.assertEqual(Answer.objects.filter(question__quiz=quiz, is_correct=True).count(), 300)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "account_')]
+        self.assertLessEqual(len(inserts), 3)
+
+    def test_whole_file_is_rejected_on_any_error(self):
+        data = self.quiz_data()
+        data['quizzes'].append({'name': 'Broken', 'subject': 'Unknown', 'questions': [
+            {'text': 'Q', 'answers': [{'text': 'a'}, {'text': 'b'}]},
+            {'text': 'Q', 'answers': [{'text': 'a', 'is_correct': True}]},
+        ]})
+        response = self.upload('quizzes.json', json.dumps(data).encode())
+        self.assertEqual(response.status_code, 200)
+        errors = response.context['form'].errors['file']
+        self.assertEqual(len(errors), 3)
+        self.assertIn('Опрос 2, вопрос 1: Отметьте хотя бы один ответ как правильный.', errors)
+        self.assertFalse(Quiz.objects.exists())
+
+    def test_command_imports_csv(self):
+        content = (
+            'quiz,subject,question,answer,is_correct\n'
+            'CSV quiz,Subject,First,A,1\n'
+            'CSV quiz,Subject,First,B,0\n'
+            'CSV quiz,Subject,Second,C,\n'
+            'CSV quiz,Subject,Second,D,да\n'
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'quizzes.csv')
+        with open(path, 'w') as f:
+            f.write(content)
+        call_command('import_quizzes', path, owner=self.moderator.username, stdout=io.StringIO())
+
+        quiz = Quiz.objects.get(name='CSV quiz')
+        self.assertEqual(quiz.owner, self.moderator)
+        self.assertEqual(
+            list(Answer.objects.filter(question__quiz=quiz, is_correct=True).values_list('text', flat=True)),
+            ['A', 'D'])
+
+
+class QueryPlanTests(BaseTestCase):
+
+    '''
+    Прогоняет `EXPLAIN QUERY PLAN` для запросов, которые реально выполняют
+    горячие представления, и проверяет, что они используют индексы.
+    '''
+
+    def setUp(self):
+        super().setUp()
+        subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.respondent = create_respondent(subjects=[subject])
+        self.quiz = create_quiz(self.moderator, subject, questions=2)
+        other = create_respondent('other', subjects=[subject])
+        TakenQuiz.objects.create(respondent=other, quiz=self.quiz, score=50.0)
+
+    def plans(self, user, url, table):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if query['sql'].startswith('SELECT') and f'"{table}"' in query['sql']:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {query["sql"]}')
+                    plans.append('\n'.join(row[-1] for row in cursor.fetchall()))
+        self.assertTrue(plans, f'Нет запросов к {table}')
+        return plans
+
+    def test_take_quiz(self):
+        url = reverse('respondents:take_quiz', args=[self.quiz.pk])
+        for plan in self.plans(self.respondent.user, url, TakenQuiz._meta.db_table) \
+                + self.plans(self.respondent.user, url, QuizAttempt._meta.db_table):
+            self.assertRegex(plan, r'USING (COVERING )?INDEX \S+ \(respondent_id=\? AND quiz_id=\?\)')
+
+    def test_respondent_quiz_list(self):
+        # Строки опросов собираются при промахе кэша, пройденные опросы — отдельным запросом.
+        url = reverse('respondents:quiz_list')
+        [plan] = self.plans(self.respondent.user, url, Quiz._meta.db_table)
+        self.assertRegex(plan, r'SEARCH account_quiz USING INDEX \S+ \(subject_id=\?\)')
+        self.assertNotIn('SCAN', plan)
+        [plan] = self.plans(self.respondent.user, url, TakenQuiz._meta.db_table)
+        self.assertRegex(plan, r'USING COVERING INDEX \S*takenquiz\S* \(respondent_id=\?\)')
+
+    def test_moderator_quiz_list_reads_counters(self):
+        url = reverse('moderators:quiz_change_list') + '?order=popular'
+        [plan] = self.plans(self.moderator, url, Quiz._meta.db_table)
+        self.assertIn('USING INDEX quiz_owner_popular_idx (owner_id=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_quiz_results(self):
+        url = reverse('moderators:quiz_results', args=[self.quiz.pk])
+        [plan] = self.plans(self.moderator, url, TakenQuiz._meta.db_table)
+        self.assertIn('USING INDEX takenquiz_quiz_date_idx (quiz_id=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_duplicate_rows_are_rejected(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TakenQuiz.objects.create(respondent=self.respondent, quiz=self.quiz, score=1.0)
+            TakenQuiz.objects.create(respondent=self.respondent, quiz=self.quiz, score=2.0)
+        first, second = Answer.objects.filter(question__quiz=self.quiz)[:2]
+        RespondentAnswer.objects.create(respondent=self.respondent, answer=first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RespondentAnswer.objects.create(respondent=self.respondent, answer=second)
+
+
+class RespondentAnswerKeysTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        subject = Subject.objects.create(name='Subject')
+        self.respondent = create_respondent(subjects=[subject])
+        self.quiz = create_quiz(create_moderator(), subject, questions=2)
+
+    def test_save_copies_question_quiz_and_correctness(self):
+        answer = Answer.objects.filter(question__quiz=self.quiz, is_correct=True).first()
+        respondent_answer = RespondentAnswer.objects.create(respondent=self.respondent, answer=answer)
+        self.assertEqual(
+            (respondent_answer.question_id, respondent_answer.quiz_id, respondent_answer.is_correct),
+            (answer.question_id, self.quiz.pk, True))
+
+        # Исправление ключа ответа меняет записанный результат только при пересчете (recompute_scores).
+        Answer.objects.filter(pk=answer.pk).update(is_correct=False)
+        respondent_answer.refresh_from_db()
+        self.assertTrue(respondent_answer.is_correct)
+
+    def test_take_quiz_writes_keys_and_progress_is_single_table(self):
+        self.client.force_login(self.respondent.user)
+        url = reverse('respondents:take_quiz', args=[self.quiz.pk])
+        question = self.client.get(url).context['question']
+        self.client.post(url, {TakeQuizForm.field_name(question): question.answers[0].pk})
+
+        respondent_answer = RespondentAnswer.objects.get(respondent=self.respondent)
+        self.assertEqual((respondent_answer.question_id, respondent_answer.quiz_id), (question.pk, self.quiz.pk))
+        self.assertEqual(respondent_answer.is_correct, question.answers[0].is_correct)
+
+        with CaptureQueriesContext(connection) as queries:
+            unanswered = list(self.respondent.get_unanswered_questions(self.quiz))
+        self.assertEqual(len(unanswered), 1)
+        self.assertNotIn('"account_answer"', queries[0]['sql'])
+
+
+class SubjectRegistryTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='<Python>', color='#123456')
+        self.respondent = create_respondent(subjects=[self.subject])
+        create_quiz(create_moderator(), self.subject)
+
+    def subject_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries if f'"{Subject._meta.db_table}"' in query['sql']]
+
+    def test_warm_registry_costs_no_subject_queries(self):
+        self.client.force_login(self.respondent.user)
+        urls = [
+            reverse('respondents:quiz_list'),
+            reverse('respondents:taken_quiz_list'),
+            reverse('respondents:category_respondents'),
+        ]
+        for url in urls:
+            self.client.get(url)
+        for url in urls:
+            self.assertEqual(self.subject_queries(lambda: self.client.get(url)), [], url)
+
+        self.client.logout()
+        signup = reverse('respondent_signup')
+        self.assertEqual(self.subject_queries(lambda: self.client.get(signup)), [])
+        response = self.client.get(signup)
+        self.assertContains(response, '&lt;Python&gt;')
+
+    def test_signup_stores_selected_subjects(self):
+        response = self.client.post(reverse('respondent_signup'), {
+            'username': 'newcomer',
+            'password1': 'correct-horse-battery',
+            'password2': 'correct-horse-battery',
+            'category': [self.subject.pk],
+        })
+        self.assertRedirects(response, reverse('respondents:quiz_list'))
+        self.assertEqual(User.objects.get(username='newcomer').respondent.get_category_ids(), [self.subject.pk])
+
+    def test_badges_are_prerendered_and_escaped(self):
+        self.assertEqual(subjects.badge(self.subject.pk), self.subject.get_html_badge())
+        self.assertIn('&lt;Python&gt;', subjects.badge(self.subject.pk))
+
+    def test_subject_changes_invalidate_registry(self):
+        subjects.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            Subject.objects.create(name='Django')
+        self.assertIn('Django', [name for _, name in subjects.choices()])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subject.delete()
+        self.assertIsNone(subjects.get(self.subject.pk))
+
+    def test_category_form_saves_selected_subjects(self):
+        other = Subject.objects.create(name='Other')
+        self.client.force_login(self.respondent.user)
+        url = reverse('respondents:category_respondents')
+        self.assertEqual(self.client.get(url).context['form'].initial['category'], [self.subject.pk])
+        self.client.post(url, {'category': [other.pk]})
+        self.assertEqual(self.respondent.get_category_ids(), [other.pk])
+
+
+class QuizListCacheTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.other_subject = Subject.objects.create(name='Other')
+        self.moderator = create_moderator()
+        self.quiz = create_quiz(self.moderator, self.subject, name='First')
+        self.second = create_quiz(self.moderator, self.subject, name='Second')
+        self.respondent = create_respondent(subjects=[self.subject])
+
+    def quiz_list(self, respondent=None):
+        self.client.force_login((respondent or self.respondent).user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('respondents:quiz_list'))
+        quiz_queries = [query for query in queries if f'"{Quiz._meta.db_table}"' in query['sql']]
+        return [quiz.name for quiz in response.context['quizzes']], quiz_queries, response
+
+    def test_rows_are_shared_by_subject_set(self):
+        names, quiz_queries, response = self.quiz_list()
+        self.assertEqual(names, ['First', 'Second'])
+        self.assertTrue(quiz_queries)
+        self.assertEqual(response.request_metrics.cache_misses, 1)
+        self.assertContains(response, reverse('respondents:take_quiz', args=[self.quiz.pk]))
+
+        other = create_respondent('other', subjects=[self.subject])
+        TakenQuiz.objects.create(respondent=other, quiz=self.quiz, score=100.0)
+        names, quiz_queries, response = self.quiz_list(other)
+        self.assertEqual(names, ['Second'])
+        self.assertEqual(quiz_queries, [])
+        self.assertEqual(response.request_metrics.cache_hits, 1)
+        self.assertEqual(quiz_rows_cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_quiz_and_question_changes_bump_subject_version(self):
+        self.quiz_list()
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.create(quiz=self.second, text='Extra')
+        self.assertEqual(self.quiz_list()[2].context['quizzes'][1].questions_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz.name = 'Renamed'
+            self.quiz.save()
+        self.assertEqual(self.quiz_list()[0], ['Renamed', 'Second'])
+
+        # Смена категории сбрасывает списки и прежней, и новой категории.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second.subject = self.other_subject
+            self.second.save()
+        self.assertEqual(self.quiz_list()[0], ['Renamed'])
+        self.assertEqual(self.quiz_list(create_respondent('other', subjects=[self.other_subject]))[0], ['Second'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiz.delete()
+        self.assertEqual(self.quiz_list()[0], [])
+
+    def test_sequence_paginator_matches_queryset_paginator(self):
+        for i in range(5):
+            create_quiz(self.moderator, self.subject, name=f'Quiz {i % 2}')
+        queryset = Quiz.objects.order_by('name', 'pk')
+        rows = list(queryset)
+        for after, before in [(None, None), (rows[1], None), (None, rows[4]), (rows[-1], None), (None, rows[0])]:
+            expected = KeysetPaginator(queryset, 2)
+            actual = KeysetSequencePaginator(rows, 2)
+            kwargs = {
+                'after': expected.encode_cursor(after) if after else None,
+                'before': expected.encode_cursor(before) if before else None,
+            }
+            expected_page, actual_page = expected.page(**kwargs), actual.page(**kwargs)
+            self.assertEqual(list(actual_page), list(expected_page))
+            self.assertEqual(
+                (actual_page.next_cursor, actual_page.previous_cursor),
+                (expected_page.next_cursor, expected_page.previous_cursor))
+
+
+class QuizSearchTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.subject = Subject.objects.create(name='Subject')
+        self.moderator = create_moderator()
+        self.by_name = create_quiz(self.moderator, self.subject, name='Основы Python')
+        self.by_answer = create_quiz(self.moderator, self.subject, name='Языки')
+        Answer.objects.filter(question__quiz=self.by_answer).update(text='Python')
+        self.other = create_quiz(create_moderator('other'), self.subject, name='Python для всех')
+        self.client.force_login(self.moderator)
+
+    def search(self, query, url='moderators:quiz_change_list', **params):
+        response = self.client.get(reverse(url), {'q': query, **params})
+        return [quiz.name for quiz in response.context['quizzes']]
+
+    def test_moderator_search_is_ranked_and_scoped(self):
+        self.assertEqual(self.search('pyth'), ['Основы Python', 'Языки'])
+        self.assertEqual(self.search('ОСНОВЫ python'), ['Основы Python'])
+        self.assertEqual(self.search('"*)'), [])
+        self.assertEqual(len(self.search('')), 2)
+
+    @override_settings(SEARCH_PAGE_SIZE=1)
+    def test_results_are_paginated(self):
+        self.assertEqual(self.search('python'), ['Основы Python'])
+        self.assertEqual(self.search('python', page=2), ['Языки'])
+
+    def test_triggers_keep_index_in_sync(self):
+        Quiz.objects.filter(pk=self.by_name.pk).update(name='Основы Django')
+        Question.objects.filter(quiz=self.by_answer).update(text='Что такое Rust?')
+        self.assertEqual(self.search('python'), ['Языки'])
+        self.assertEqual(self.search('rust'), ['Языки'])
+
+        Answer.objects.filter(question__quiz=self.by_answer).delete()
+        self.assertEqual(self.search('python'), [])
+        self.by_answer.delete()
+        self.assertEqual(self.search('rust'), [])
+
+        import_quizzes([{
+            'name': 'Импорт', 'subject': 'Subject',
+            'questions': [{'text': 'Вопрос про Python', 'answers': [
+                {'text': 'Да', 'is_correct': True}, {'text': 'Нет', 'is_correct': False}]}],
+        }], self.moderator)
+        self.assertEqual(self.search('python'), ['Импорт'])
+
+    def test_rebuild_command_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER account_quizsearch_quiz_insert')
+            cursor.execute('DELETE FROM account_quizsearch')
+        create_quiz(self.moderator, self.subject, name='Python 2')
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.search('python'), ['Основы Python', 'Python 2', 'Языки'])
+        create_quiz(self.moderator, self.subject, name='Python 3')
+        self.assertIn('Python 3', self.search('python'))
+
+    def test_respondent_search_skips_taken_and_foreign_quizzes(self):
+        respondent = create_respondent(subjects=[self.subject])
+        create_quiz(self.moderator, Subject.objects.create(name='Other'), name='Python вне категорий')
+        TakenQuiz.objects.create(respondent=respondent, quiz=self.other, score=100.0)
+        self.client.force_login(respondent.user)
+        self.assertEqual(self.search('python', 'respondents:quiz_search'), ['Основы Python', 'Языки'])
+
+
+class RequestMetricsTests(RequestBudgetMixin, BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.subject = Subject.objects.create(name='Subject')
+        self.respondent = create_respondent(subjects=[self.subject])
+        self.quizzes = [create_quiz(self.moderator, self.subject, name=f'Quiz {i}', questions=3) for i in range(5)]
+        for quiz in self.quizzes[:3]:
+            TakenQuiz.objects.bulk_create([
+                TakenQuiz(respondent=respondent, quiz=quiz, score=50.0)
+                for respondent in bulk_create_respondents(5, prefix=f'q{quiz.pk}-')
+            ])
+            TakenQuiz.objects.create(respondent=self.respondent, quiz=quiz, score=100.0)
+
+    def test_budgeted_views_stay_within_budget(self):
+        self.client.force_login(self.respondent.user)
+        for url in (
+            reverse('respondents:quiz_list'),
+            reverse('respondents:taken_quiz_list'),
+            reverse('respondents:take_quiz', args=[self.quizzes[4].pk]),
+        ):
+            self.assertWithinBudget(self.client.get(url))
+        question = get_quiz_content(self.quizzes[4].pk).questions[0]
+        response = self.client.post(
+            reverse('respondents:take_quiz', args=[self.quizzes[4].pk]),
+            {TakeQuizForm.field_name(question): question.answers[0].pk})
+        self.assertWithinBudget(response)
+
+        self.client.force_login(self.moderator)
+        self.assertWithinBudget(self.client.get(reverse('moderators:quiz_change_list')))
+        self.assertWithinBudget(self.client.get(reverse('moderators:quiz_results', args=[self.quizzes[0].pk])))
+
+    def test_metrics_match_executed_queries(self):
+        self.client.force_login(self.moderator)
+        url = reverse('moderators:quiz_results', args=[self.quizzes[0].pk])
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('account.metrics', 'INFO') as logs:
+            response = self.client.get(url)
+        metrics = response.request_metrics
+        self.assertEqual(metrics.url_name, 'moderators:quiz_results')
+        self.assertEqual(metrics.queries, len(queries))
+        self.assertGreater(metrics.template_time, 0)
+        self.assertIn(f'db;dur={metrics.as_dict()["db_ms"]}', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['queries'], len(queries))
+        self.assertEqual(line['status'], 200)
+
+    @override_settings(REQUEST_BUDGETS={'moderators:quiz_change_list': {'queries': 1}})
+    def test_over_budget_request_is_flagged(self):
+        self.client.force_login(self.moderator)
+        with self.assertLogs('account.metrics', 'WARNING') as logs:
+            response = self.client.get(reverse('moderators:quiz_change_list'))
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['over_budget']['queries']['limit'], 1)
+        with self.assertRaises(AssertionError):
+            self.assertWithinBudget(response)
+
+
+class BenchTests(BaseTestCase):
+    def test_seed_and_single_worker_run(self):
+        fixture = bench.seed(**bench.SCALES['tiny'])
+        self.assertEqual(fixture.counts['answers'], 4 * 3 * 3)
+        self.assertEqual(fixture.counts['respondent_answers'], fixture.counts['taken_quizzes'] * 3)
+        self.assertEqual(QuizStats.objects.aggregate(total=Sum('attempts'))['total'], fixture.counts['taken_quizzes'])
+
+        report = bench.run(fixture, workers=1, iterations=2, signups=0, host='testserver')
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['scenarios']['browse']['count'], 2)
+        self.assertIn('respondents:take_quiz', report['endpoints'])
+        self.assertIn('p99_ms', report['endpoints']['moderators:quiz_results'])
+        self.assertGreater(report['endpoints']['respondents:quiz_list']['mean_queries'], 0)
+
+    def test_compare_purge(self):
+        Subject.objects.create(name='Subject')
+        report = bench.compare_purge(respondents=4, questions=2, answers=2, batch_size=3)
+        self.assertEqual(report['cascade']['deleted'], report['purge']['deleted'])
+        self.assertGreater(report['purge']['batches'], 1)
+        self.assertFalse(Quiz.all_objects.filter(name__startswith='Bench').exists())
+
+    def test_compare_question_editor(self):
+        Subject.objects.create(name='Subject')
+        report = bench.compare_question_editor(questions=3, answers=2, host='testserver')
+        self.assertEqual(report['per_question']['requests'], 6)
+        self.assertLess(report['bulk']['queries'], report['per_question']['queries'])
+        self.assertEqual(Answer.objects.filter(text__endswith=' v2').count(), 3)
+
+    def test_compare_sessions(self):
+        fixture = bench.seed(**bench.SCALES['tiny'])
+        report = bench.compare_sessions(fixture, users=1, host='testserver')['sessions']
+        self.assertEqual(set(report), {f'{session}+{messages}' for session, messages in bench.SESSION_CONFIGS})
+        for name, result in report.items():
+            self.assertGreater(result['steps'], 0, name)
+        self.assertGreater(report['db+session']['session_writes_per_step'], 0)
+        self.assertEqual(report['cached_db+fallback']['session_writes_per_step'], 0)
+        self.assertEqual(report['signed_cookies+cookie']['session_reads_per_step'], 0)
+
+
+class SessionStoreTests(BaseTestCase):
+    def session_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [query['sql'] for query in queries if '"django_session"' in query['sql']]
+
+    def test_unchanged_session_is_not_written(self):
+        session = db_sessions.SessionStore()
+        session['answer'] = [1, 2]
+        session.save()
+
+        session = db_sessions.SessionStore(session.session_key)
+        session['answer'] = [1, 2]
+        self.assertTrue(session.modified)
+        self.assertEqual(self.session_queries(session.save), [])
+
+        session['answer'].append(3)
+        self.assertEqual(len(self.session_queries(session.save)), 1)
+        self.assertEqual(db_sessions.SessionStore(session.session_key)['answer'], [1, 2, 3])
+        self.assertEqual(self.session_queries(session.save), [])
+
+    def test_cycle_key_keeps_data(self):
+        session = db_sessions.SessionStore()
+        session['answer'] = 1
+        session.save()
+        session = db_sessions.SessionStore(session.session_key)
+        session.load()
+        old_key = session.session_key
+        session.cycle_key()
+        session.save()
+        self.assertNotEqual(session.session_key, old_key)
+        self.assertEqual(db_sessions.SessionStore(session.session_key)['answer'], 1)
+
+    @override_settings(SESSION_ENGINE='account.sessions.cache', MESSAGE_STORAGE=settings.MESSAGE_STORAGES['cookie'])
+    def test_cache_sessions_and_cookie_messages_skip_session_table(self):
+        respondent = create_respondent()
+        self.client.force_login(respondent.user)
+        queries = self.session_queries(lambda: self.client.get(reverse('respondents:quiz_list')))
+        self.assertEqual(queries, [])
+
+
+class AsyncRespondentViewsTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.enterContext(async_views())
+        self.subject = Subject.objects.create(name='Subject')
+        self.respondent = create_respondent(subjects=[self.subject])
+        moderator = create_moderator()
+        self.quiz = create_quiz(moderator, self.subject, name='A', questions=3)
+        self.single_page = create_quiz(moderator, self.subject, name='B', questions=2, single_page=True)
+        self.client.force_login(self.respondent.user)
+        self.async_client.cookies = self.client.cookies
+
+    def test_routes_use_async_views(self):
+        match = resolve(reverse('respondents:take_quiz', args=[self.quiz.pk]))
+        self.assertIs(match.func, respondents_async.take_quiz)
+        self.assertTrue(iscoroutinefunction(resolve(reverse('respondents:quiz_list')).func))
+
+    async def test_quiz_lists(self):
+        response = await self.async_client.get(reverse('respondents:quiz_list'))
+        self.assertEqual([quiz.name for quiz in response.context['quizzes']], ['A', 'B'])
+        self.assertEqual([subject.name for subject in response.context['categories']], ['Subject'])
+        self.assertEqual(response.request_metrics.url_name, 'respondents:quiz_list')
+
+        response = await self.async_client.get(reverse('respondents:quiz_list'), {'after': 'broken'})
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.get(reverse('respondents:taken_quiz_list'))
+        self.assertEqual(list(response.context['taken_quizzes']), [])
+
+    async def test_walkthrough_matches_sync_view(self):
+        url = reverse('respondents:take_quiz', args=[self.quiz.pk])
+        content = await aget_quiz_content(self.quiz.pk)
+        for i, question in enumerate(content.questions):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.context['question'], question)
+            answer = question.answers[0 if i else 1]
+            response = await self.async_client.post(url, {TakeQuizForm.field_name(question): answer.pk})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse('respondents:quiz_list'))
+
+        taken_quiz = await TakenQuiz.objects.aget(respondent=self.respondent, quiz=self.quiz)
+        self.assertEqual(taken_quiz.score, 66.67)
+        self.assertEqual(await RespondentAnswer.objects.filter(respondent=self.respondent).acount(), 3)
+
+        response = await self.async_client.get(url)
+        self.assertRedirects(response, reverse('respondents:taken_quiz_list'), fetch_redirect_response=False)
+
+    async def test_single_page_quiz(self):
+        url = reverse('respondents:take_quiz', args=[self.single_page.pk])
+        content = await aget_quiz_content(self.single_page.pk)
+        data = {TakeQuizForm.field_name(question): question.answers[0].pk for question in content.questions}
+        response = await self.async_client.post(url, data)
+        self.assertRedirects(response, reverse('respondents:quiz_list'), fetch_redirect_response=False)
+        self.assertEqual((await TakenQuiz.objects.aget(quiz=self.single_page)).score, 100.0)
+
+    def test_empty_quiz_is_not_finished(self):
+        empty = create_quiz(create_moderator('moderator2'), self.subject, name='Empty', questions=0)
+        response = async_to_sync(self.async_client.get)(reverse('respondents:take_quiz', args=[empty.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(QuizAttempt.objects.filter(quiz=empty).exists())
+
+    def test_login_is_required(self):
+        self.async_client.cookies.clear()
+        response = async_to_sync(self.async_client.get)(reverse('respondents:quiz_list'))
+        self.assertEqual(response.status_code, 302)
+
+
+class DatabaseProfileTests(BaseTestCase):
+    def test_sqlite_profile_is_applied_to_connections(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Профиль только для SQLite.')
+        profile = bench.database_profile()
+        self.assertEqual(profile['synchronous'], 1)
+        self.assertEqual(profile['cache_size'], settings.SQLITE_PRAGMAS['cache_size'])
+        self.assertEqual(profile['temp_store'], 2)
+        self.assertEqual(profile['busy_timeout'], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+        self.assertEqual(profile['transaction_mode'], 'IMMEDIATE')
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class ReplicaRoutingTests(BaseTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        super().setUp()
+        self.moderator = create_moderator()
+        self.subject = Subject.objects.create(name='Subject')
+        self.quiz = create_quiz(self.moderator, self.subject, name='Primary')
+        # Реплика «отстает»: на ней есть только старая версия опроса.
+        self.moderator.save(using='replica')
+        self.subject.save(using='replica')
+        Quiz.objects.using('replica').create(
+            pk=self.quiz.pk, owner_id=self.moderator.pk, subject_id=self.subject.pk, name='Replica')
+        self.client.force_login(self.moderator)
+
+    def quiz_names(self, response):
+        return [quiz.name for quiz in response.context['quizzes']]
+
+    def test_opted_in_views_read_from_replica(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('moderators:quiz_change_list'))
+        self.assertEqual(self.quiz_names(response), ['Replica'])
+        self.assertTrue(replica_queries)
+
+        response = self.client.get(reverse('moderators:quiz_results', args=[self.quiz.pk]))
+        self.assertEqual(response.context['quiz'].name, 'Replica')
+
+    def test_other_views_and_writes_use_primary(self):
+        response = self.client.get(reverse('moderators:quiz_change', args=[self.quiz.pk]))
+        self.assertEqual(response.context['quiz'].name, 'Primary')
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).name, 'Primary')
+
+    def test_writes_pin_client_to_primary(self):
+        response = self.client.post(reverse('moderators:quiz_change', args=[self.quiz.pk]), {
+            'name': 'Renamed', 'subject': self.subject.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies['read_primary']['max-age'], 15)
+
+        response = self.client.get(reverse('moderators:quiz_change_list'))
+        self.assertEqual(self.quiz_names(response), ['Renamed'])
+
+        self.client.cookies.pop('read_primary')
+        response = self.client.get(reverse('moderators:quiz_change_list'))
+        self.assertEqual(self.quiz_names(response), ['Replica'])
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_disabled_replica_is_never_used(self):
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            response = self.client.get(reverse('moderators:quiz_change_list'))
+        self.assertEqual(self.quiz_names(response), ['Primary'])
+        self.assertFalse(replica_queries)
+        self.assertNotIn('read_primary', self.client.post(reverse('moderators:quiz_change', args=[self.quiz.pk]), {
+            'name': 'Renamed', 'subject': self.subject.pk,
+        }).cookies)
@@ -1,25 +1,39 @@
+from django.conf import settings
 from django.urls import include, path
 
-from .views import account, moderators, respondents
+from .views import account, moderators, respondents, respondents_async
+
+# Под ASGI самые нагруженные страницы респондента обслуживают асинхронные
+# версии представлений (см. `survey/asgi.py`).
+respondent_views = respondents_async if settings.ASYNC_VIEWS else respondents
 
 urlpatterns = [
     path('', account.home, name='home'),
 
     path('respondents/', include(([
-        path('', respondents.QuizListView.as_view(), name='quiz_list'),
+        path('', respondent_views.QuizListView.as_view(), name='quiz_list'),
         path('category/', respondents.RespondentCategoryView.as_view(), name='category_respondents'),
-        path('taken/', respondents.TakenQuizListView.as_view(), name='taken_quiz_list'),
-        path('quiz/<int:pk>/', respondents.take_quiz, name='take_quiz'),
+        path('taken/', respondent_views.TakenQuizListView.as_view(), name='taken_quiz_list'),
+        path('search/', respondents.QuizSearchView.as_view(), name='quiz_search'),
+        path('quiz/<int:pk>/', respondent_views.take_quiz, name='take_quiz'),
     ], 'account'), namespace='respondents')),
 
     path('moderators/', include(([
         path('', moderators.QuizListView.as_view(), name='quiz_change_list'),
         path('quiz/add/', moderators.QuizCreateView.as_view(), name='quiz_add'),
+        path('quiz/import/', moderators.quiz_import, name='quiz_import'),
         path('quiz/<int:pk>/', moderators.QuizUpdateView.as_view(), name='quiz_change'),
         path('quiz/<int:pk>/delete/', moderators.QuizDeleteView.as_view(), name='quiz_delete'),
         path('quiz/<int:pk>/results/', moderators.QuizResultsView.as_view(), name='quiz_results'),
+        path('quiz/<int:pk>/results/analytics/', moderators.QuizAnalyticsView.as_view(), name='quiz_analytics'),
+        path('quiz/<int:pk>/results/export/', moderators.quiz_results_export, name='quiz_results_export'),
+        path('quiz/<int:pk>/jobs/<slug:name>/', moderators.quiz_job_start, name='quiz_job_start'),
         path('quiz/<int:pk>/question/add/', moderators.question_add, name='question_add'),
+        path('quiz/<int:pk>/questions/', moderators.questions_bulk_change, name='questions_bulk_change'),
         path('quiz/<int:quiz_pk>/question/<int:question_pk>/', moderators.question_change, name='question_change'),
         path('quiz/<int:quiz_pk>/question/<int:question_pk>/delete/', moderators.QuestionDeleteView.as_view(), name='question_delete'),
+        path('jobs/', moderators.JobListView.as_view(), name='job_list'),
+        path('jobs/<int:pk>/', moderators.JobDetailView.as_view(), name='job_detail'),
+        path('jobs/<int:pk>/status/', moderators.job_status, name='job_status'),
     ], 'account'), namespace='moderators')),
 ]
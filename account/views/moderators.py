@@ -1,19 +1,34 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Avg, Count
-from django.forms import inlineformset_factory
+from django.db.models import Count
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse, reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
                                   UpdateView)
 from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import require_POST
 
+from ..cache import get_quiz_content, invalidate_quiz_content
 from ..decorators import moderator_required
-from ..forms import BaseAnswerInlineFormSet, QuestionForm, ModeratorSignUpForm
-from ..models import Answer, Question, Quiz, User
+from ..exports import (ANSWER_COLUMNS, EXPORT_FORMATS, RESULT_COLUMNS,
+                       answer_rows, result_rows)
+from ..forms import (AnswerFormSet, BulkAnswerFormSet, ModeratorSignUpForm,
+                     QuestionForm, QuizImportForm)
+from ..importers import import_quizzes, parse_quiz_file
+from ..jobs import enqueue
+from ..models import (Answer, AnswerStats, Job, Question, QuestionStats, Quiz,
+                      QuizStats, User, Watermark)
+from ..purge import purge_question, soft_delete_quiz
+from ..search import QuizSearchResults
+from ..stats import QUESTION_STATS_WATERMARK
 
 
 class ModeratorSignUpView(CreateView):
@@ -34,22 +49,51 @@ class ModeratorSignUpView(CreateView):
 @method_decorator([login_required, moderator_required], name='dispatch')
 class QuizListView(ListView):
     model = Quiz
-    ordering = ('name', )
+    read_from_replica = True
+    orderings = {
+        'name': ('name', 'pk'),
+        'popular': ('-taken_count', 'name', 'pk'),
+    }
     context_object_name = 'quizzes'
     template_name = 'account/moderators/quiz_change_list.html'
 
     def get_queryset(self):
-        queryset = self.request.user.quizzes \
-            .select_related('subject') \
-            .annotate(questions_count=Count('questions', distinct=True)) \
-            .annotate(taken_count=Count('taken_quizzes', distinct=True))
+
+        '''
+        Количество вопросов и прохождений читается из счетчиков опроса,
+        без соединений и GROUP BY. Порядок «сначала популярные» идет
+        по индексу `quiz_owner_popular_idx`.
+        '''
+
+        queryset = self.request.user.quizzes.order_by(*self.get_ordering())
+        if self.get_search_query():
+            return QuizSearchResults(queryset, self.get_search_query())
         return queryset
 
+    def get_order(self):
+        order = self.request.GET.get('order')
+        return order if order in self.orderings else 'name'
+
+    def get_ordering(self):
+        return self.orderings[self.get_order()]
+
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_paginate_by(self, queryset):
+        # Постранично выводятся только результаты поиска.
+        return settings.SEARCH_PAGE_SIZE if self.get_search_query() else None
+
+    def get_context_data(self, **kwargs):
+        kwargs['query'] = self.get_search_query()
+        kwargs['order'] = self.get_order()
+        return super().get_context_data(**kwargs)
+
 
 @method_decorator([login_required, moderator_required], name='dispatch')
 class QuizCreateView(CreateView):
     model = Quiz
-    fields = ('name', 'start_date', 'end_date', 'is_active', 'subject', )
+    fields = ('name', 'start_date', 'end_date', 'is_active', 'single_page', 'subject', )
     template_name = 'account/moderators/quiz_add_form.html'
 
     def form_valid(self, form):
@@ -63,7 +107,7 @@ class QuizCreateView(CreateView):
 @method_decorator([login_required, moderator_required], name='dispatch')
 class QuizUpdateView(UpdateView):
     model = Quiz
-    fields = ('name', 'subject', )
+    fields = ('name', 'subject', 'single_page', )
     context_object_name = 'quiz'
     template_name = 'account/moderators/quiz_change_form.html'
 
@@ -85,10 +129,14 @@ class QuizDeleteView(DeleteView):
     template_name = 'account/moderators/quiz_delete_confirm.html'
     success_url = reverse_lazy('moderators:quiz_change_list')
 
-    def delete(self, request, *args, **kwargs):
-        quiz = self.get_object()
-        messages.success(request, 'The quiz %s was deleted with success!' % quiz.name)
-        return super().delete(request, *args, **kwargs)
+    def form_valid(self, form):
+        # Опрос скрывается сразу, а строки удаляет задача purge_quiz пакетами.
+        quiz = self.object
+        with transaction.atomic():
+            soft_delete_quiz(quiz)
+            enqueue('purge_quiz', owner=self.request.user, quiz_id=quiz.pk)
+        messages.success(self.request, f'Опрос {quiz.name} успешно удален!')
+        return redirect(self.get_success_url())
 
     def get_queryset(self):
         return self.request.user.quizzes.all()
@@ -97,26 +145,187 @@ class QuizDeleteView(DeleteView):
 @method_decorator([login_required, moderator_required], name='dispatch')
 class QuizResultsView(DetailView):
     model = Quiz
+    read_from_replica = True
     context_object_name = 'quiz'
     template_name = 'account/moderators/quiz_results.html'
 
     def get_context_data(self, **kwargs):
-        quiz = self.get_object()
+        quiz = self.object
         taken_quizzes = quiz.taken_quizzes.select_related('respondent__user').order_by('-date')
-        total_taken_quizzes = taken_quizzes.count()
-        quiz_score = quiz.taken_quizzes.aggregate(average_score=Avg('score'))
+        try:
+            stats = quiz.stats
+        except QuizStats.DoesNotExist:
+            stats = QuizStats(quiz=quiz)
         extra_context = {
             'taken_quizzes': taken_quizzes,
-            'total_taken_quizzes': total_taken_quizzes,
-            'quiz_score': quiz_score
+            'total_taken_quizzes': stats.attempts,
+            'quiz_score': {'average_score': stats.average_score},
+            'stats': stats,
+            'histogram': stats.histogram(),
+            'show_archived': self.request.GET.get('archived') == '1',
         }
+        if extra_context['show_archived']:
+            extra_context['archived_quizzes'] = quiz.archived_taken_quizzes \
+                .select_related('respondent__user') \
+                .order_by('-date')
         kwargs.update(extra_context)
         return super().get_context_data(**kwargs)
 
+    def get_queryset(self):
+        return self.request.user.quizzes.select_related('stats')
+
+
+@method_decorator([login_required, moderator_required], name='dispatch')
+class QuizAnalyticsView(DetailView):
+
+    '''
+    Аналитика по вопросам: доля правильных ответов, распределение
+    выбранных вариантов и индекс дискриминации. Данные берутся из
+    материализованной статистики, которую обновляет команда
+    `refresh_question_stats`, поэтому страница не агрегирует ответы.
+    '''
+
+    model = Quiz
+    read_from_replica = True
+    context_object_name = 'quiz'
+    template_name = 'account/moderators/quiz_analytics.html'
+
+    def get_context_data(self, **kwargs):
+        content = get_quiz_content(self.object.pk)
+        question_stats = QuestionStats.objects.in_bulk([question.pk for question in content.questions])
+        answer_counts = dict(AnswerStats.objects
+                             .filter(pk__in=[answer.pk for question in content.questions for answer in question.answers])
+                             .values_list('pk', 'count'))
+        questions = []
+        for question in content.questions:
+            stats = question_stats.get(question.pk) or QuestionStats(question_id=question.pk)
+            answers = []
+            for answer in question.answers:
+                count = answer_counts.get(answer.pk, 0)
+                percent = round(count / stats.answered * 100, 1) if stats.answered else None
+                answers.append({'answer': answer, 'count': count, 'percent': percent})
+            questions.append({'question': question, 'stats': stats, 'answers': answers})
+        kwargs['questions'] = questions
+        kwargs['watermark'] = Watermark.objects.filter(name=QUESTION_STATS_WATERMARK).first()
+        return super().get_context_data(**kwargs)
+
     def get_queryset(self):
         return self.request.user.quizzes.all()
 
 
+@login_required
+@moderator_required
+def quiz_import(request):
+    if request.method == 'POST':
+        form = QuizImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                quizzes = import_quizzes(parse_quiz_file(upload.read(), upload.name), request.user)
+            except ValidationError as e:
+                form.add_error('file', e)
+            else:
+                messages.success(request, f'Импортировано опросов: {len(quizzes)}.')
+                return redirect('moderators:quiz_change_list')
+    else:
+        form = QuizImportForm()
+
+    return render(request, 'account/moderators/quiz_import_form.html', {'form': form})
+
+
+# Фоновые задачи, которые модератор запускает для своего опроса:
+# имя задачи -> параметры для опроса.
+QUIZ_JOBS = {
+    'rebuild_quiz_stats': lambda quiz: {'quiz_ids': [quiz.pk]},
+    'refresh_question_stats': lambda quiz: {},
+}
+
+
+@login_required
+@moderator_required
+@require_POST
+def quiz_job_start(request, pk, name):
+
+    '''
+    Ставит тяжелую операцию по опросу в очередь `run_workers` вместо
+    выполнения в запросе и перенаправляет на страницу статуса задачи.
+    '''
+
+    quiz = get_object_or_404(Quiz, pk=pk, owner=request.user)
+    if name not in QUIZ_JOBS:
+        raise Http404('Неизвестная задача.')
+    job = enqueue(name, owner=request.user, unique=True, **QUIZ_JOBS[name](quiz))
+    return redirect('moderators:job_detail', job.pk)
+
+
+@method_decorator([login_required, moderator_required], name='dispatch')
+class JobListView(ListView):
+    model = Job
+    context_object_name = 'jobs'
+    template_name = 'account/moderators/job_list.html'
+
+    def get_queryset(self):
+        return self.request.user.jobs.order_by('-pk')[:50]
+
+
+@method_decorator([login_required, moderator_required], name='dispatch')
+class JobDetailView(DetailView):
+    model = Job
+    context_object_name = 'job'
+    template_name = 'account/moderators/job_detail.html'
+
+    def get_queryset(self):
+        return self.request.user.jobs.all()
+
+
+@login_required
+@moderator_required
+def job_status(request, pk):
+
+    '''
+    Статус задачи в JSON для опроса страницы задачи.
+    '''
+
+    job = get_object_or_404(Job, pk=pk, owner=request.user)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'finished': job.is_finished,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error_message,
+        'metrics': job.metrics,
+    })
+
+
+@login_required
+@moderator_required
+def quiz_results_export(request, pk):
+
+    '''
+    Потоковая выгрузка результатов опроса в CSV или NDJSON
+    (`?format=csv|ndjson`). С параметром `?data=answers` выгружаются
+    ответы респондентов на каждый вопрос. Строки читаются из базы
+    порциями и сразу отдаются клиенту, поэтому расход памяти
+    не зависит от количества прохождений.
+    '''
+
+    quiz = get_object_or_404(Quiz, pk=pk, owner=request.user)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise Http404('Неизвестный формат выгрузки.')
+    content_type, stream = EXPORT_FORMATS[export_format]
+
+    if request.GET.get('data') == 'answers':
+        filename, columns, rows = 'answers', ANSWER_COLUMNS, answer_rows(quiz)
+    else:
+        filename, columns, rows = 'results', RESULT_COLUMNS, result_rows(quiz)
+
+    response = StreamingHttpResponse(stream(columns, rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="quiz-{quiz.pk}-{filename}.{export_format}"'
+    return response
+
+
 @login_required
 @moderator_required
 def question_add(request, pk):
@@ -136,6 +345,7 @@ def question_add(request, pk):
             question = form.save(commit=False)
             question.quiz = quiz
             question.save()
+            transaction.on_commit(lambda: invalidate_quiz_content(quiz.pk))
             messages.success(request, 'Теперь вы можете добавить ответы/варианты к вопросу.')
             return redirect('moderators:question_change', quiz.pk, question.pk)
     else:
@@ -161,17 +371,6 @@ def question_change(request, quiz_pk, question_pk):
     quiz = get_object_or_404(Quiz, pk=quiz_pk, owner=request.user)
     question = get_object_or_404(Question, pk=question_pk, quiz=quiz)
 
-    AnswerFormSet = inlineformset_factory(
-        Question,  # parent model
-        Answer,  # base model
-        formset=BaseAnswerInlineFormSet,
-        fields=('text', 'is_correct'),
-        min_num=2,
-        validate_min=True,
-        max_num=10,
-        validate_max=True
-    )
-
     if request.method == 'POST':
         form = QuestionForm(request.POST, instance=question)
         formset = AnswerFormSet(request.POST, instance=question)
@@ -179,6 +378,9 @@ def question_change(request, quiz_pk, question_pk):
             with transaction.atomic():
                 form.save()
                 formset.save()
+                if changes_scores(formset.forms):
+                    schedule_rescoring(quiz.pk, request.user)
+                transaction.on_commit(lambda: invalidate_quiz_content(quiz.pk))
             messages.success(request, 'Вопросы и ответы успешно сохранены!')
             return redirect('moderators:quiz_change', quiz.pk)
     else:
@@ -193,6 +395,85 @@ def question_change(request, quiz_pk, question_pk):
     })
 
 
+def changes_scores(answer_forms):
+    # Баллы зависят от правильности выбранных ответов; удаление ответа
+    # удаляет и ответы респондентов, которые его выбрали.
+    return any(
+        form.instance.pk is not None and ('is_correct' in form.changed_data or form.cleaned_data.get('DELETE'))
+        for form in answer_forms
+    )
+
+
+def schedule_rescoring(quiz_id, user):
+    enqueue('recompute_scores', owner=user, unique=True, quiz_ids=[quiz_id])
+
+
+def save_question_editors(quiz, editors, user):
+
+    '''
+    Сохраняет только измененные строки массового редактора: вопросы
+    и ответы пакетами `bulk_update`/`bulk_create`, удаленные ответы —
+    одним запросом, всё в одной транзакции. Возвращает количество
+    измененных строк. Если изменились правильные ответы, ставит в очередь
+    пересчет баллов опроса.
+    '''
+
+    questions, created, updated, deleted = [], [], [], []
+    rescore = any(changes_scores(formset.forms) for _, formset in editors)
+    for form, formset in editors:
+        if form.has_changed():
+            questions.append(form.instance)
+        deleted_forms = formset.deleted_forms
+        for answer_form in formset.forms:
+            if answer_form in deleted_forms:
+                if answer_form.instance.pk is not None:
+                    deleted.append(answer_form.instance.pk)
+            elif answer_form.has_changed():
+                (created if answer_form.instance.pk is None else updated).append(answer_form.instance)
+
+    with transaction.atomic():
+        Question.objects.bulk_update(questions, ['text'], batch_size=500)
+        Answer.objects.bulk_update(updated, ['text', 'is_correct'], batch_size=500)
+        Answer.objects.bulk_create(created, batch_size=500)
+        if deleted:
+            Answer.objects.filter(pk__in=deleted).delete()
+        if rescore:
+            schedule_rescoring(quiz.pk, user)
+        transaction.on_commit(lambda: invalidate_quiz_content(quiz.pk))
+    return len(questions) + len(created) + len(updated) + len(deleted)
+
+
+@login_required
+@moderator_required
+def questions_bulk_change(request, pk):
+
+    '''
+    Все вопросы опроса с ответами на одной странице. Ответы всех вопросов
+    загружаются одним запросом, формы не обращаются к базе при проверке,
+    а сохраняются только измененные строки (см. `save_question_editors`).
+    '''
+
+    quiz = get_object_or_404(Quiz, pk=pk, owner=request.user)
+    questions = list(quiz.questions.order_by('pk'))
+    answers = defaultdict(list)
+    for answer in Answer.objects.filter(question__quiz=quiz).order_by('pk'):
+        answers[answer.question_id].append(answer)
+
+    data = request.POST if request.method == 'POST' else None
+    editors = [
+        (QuestionForm(data, instance=question, prefix=f'question-{question.pk}'),
+         BulkAnswerFormSet(data, instance=question, prefix=f'answers-{question.pk}', answers=answers[question.pk]))
+        for question in questions
+    ]
+    # Проверяются все формы, чтобы показать все ошибки сразу.
+    if data is not None and all([form.is_valid() & formset.is_valid() for form, formset in editors]):
+        changed = save_question_editors(quiz, editors, request.user)
+        messages.success(request, f'Изменения сохранены (строк: {changed}).')
+        return redirect('moderators:quiz_change', quiz.pk)
+
+    return render(request, 'account/moderators/questions_bulk_form.html', {'quiz': quiz, 'editors': editors})
+
+
 @method_decorator([login_required, moderator_required], name='dispatch')
 class QuestionDeleteView(DeleteView):
     model = Question
@@ -205,14 +486,17 @@ class QuestionDeleteView(DeleteView):
         kwargs['quiz'] = question.quiz
         return super().get_context_data(**kwargs)
 
-    def delete(self, request, *args, **kwargs):
-        question = self.get_object()
-        messages.success(request, f'Вопрос {question.text} успешно удален!')
-        return super().delete(request, *args, **kwargs)
+    def form_valid(self, form):
+        # Ответы респондентов удаляются пакетами, без загрузки в память.
+        question = self.object
+        purge_question(question.pk)
+        schedule_rescoring(question.quiz_id, self.request.user)
+        invalidate_quiz_content(question.quiz_id)
+        messages.success(self.request, f'Вопрос {question.text} успешно удален!')
+        return redirect(self.get_success_url())
 
     def get_queryset(self):
-        return Question.objects.filter(quiz__owner=self.request.user)
+        return Question.objects.filter(quiz__owner=self.request.user, quiz__deleted_at__isnull=True)
 
     def get_success_url(self):
-        question = self.get_object()
-        return reverse('moderators:quiz_change', kwargs={'pk': question.quiz_id})
+        return reverse('moderators:quiz_change', kwargs={'pk': self.object.quiz_id})
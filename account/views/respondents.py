@@ -1,17 +1,22 @@
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
-from django.db.models import Count
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views.generic import CreateView, ListView, UpdateView
 from django.views.decorators.csrf import csrf_protect
 
+from ..cache import aget_quiz_rows, get_quiz_content, get_quiz_rows, subjects
 from ..decorators import respondent_required
 from ..forms import RespondentCategoryForm, RespondentSignUpForm, TakeQuizForm
-from ..models import Quiz, Respondent, TakenQuiz, User
+from ..models import (ArchivedTakenQuiz, Quiz, QuizAttempt, Respondent,
+                      TakenQuiz, User)
+from ..pagination import KeysetPaginationMixin
+from ..search import QuizSearchResults
 
 
 class RespondentSignUpView(CreateView):
@@ -44,36 +49,196 @@ class RespondentCategoryView(UpdateView):
         return super().form_valid(form)
 
 
-@method_decorator([login_required, respondent_required], name='dispatch')
-class QuizListView(ListView):
+class RespondentHeaderMixin:
+    def get_context_data(self, **kwargs):
+        kwargs['categories'] = self.get_categories()
+        return super().get_context_data(**kwargs)
+
+    def get_categories(self):
+        return subjects.filter(self.get_category_ids())
+
+    def get_category_ids(self):
+        if not hasattr(self, '_category_ids'):
+            self._category_ids = self.request.user.respondent.get_category_ids()
+        return self._category_ids
+
+
+class QuizListMixin(RespondentHeaderMixin, KeysetPaginationMixin):
     model = Quiz
-    ordering = ('name', )
+    read_from_replica = True
+    orderings = {
+        'name': ('name', 'pk'),
+        'popular': ('-taken_count', 'name', 'pk'),
+    }
     context_object_name = 'quizzes'
     template_name = 'account/respondents/quiz_list.html'
 
     def get_queryset(self):
-        respondent = self.request.user.respondent
-        respondent_category = respondent.category.values_list('pk', flat=True)
-        taken_quizzes = respondent.quizzes.values_list('pk', flat=True)
-        queryset = Quiz.objects.filter(subject__in=respondent_category) \
-            .exclude(pk__in=taken_quizzes) \
-            .annotate(questions_count=Count('questions')) \
-            .filter(questions_count__gt=0)
-        return queryset
+
+        '''
+        Строки опросов категорий респондента берутся из общего кэша
+        (см. `get_quiz_rows`), пройденные опросы исключаются поверх него.
+        Кэш отсортирован по названию, другой порядок сортируется здесь же.
+        '''
+
+        rows = get_quiz_rows(self.get_category_ids())
+        if not rows:
+            return []
+        taken = set(TakenQuiz.objects.filter(respondent_id=self.request.user.pk).values_list('quiz_id', flat=True))
+        return self.sort_rows(row for row in rows if row.pk not in taken)
+
+    async def aget_queryset(self):
+        rows = await aget_quiz_rows(self.get_category_ids())
+        if not rows:
+            return []
+        taken = {pk async for pk in TakenQuiz.objects
+                 .filter(respondent_id=self.request.user.pk)
+                 .values_list('quiz_id', flat=True)}
+        return self.sort_rows(row for row in rows if row.pk not in taken)
+
+    def sort_rows(self, rows):
+        if self.get_order() == 'popular':
+            return sorted(rows, key=lambda row: (-row.taken_count, row.name, row.pk))
+        return list(rows)
+
+    def get_order(self):
+        order = self.request.GET.get('order')
+        return order if order in self.orderings else 'name'
+
+    def get_keyset_ordering(self):
+        return self.orderings[self.get_order()]
+
+    def get_context_data(self, **kwargs):
+        kwargs['order'] = self.get_order()
+        return super().get_context_data(**kwargs)
 
 
 @method_decorator([login_required, respondent_required], name='dispatch')
-class TakenQuizListView(ListView):
+class QuizListView(QuizListMixin, ListView):
+    pass
+
+
+class TakenQuizListMixin(RespondentHeaderMixin):
     model = TakenQuiz
+    read_from_replica = True
     context_object_name = 'taken_quizzes'
     template_name = 'account/respondents/taken_quiz_list.html'
 
     def get_queryset(self):
-        queryset = self.request.user.respondent.taken_quizzes \
-            .select_related('quiz', 'quiz__subject') \
+        queryset = TakenQuiz.objects \
+            .filter(respondent_id=self.request.user.pk, quiz__deleted_at__isnull=True) \
+            .select_related('quiz') \
             .order_by('quiz__name')
         return queryset
 
+    async def aget_queryset(self):
+        # QuerySet ленивый и выполняется асинхронно уже в `get`.
+        return self.get_queryset()
+
+    def get_context_data(self, **kwargs):
+        # Архив читается только по запросу; QuerySet ленивый и выполняется
+        # при отрисовке шаблона (и в асинхронной версии тоже).
+        kwargs['show_archived'] = self.request.GET.get('archived') == '1'
+        if kwargs['show_archived']:
+            kwargs['archived_quizzes'] = ArchivedTakenQuiz.objects \
+                .filter(respondent_id=self.request.user.pk, quiz__deleted_at__isnull=True) \
+                .select_related('quiz') \
+                .order_by('quiz__name')
+        return super().get_context_data(**kwargs)
+
+
+@method_decorator([login_required, respondent_required], name='dispatch')
+class TakenQuizListView(TakenQuizListMixin, ListView):
+    pass
+
+
+@method_decorator([login_required, respondent_required], name='dispatch')
+class QuizSearchView(RespondentHeaderMixin, ListView):
+    read_from_replica = True
+    context_object_name = 'quizzes'
+    template_name = 'account/respondents/quiz_search.html'
+
+    def get_queryset(self):
+
+        '''
+        Поиск по открытым и еще не пройденным опросам категорий
+        респондента (см. `account.search`).
+        '''
+
+        taken_quizzes = TakenQuiz.objects.filter(respondent_id=self.request.user.pk).values('quiz_id')
+        queryset = Quiz.objects.open() \
+            .filter(subject_id__in=self.get_category_ids()) \
+            .exclude(pk__in=taken_quizzes) \
+            .filter(questions_count__gt=0)
+        return QuizSearchResults(queryset, self.get_search_query())
+
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_paginate_by(self, queryset):
+        return settings.SEARCH_PAGE_SIZE
+
+    def get_context_data(self, **kwargs):
+        kwargs['query'] = self.get_search_query()
+        return super().get_context_data(**kwargs)
+
+
+def already_taken(request):
+    messages.info(request, 'Вы уже прошли этот опрос.')
+    return redirect('respondents:taken_quiz_list')
+
+
+def finish_attempt(request, quiz, attempt, total_questions):
+    score = attempt.finish(total_questions).score
+    if score < 50.0:
+        messages.warning(request, f'Удачи в следующий раз! Ваш результат за тест {quiz.name} составил {score}.')
+    else:
+        messages.success(request, f'Поздравляем! Вы успешно прошли тест {quiz.name}! Вы набрали {score} очков.')
+    return redirect('respondents:quiz_list')
+
+
+def remaining_questions(content, answered_ids):
+
+    '''
+    Вопросы снимка, на которые респондент еще не ответил, в порядке
+    снимка. Не зависят от того, как модератор менял опрос во время попытки.
+    '''
+
+    return [question for question in content.questions if question.pk not in answered_ids]
+
+
+def quiz_step(quiz, content, remaining):
+
+    '''
+    Вопросы текущего шага попытки и контекст шаблона для них
+    (без формы). Общая часть синхронного и асинхронного `take_quiz`.
+    '''
+
+    total_questions = len(content.questions)
+    progress = 100 - round(((len(remaining) - 1) / total_questions) * 100)
+    if quiz.single_page:
+        # Все оставшиеся вопросы отправляются одной формой и одной транзакцией.
+        questions = remaining
+    else:
+        questions = remaining[:1]
+    return questions, {
+        'quiz': quiz,
+        'question': questions[0],
+        'progress': progress,
+        'is_last_step': len(questions) == len(remaining)
+    }
+
+
+def submit_answers(request, quiz, respondent, attempt, form, remaining, total_questions):
+    with transaction.atomic():
+        if not attempt.advance(len(form.questions), form.correct_count):
+            # На эти вопросы уже ответил параллельный запрос.
+            return redirect('respondents:take_quiz', quiz.pk)
+        form.save(respondent, quiz)
+        if len(form.questions) < len(remaining):
+            return redirect('respondents:take_quiz', quiz.pk)
+        return finish_attempt(request, quiz, attempt, total_questions)
+
 
 @login_required
 @respondent_required
@@ -81,39 +246,31 @@ def take_quiz(request, pk):
     quiz = get_object_or_404(Quiz, pk=pk)
     respondent = request.user.respondent
 
-    if respondent.quizzes.filter(pk=pk).exists():
-        return render(request, 'respondents/taken_quiz.html')
+    if respondent.has_taken(quiz):
+        return already_taken(request)
+
+    content = get_quiz_content(quiz.pk)
+    total_questions = len(content.questions)
+    if not total_questions:
+        # Пустой опрос нельзя пройти: попытка не создается.
+        raise Http404('В опросе нет вопросов.')
 
-    total_questions = quiz.questions.count()
-    unanswered_questions = respondent.get_unanswered_questions(quiz)
-    total_unanswered_questions = unanswered_questions.count()
-    progress = 100 - round(((total_unanswered_questions - 1) / total_questions) * 100)
-    question = unanswered_questions.first()
+    attempt, _ = QuizAttempt.objects.get_or_create(respondent=respondent, quiz=quiz)
+    # Ответы появляются только вместе со сдвигом счетчика попытки.
+    answered_ids = respondent.get_answered_question_ids(quiz) if attempt.position else set()
+    remaining = remaining_questions(content, answered_ids)
+    if not remaining:
+        # Опрос не пуст, значит, респондент уже ответил хотя бы на один
+        # вопрос, а неотвеченные из опроса удалили.
+        return finish_attempt(request, quiz, attempt, total_questions)
 
+    questions, context = quiz_step(quiz, content, remaining)
     if request.method == 'POST':
-        form = TakeQuizForm(question=question, data=request.POST)
+        form = TakeQuizForm(questions=questions, data=request.POST)
         if form.is_valid():
-            with transaction.atomic():
-                respondent_answer = form.save(commit=False)
-                respondent_answer.respondent = respondent
-                respondent_answer.save()
-                if respondent.get_unanswered_questions(quiz).exists():
-                    return redirect('respondents:take_quiz', pk)
-                else:
-                    correct_answers = respondent.quiz_answers.filter(answer__question__quiz=quiz, answer__is_correct=True).count()
-                    score = round((correct_answers / total_questions) * 100.0, 2)
-                    TakenQuiz.objects.create(respondent=respondent, quiz=quiz, score=score)
-                    if score < 50.0:
-                        messages.warning(request, f'Удачи в следующий раз! Ваш результат за тест {quiz.name} составил {score}.')
-                    else:
-                        messages.success(request, f'Поздравляем! Вы успешно прошли тест {quiz.name}! Вы набрали {score} очков.')
-                    return redirect('respondents:quiz_list')
+            return submit_answers(request, quiz, respondent, attempt, form, remaining, total_questions)
     else:
-        form = TakeQuizForm(question=question)
+        form = TakeQuizForm(questions=questions)
 
-    return render(request, 'account/respondents/take_quiz_form.html', {
-        'quiz': quiz,
-        'question': question,
-        'form': form,
-        'progress': progress
-    })
+    context['form'] = form
+    return render(request, 'account/respondents/take_quiz_form.html', context)
@@ -0,0 +1,98 @@
+'''
+Асинхронные версии самых нагруженных страниц респондента для запуска
+под ASGI (см. `survey/asgi.py` и настройку `ASYNC_VIEWS`). Чтение идет
+через асинхронный интерфейс ORM, запись и завершение попытки — одной
+синхронной транзакцией в потоке, шаблоны отрисовываются обработчиком
+`TemplateResponse` тоже в потоке.
+'''
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import aget_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.decorators import classonlymethod
+from django.views.generic import ListView
+
+from ..cache import aget_quiz_content, subjects
+from ..decorators import respondent_required
+from ..forms import TakeQuizForm
+from ..models import Quiz, QuizAttempt, Respondent
+from .respondents import (QuizListMixin, TakenQuizListMixin, already_taken,
+                          finish_attempt, quiz_step, remaining_questions,
+                          submit_answers)
+
+
+async def load_user(request):
+    # Ленивый `request.user` обращается к базе синхронно и в асинхронном
+    # коде недоступен, поэтому заменяем его пользователем из `auser()`.
+    request.user = await request.auser()
+    return request.user
+
+
+class AsyncRespondentListMixin:
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # `method_decorator` не поддерживает асинхронный `dispatch`.
+        return login_required(respondent_required(super().as_view(**initkwargs)))
+
+    async def get(self, request, *args, **kwargs):
+        user = await load_user(request)
+        self._category_ids = await Respondent(pk=user.pk).aget_category_ids()
+        self._categories = await subjects.afilter(self._category_ids)
+
+        queryset = await self.aget_queryset()
+        page_size = self.get_paginate_by(queryset)
+        if page_size:
+            self._page = await self.apaginate_queryset(queryset, page_size)
+            self.object_list = queryset
+        else:
+            self.object_list = [obj async for obj in queryset]
+        return self.render_to_response(self.get_context_data())
+
+    def get_categories(self):
+        return self._categories
+
+    def paginate_queryset(self, queryset, page_size):
+        return self._page
+
+
+class QuizListView(AsyncRespondentListMixin, QuizListMixin, ListView):
+    pass
+
+
+class TakenQuizListView(AsyncRespondentListMixin, TakenQuizListMixin, ListView):
+    pass
+
+
+@login_required
+@respondent_required
+async def take_quiz(request, pk):
+    user = await load_user(request)
+    quiz = await aget_object_or_404(Quiz, pk=pk)
+    respondent = await Respondent.objects.aget(pk=user.pk)
+
+    if await respondent.ahas_taken(quiz):
+        return already_taken(request)
+
+    content = await aget_quiz_content(quiz.pk)
+    total_questions = len(content.questions)
+    if not total_questions:
+        raise Http404('В опросе нет вопросов.')
+
+    attempt, _ = await QuizAttempt.objects.aget_or_create(respondent=respondent, quiz=quiz)
+    answered_ids = await respondent.aget_answered_question_ids(quiz) if attempt.position else set()
+    remaining = remaining_questions(content, answered_ids)
+    if not remaining:
+        return await sync_to_async(finish_attempt)(request, quiz, attempt, total_questions)
+
+    questions, context = quiz_step(quiz, content, remaining)
+    if request.method == 'POST':
+        form = TakeQuizForm(questions=questions, data=request.POST)
+        if form.is_valid():
+            return await sync_to_async(submit_answers)(request, quiz, respondent, attempt, form, remaining, total_questions)
+    else:
+        form = TakeQuizForm(questions=questions)
+
+    context['form'] = form
+    return TemplateResponse(request, 'account/respondents/take_quiz_form.html', context)
@@ -0,0 +1,13 @@
+# Точки входа процессов пула `run_workers`. Процессы запускаются методом
+# spawn и загружают этот модуль до `django.setup()`, поэтому модели
+# импортируются только внутри функций.
+
+
+def setup():
+    import django
+    django.setup()
+
+
+def run_job(job_id):
+    from .jobs import execute_job
+    return execute_job(job_id)
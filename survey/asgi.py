@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'survey.settings')
+# Под ASGI респондентские страницы обслуживают асинхронные представления.
+os.environ.setdefault('SURVEY_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -11,7 +11,9 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from django.contrib.messages import constants as messages
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'account.metrics.RequestMetricsMiddleware',
+    'account.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +63,7 @@ ROOT_URLCONF = 'survey.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'account.metrics.InstrumentedDjangoTemplates',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,16 +78,203 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'survey.wsgi.application'
+ASGI_APPLICATION = 'survey.asgi.application'
+
+# Асинхронные версии страниц респондента (`account.views.respondents_async`).
+# Включается в `survey/asgi.py`: под WSGI они бы только добавили переключений
+# между потоками.
+ASYNC_VIEWS = os.environ.get('SURVEY_ASYNC_VIEWS') == '1'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Параметры берутся из окружения (SURVEY_DB_*), по умолчанию — файл SQLite.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': os.environ.get('SURVEY_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('SURVEY_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'USER': os.environ.get('SURVEY_DB_USER', ''),
+        'PASSWORD': os.environ.get('SURVEY_DB_PASSWORD', ''),
+        'HOST': os.environ.get('SURVEY_DB_HOST', ''),
+        'PORT': os.environ.get('SURVEY_DB_PORT', ''),
+        # Постоянные соединения с проверкой перед повторным использованием.
+        # Под ASGI каждый запрос работает с базой в своем потоке, соединение
+        # переиспользовать некому, поэтому там по умолчанию 0.
+        'CONN_MAX_AGE': int(os.environ.get('SURVEY_DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+}
+
+# Профиль SQLite, применяемый к каждому новому соединению: WAL позволяет
+# читать во время записи, synchronous=NORMAL в режиме WAL не теряет
+# целостность при сбое процесса, mmap и кэш страниц уменьшают чтение с диска.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SURVEY_SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SURVEY_SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SURVEY_SQLITE_CACHE_SIZE', -64000)),  # отрицательное — в КиБ
+    'mmap_size': int(os.environ.get('SURVEY_SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {
+        # Время ожидания блокировки записи (busy timeout), сек.
+        'timeout': float(os.environ.get('SURVEY_SQLITE_BUSY_TIMEOUT', 20)),
+        # Транзакция сразу берет блокировку записи: ожидание укладывается
+        # в busy timeout, а не заканчивается «database is locked» при попытке
+        # превратить чтение в запись посреди транзакции.
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
     }
+
+# Реплика для чтения. Включается переменной SURVEY_DB_REPLICA_NAME; без нее
+# алиас `replica` указывает на ту же базу и не используется. Локально
+# реплику на SQLite обновляет команда `sync_replica`. В тестах у `replica`
+# своя пустая тестовая база.
+REPLICA_DATABASE = 'replica' if os.environ.get('SURVEY_DB_REPLICA_NAME') else None
+
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('SURVEY_DB_REPLICA_NAME', DATABASES['default']['NAME']),
+}
+
+DATABASE_ROUTERS = ['account.routers.ReplicaRouter']
+
+# Сколько секунд после изменяющего запроса клиент читает только с `default`.
+REPLICA_PIN_SECONDS = int(os.environ.get('SURVEY_DB_REPLICA_PIN_SECONDS', 15))
+REPLICA_PIN_COOKIE = 'read_primary'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Кэш должен быть общим для всех процессов (веб-воркеры, run_workers):
+# версии снимков опросов, списков и справочника категорий меняет процесс,
+# обработавший правку, а читают все (SURVEY_CACHE_BACKEND):
+#   file      — файлы в каталоге SURVEY_CACHE_LOCATION (по умолчанию cache/),
+#               общий для процессов одной машины;
+#   redis     — Redis, SURVEY_CACHE_LOCATION — URL (нужен пакет redis);
+#   memcached — memcached, SURVEY_CACHE_LOCATION — host:port (пакет pymemcache);
+#   locmem    — память процесса: только если все запросы и задачи
+#               обслуживает один процесс, иначе остальные процессы
+#               до истечения срока отдают устаревшие снимки.
+CACHE_BACKENDS = {
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+}
+CACHE_BACKEND = os.environ.get('SURVEY_CACHE_BACKEND', 'file')
+CACHE_LOCATION = os.environ.get('SURVEY_CACHE_LOCATION', str(BASE_DIR / 'cache'))
+
+# Тесты очищают кэш перед каждым случаем, поэтому под `manage.py test`
+# кэш всегда локальный: у каждого процесса (и параллельного воркера)
+# свой, а кэш разработчика на диске или в Redis не затрагивается.
+TESTING = sys.argv[1:2] == ['test']
+
+
+def cache_settings(name, max_entries, backend=CACHE_BACKEND):
+    config = {'BACKEND': CACHE_BACKENDS[backend], 'KEY_PREFIX': name}
+    if backend == 'file':
+        config['LOCATION'] = os.path.join(CACHE_LOCATION, name)
+    elif backend == 'locmem':
+        config['LOCATION'] = f'survey-{name}'
+    else:
+        return dict(config, LOCATION=CACHE_LOCATION)
+    # Ограничение количества записей есть только у файлового и локального кэша.
+    config['OPTIONS'] = {'MAX_ENTRIES': max_entries}
+    return config
+
+
+CACHES = {
+    'default': cache_settings('data', 10000, 'locmem' if TESTING else CACHE_BACKEND),
+    # Сессии отдельно от данных: вытеснение снимков опросов
+    # не должно разлогинивать пользователей.
+    'sessions': cache_settings('sessions', 10000, 'locmem' if TESTING else CACHE_BACKEND),
+}
+
+# Время жизни снимка содержимого опроса (вопросы и ответы) в кэше, сек.
+QUIZ_CONTENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Время жизни справочника категорий с готовыми бейджами в кэше, сек.
+SUBJECT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Время жизни готовых строк списка опросов для набора категорий, сек.
+# Ключ включает дату, поэтому дольше суток строки не нужны.
+QUIZ_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Размер порции строк при потоковой выгрузке результатов.
+EXPORT_CHUNK_SIZE = 2000
+
+# Поиск опросов: сколько лучших совпадений ранжируется и размер страницы.
+SEARCH_MAX_RESULTS = 1000
+SEARCH_PAGE_SIZE = 20
+
+# Массовый редактор вопросов отправляет до ~45 полей на вопрос
+# (ответы, признаки и служебные поля наборов форм).
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
+
+# Сколько ключей прохождений обрабатывает один пакет refresh_question_stats.
+QUESTION_STATS_BATCH_SIZE = 5000
+
+# Сколько респондентов пересчитывает одна транзакция recompute_scores.
+SCORE_RECOMPUTE_BATCH_SIZE = 1000
+
+# Сколько строк удаляет одна транзакция при очистке опроса или вопроса.
+PURGE_BATCH_SIZE = 2000
+
+# Сколько прохождений переносит в архив одна транзакция archive_attempts.
+ARCHIVE_BATCH_SIZE = 500
+
+# Фоновые задачи (`manage.py run_workers`): размер пула процессов, пауза
+# между проверками пустой очереди, сек., число попыток и базовая задержка
+# повтора, сек. (удваивается с каждой попыткой). Задача, которая
+# выполняется дольше JOB_TIMEOUT, сек., считается зависшей.
+JOB_WORKERS = int(os.environ.get('SURVEY_JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = 1.0
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_TIMEOUT = 60 * 30
+
+
+# Request metrics
+
+# Бюджеты запросов по имени URL: количество SQL-запросов и время, мс
+# (`db_ms`, `view_ms`, `template_ms`, `total_ms`). Превышение пишется
+# в лог `account.metrics` с уровнем WARNING.
+REQUEST_BUDGETS = {
+    'respondents:quiz_list': {'queries': 10, 'total_ms': 300},
+    'respondents:take_quiz': {'queries': 30, 'total_ms': 300},
+    'respondents:taken_quiz_list': {'queries': 8, 'total_ms': 300},
+    'moderators:quiz_change_list': {'queries': 8, 'total_ms': 300},
+    'moderators:quiz_results': {'queries': 10, 'total_ms': 500},
+    'moderators:quiz_analytics': {'queries': 10, 'total_ms': 300},
+    'moderators:job_status': {'queries': 4, 'total_ms': 100},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'account.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('SURVEY_METRICS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'account.jobs': {
+            'handlers': ['console'],
+            'level': os.environ.get('SURVEY_JOBS_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
 
 
@@ -138,8 +329,46 @@ LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
 
+# Sessions
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/
+
+# Хранилище сессий (SURVEY_SESSION_STORAGE). Хранилища `account.sessions`
+# не перезаписывают сессию, если ее данные не изменились.
+#   db             — только таблица django_session;
+#   cached_db      — чтение из кэша, запись в кэш и в базу;
+#   cache          — только кэш, без базы: вытесненная из кэша сессия
+#                    теряется, и пользователь выходит из системы;
+#   signed_cookies — данные в подписанной cookie, без базы и кэша.
+# cached_db и cache требуют общего для процессов кэша (file в пределах
+# одной машины, redis, memcached), поэтому с locmem настройки
+# не загружаются: выход или смена ключа сессии в одном процессе
+# не были бы видны остальным.
+SESSION_STORAGES = {
+    'db': 'account.sessions.db',
+    'cached_db': 'account.sessions.cached_db',
+    'cache': 'account.sessions.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_STORAGE = os.environ.get('SURVEY_SESSION_STORAGE', 'db')
+if SESSION_STORAGE in ('cached_db', 'cache') and CACHE_BACKEND == 'locmem':
+    raise ImproperlyConfigured(
+        f'SURVEY_SESSION_STORAGE={SESSION_STORAGE} требует общего кэша: '
+        'задайте SURVEY_CACHE_BACKEND (file, redis или memcached).')
+SESSION_ENGINE = SESSION_STORAGES[SESSION_STORAGE]
+SESSION_CACHE_ALIAS = 'sessions'
+
+
 # Messages built-in framework
 
+# Хранилище сообщений (SURVEY_MESSAGE_STORAGE): cookie и fallback
+# (cookie, а при переполнении — сессия) не пишут в сессию.
+MESSAGE_STORAGES = {
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+}
+MESSAGE_STORAGE = MESSAGE_STORAGES[os.environ.get('SURVEY_MESSAGE_STORAGE', 'fallback')]
+
 MESSAGE_TAGS = {
     messages.DEBUG: 'alert-secondary',
     messages.INFO: 'alert-info',